@@ -0,0 +1,71 @@
+"""
+Detection parity check for annotation compaction.
+
+    python benchmarks/compaction_parity.py                       # every game in data/annotations
+    python benchmarks/compaction_parity.py --search-end 600      # only the first 10 minutes
+
+Runs Talk2Video.look_for_event over each sample game twice, once with the raw annotation windows and once
+with compacted ones (utils/annotation_compact.py), and reports the context tokens of both runs and whether
+the detected timestamps are the same. Exits non-zero if any game differs.
+
+LLM calls go through utils.llama_api.make_client, so LLAMA_TRANSPORT=record/replay and
+LLAMA_API_CLIENT_BASE_URL work as usual. Answers can vary between identical calls, so rerun a game that
+differs in a single window before putting it down to compaction.
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.talk2Video import Talk2Video
+from core.live import SHOOTING_FOUL_EVENT
+from utils.llama_api import make_client
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def sample_games(annotations_dir: str) -> list:
+    """Frame annotation files of the sample games (the *_audio.json transcripts are part of them)."""
+    return sorted(path for path in glob.glob(os.path.join(annotations_dir, '*_annotations.json')))
+
+
+def detect(annotations_path: str, client, compact: bool, event: str, window_length: int, search_end: float) -> dict:
+    name = os.path.basename(annotations_path).replace('_annotations.json', '')
+    t2v = Talk2Video(os.path.join('data', 'video', f'{name}.mp4'), client=client, compact_context=compact)
+    t2v.load_annotations(annotations_path)
+    # Both runs of a game share its job metrics, so count the difference
+    counters = ('context_tokens_raw', 'context_tokens_sent', 'prompt_tokens')
+    before = t2v.metrics.summary()
+    hits, _ = t2v.look_for_event(event, window_length=window_length, search_end=search_end)
+    after = t2v.metrics.summary()
+    return {'hits': sorted(hits), **{name: after[name] - before[name] for name in counters}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--annotations-dir', default=os.path.join(REPO_ROOT, 'data', 'annotations'))
+    parser.add_argument('--event', default=SHOOTING_FOUL_EVENT)
+    parser.add_argument('--window-length', type=int, default=5)
+    parser.add_argument('--search-end', type=float, default=float('inf'))
+    args = parser.parse_args()
+
+    client = make_client()
+    mismatches = 0
+    for path in sample_games(args.annotations_dir):
+        raw = detect(path, client, False, args.event, args.window_length, args.search_end)
+        compact = detect(path, client, True, args.event, args.window_length, args.search_end)
+        same = raw['hits'] == compact['hits']
+        mismatches += not same
+        print(json.dumps({
+            'annotations': os.path.relpath(path, REPO_ROOT),
+            'same_detections': same,
+            'raw_hits': raw['hits'],
+            'compact_hits': compact['hits'],
+            'context_tokens_raw': raw['context_tokens_sent'],
+            'context_tokens_compact': compact['context_tokens_sent'],
+            'reduction': round(1 - compact['context_tokens_sent'] / raw['context_tokens_sent'], 3)
+            if raw['context_tokens_sent'] else 0.0,
+        }))
+    sys.exit(1 if mismatches else 0)
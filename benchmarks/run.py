@@ -0,0 +1,360 @@
+"""
+Benchmark suite for the annotation and referee pipelines.
+
+    python benchmarks/run.py                      # run everything, write benchmarks/results/<commit>.json
+    python benchmarks/run.py -k annotations       # only scenarios whose name contains 'annotations'
+    python benchmarks/run.py --compare a.json b.json
+
+All inputs are synthetic (see benchmarks/synthetic.py) and LLM calls go to benchmarks/stubs.StubClient,
+so results only depend on this code and the machine, and can be compared across commits.
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import platform
+import argparse
+import statistics
+import subprocess
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks import synthetic
+from benchmarks.stubs import StubClient
+
+SCENARIOS = {}
+
+
+def scenario(name: str, repeat: int = 3):
+    """Registers a benchmark. The function receives the shared context and may return extra metrics."""
+    def register(fn):
+        SCENARIOS[name] = (fn, repeat)
+        return fn
+    return register
+
+
+class Context:
+    """Lazily generated synthetic inputs, shared by all scenarios in a run."""
+
+    def __init__(self, workdir: str, video_seconds: int):
+        self.workdir = workdir
+        self.video_seconds = video_seconds
+        self._cache = {}
+
+    def get(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def video_path(self) -> str:
+        return self.get('video', lambda: synthetic.make_video(
+            os.path.join(self.workdir, 'data', 'video', 'synthetic.mp4'), seconds=self.video_seconds))
+
+    def annotations_path(self, seconds: int) -> str:
+        return self.get(('annotations', seconds), lambda: synthetic.write_annotations(
+            os.path.join(self.workdir, 'data', 'annotations', f'synthetic_{seconds}_annotations.json'), seconds))
+
+    def talk2video(self, seconds: int = None):
+        from core.talk2Video import Talk2Video
+        t2v = Talk2Video(self.video_path, client=StubClient())
+        if seconds is not None:
+            t2v.load_annotations(self.annotations_path(seconds))
+        return t2v
+
+    @property
+    def ntsc_video_path(self) -> str:
+        """The synthetic video at 29.97 fps, where seconds_per_frame steps aren't whole numbers of frames."""
+        return self.get('ntsc_video', lambda: synthetic.make_video(
+            os.path.join(self.workdir, 'data', 'video', 'synthetic_ntsc.mp4'), seconds=self.video_seconds,
+            fps=30000 / 1001))
+
+    def referee(self, video_path: str = None):
+        from core.referree import Referee
+        return Referee(video_path or self.video_path, client=StubClient())
+
+
+@scenario('extract_frames')
+def bench_extract_frames(ctx):
+    from utils.video import Video
+    frames = Video(ctx.video_path, client=StubClient()).extract_frames(seconds_per_frame=1)
+    return {'frames': len(frames), 'video_seconds': ctx.video_seconds}
+
+
+@scenario('cut_frames')
+def bench_cut_frames(ctx):
+    from utils.video import Video
+    frames = Video(ctx.video_path, client=StubClient()).cut_frames(10, 14, seconds_per_frame=0.2)
+    return {'frames': len(frames)}
+
+
+@scenario('extract_frames_ffmpeg')
+def bench_extract_frames_ffmpeg(ctx):
+    from utils.video import Video
+    frames = Video(ctx.video_path, client=StubClient()).extract_frames(seconds_per_frame=1, backend='ffmpeg')
+    return {'frames': len(frames), 'video_seconds': ctx.video_seconds}
+
+
+@scenario('cut_frames_ffmpeg')
+def bench_cut_frames_ffmpeg(ctx):
+    from utils.video import Video
+    frames = Video(ctx.video_path, client=StubClient()).cut_frames(10, 14, seconds_per_frame=0.2, backend='ffmpeg')
+    return {'frames': len(frames)}
+
+
+@scenario('decode_opencv')
+def bench_decode_opencv(ctx):
+    from utils.video import Video
+    started = time.perf_counter()
+    frames = sum(1 for _ in Video(ctx.video_path, client=StubClient()).iter_frames(seconds_per_frame=0.2))
+    return {'frames': frames, 'frames_per_second': frames / (time.perf_counter() - started)}
+
+
+@scenario('decode_ffmpeg')
+def bench_decode_ffmpeg(ctx):
+    from utils.ffmpeg_decoder import FFmpegDecoder
+    started = time.perf_counter()
+    frames = sum(1 for _ in FFmpegDecoder(ctx.video_path).frames_between(0, None, seconds_per_frame=0.2))
+    return {'frames': frames, 'frames_per_second': frames / (time.perf_counter() - started)}
+
+
+def _decoded_frames(ctx) -> list:
+    from utils.video import Video
+    return ctx.get('decoded_frames', lambda: [
+        (seconds, frame.copy()) for seconds, frame in
+        Video(ctx.video_path, client=StubClient()).iter_frames(seconds_per_frame=0.2)])
+
+
+def _encode_only(ctx, workers: int = 0, mode: str = 'thread') -> dict:
+    from utils.encode_pool import EncodePool, _encode
+    frames = _decoded_frames(ctx)
+    started = time.perf_counter()
+    if workers:
+        with EncodePool(workers, mode) as pool:
+            encoded = sum(1 for _ in pool.encode(frames))
+    else:
+        encoded = sum(1 for _ in (_encode(frame) for _, frame in frames))
+    return {'frames': encoded, 'frames_per_second': encoded / (time.perf_counter() - started)}
+
+
+@scenario('encode_inline')
+def bench_encode_inline(ctx):
+    return _encode_only(ctx)
+
+
+@scenario('encode_threads')
+def bench_encode_threads(ctx):
+    return _encode_only(ctx, workers=4)
+
+
+@scenario('encode_processes')
+def bench_encode_processes(ctx):
+    return _encode_only(ctx, workers=4, mode='process')
+
+
+@scenario('decode_encode_inline')
+def bench_decode_encode_inline(ctx):
+    from utils.video import Video
+    started = time.perf_counter()
+    frames = Video(ctx.video_path, client=StubClient()).cut_frames(0, ctx.video_seconds, seconds_per_frame=0.2)
+    return {'frames': len(frames), 'frames_per_second': len(frames) / (time.perf_counter() - started)}
+
+
+@scenario('decode_encode_threads')
+def bench_decode_encode_threads(ctx):
+    from utils.video import Video
+    started = time.perf_counter()
+    frames = Video(ctx.video_path, client=StubClient()).cut_frames(0, ctx.video_seconds, seconds_per_frame=0.2,
+                                                                   encode_workers=4)
+    return {'frames': len(frames), 'frames_per_second': len(frames) / (time.perf_counter() - started)}
+
+
+@scenario('decode_encode_ffmpeg_threads')
+def bench_decode_encode_ffmpeg_threads(ctx):
+    from utils.video import Video
+    started = time.perf_counter()
+    frames = Video(ctx.video_path, client=StubClient()).cut_frames(0, ctx.video_seconds, seconds_per_frame=0.2,
+                                                                   backend='ffmpeg', encode_workers=4)
+    return {'frames': len(frames), 'frames_per_second': len(frames) / (time.perf_counter() - started)}
+
+
+@scenario('describe_frames')
+def bench_describe_frames(ctx):
+    from utils.video import Video
+    vid = Video(ctx.video_path, client=StubClient())
+    frames = ctx.get('frame_dict', lambda: vid.extract_frames(seconds_per_frame=1))
+    vid.describe_frames(dict(frames), threads=10)
+    return {'frames': len(frames)}
+
+
+@scenario('load_annotations_20min')
+def bench_load_annotations_20min(ctx):
+    t2v = ctx.talk2video(synthetic.TWENTY_MINUTES)
+    return {'annotations': len(t2v.annotations)}
+
+
+@scenario('load_annotations_full_game')
+def bench_load_annotations_full_game(ctx):
+    t2v = ctx.talk2video(synthetic.FULL_GAME)
+    return {'annotations': len(t2v.annotations)}
+
+
+@scenario('chunk_annotations_full_game')
+def bench_chunk_annotations_full_game(ctx):
+    t2v = ctx.talk2video(synthetic.FULL_GAME)
+    chunks = t2v.chunk_annotations(t2v.simple_annotations, token_limit=120000)
+    return {'chunks': len(chunks)}
+
+
+@scenario('look_for_event_20min', repeat=1)
+def bench_look_for_event_20min(ctx):
+    t2v = ctx.talk2video(synthetic.TWENTY_MINUTES)
+    hits, _ = t2v.look_for_event("Contact on the shooter's arm", window_length=5)
+    return {'hits': len(hits), 'requests': t2v.llama_api.client.calls}
+
+
+@scenario('look_for_events_20min', repeat=1)
+def bench_look_for_events_20min(ctx):
+    t2v = ctx.talk2video(synthetic.TWENTY_MINUTES)
+    timeline, _ = t2v.look_for_events({
+        'shooting_foul': "Contact on the shooter's arm",
+        'travel': "The ball handler takes more than two steps without dribbling",
+        'out_of_bounds': "The ball or the ball handler goes out of bounds",
+    }, window_length=5)
+    return {'hits': sum(len(v) for v in timeline.values()), **{f'hits_{k}': len(v) for k, v in timeline.items()},
+            'requests': t2v.llama_api.client.calls}
+
+
+@scenario('look_for_event_budget_20min', repeat=1)
+def bench_look_for_event_budget_20min(ctx):
+    from core.talk2Video import Talk2Video
+    from utils.llama_api import BudgetGovernor
+    governor = BudgetGovernor(max_requests=100)
+    t2v = Talk2Video(ctx.video_path, client=governor.wrap(StubClient()))
+    t2v.load_annotations(ctx.annotations_path(synthetic.TWENTY_MINUTES))
+    hits, unchecked = t2v.look_for_event("Contact on the shooter's arm", window_length=5)
+    return {'hits': len(hits), 'unchecked': len(unchecked), 'requests': governor.used['requests']}
+
+
+@scenario('look_for_event_intervals_20min', repeat=1)
+def bench_look_for_event_intervals_20min(ctx):
+    t2v = ctx.talk2video(synthetic.TWENTY_MINUTES)
+    intervals, unchecked = t2v.look_for_event_intervals("Contact on the shooter's arm", coarse_window=60,
+                                                         target_resolution=2)
+    return {'intervals': len(intervals), 'unchecked': len(unchecked), 'requests': t2v.llama_api.client.calls}
+
+
+@scenario('referee_look_into_video', repeat=1)
+def bench_referee_look_into_video(ctx):
+    ref = ctx.referee()
+    ref.look_into_video(12, boundry_seconds=2)
+    return {'requests': ref.talk_to_video.vid.client.calls}
+
+
+def _dense_reviews(ref) -> dict:
+    for timestamp in (10, 11, 12, 12, 13, 14):
+        ref.look_into_video(timestamp, boundry_seconds=2)
+    return {'requests': ref.talk_to_video.vid.client.calls,
+            'group_cache_hits': ref.metrics.counters['group_cache_hits']}
+
+
+@scenario('referee_dense_candidates', repeat=1)
+def bench_referee_dense_candidates(ctx):
+    return _dense_reviews(ctx.referee())
+
+
+@scenario('referee_dense_candidates_ntsc', repeat=1)
+def bench_referee_dense_candidates_ntsc(ctx):
+    return _dense_reviews(ctx.referee(ctx.ntsc_video_path))
+
+
+@scenario('startup_text_judgement', repeat=1)
+def bench_startup_text_judgement(ctx):
+    from benchmarks.startup import measure, TEXT_JUDGEMENT_SNIPPET
+    result = measure(TEXT_JUDGEMENT_SNIPPET, repeat=3)
+    return {'startup_seconds': result['seconds_median'], 'torch_loaded': 'torch' in result['heavy_modules']}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return 'unknown'
+
+
+def run(selected: list, video_seconds: int) -> dict:
+    results = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='bron-bench-') as workdir:
+        # Video/Talk2Video write frames and annotations relative to the working directory
+        os.chdir(workdir)
+        try:
+            ctx = Context(workdir, video_seconds)
+            for name in selected:
+                fn, repeat = SCENARIOS[name]
+                timings = []
+                extra = {}
+                try:
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        extra = fn(ctx) or {}
+                        timings.append(time.perf_counter() - started)
+                except Exception as e:
+                    print(f"{name}: failed: {e}")
+                    results[name] = {'error': str(e)}
+                    continue
+                results[name] = {
+                    'repeat': repeat,
+                    'seconds_min': min(timings),
+                    'seconds_median': statistics.median(timings),
+                    'seconds_mean': statistics.mean(timings),
+                    **extra,
+                }
+                print(f"{name}: median {results[name]['seconds_median']:.4f}s {extra}")
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def compare(old_path: str, new_path: str):
+    old = json.load(open(old_path))
+    new = json.load(open(new_path))
+    print(f"{'scenario':35s} {old['commit']:>12s} {new['commit']:>12s}   change")
+    for name, result in new['results'].items():
+        before = old['results'].get(name, {}).get('seconds_median')
+        after = result.get('seconds_median')
+        if before is None or after is None:
+            print(f"{name:35s} {'-':>12s} {'-':>12s}")
+            continue
+        print(f"{name:35s} {before:12.4f} {after:12.4f}   {100 * (after - before) / before:+.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-k', '--filter', default='', help="only run scenarios containing this string")
+    parser.add_argument('--video-seconds', type=int, default=60, help="length of the synthetic video")
+    parser.add_argument('--output', default=None, help="results file (default benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    selected = [name for name in SCENARIOS if args.filter in name]
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'video_seconds': args.video_seconds,
+        'results': run(selected, args.video_seconds),
+    }
+    output = args.output or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {output}")
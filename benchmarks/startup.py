@@ -0,0 +1,91 @@
+"""
+Startup-time benchmark.
+
+    python benchmarks/startup.py
+
+Measures the wall time of `python -c "import <module>"` for each entry point in a fresh interpreter,
+lists which heavy dependencies got imported, and checks that the text-only judgement path
+(import core.referree, build a Referee, make_judgement on a summary) never imports torch.
+"""
+import os
+import sys
+import json
+import time
+import statistics
+import subprocess
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+ENTRY_POINTS = [
+    'core.referree',
+    'core.talk2Video',
+    'utils.video',
+    'utils.audio',
+    'utils.llama_api',
+    'utils.preproc_db',
+    'utils.motion',
+    'utils.mock_llama_server',
+]
+
+HEAVY_MODULES = ['torch', 'whisperx', 'moviepy', 'cv2', 'numpy', 'llama_api_client', 'httpx', 'pydantic']
+
+# Runs the text-only judgement path against the in-process stub client
+TEXT_JUDGEMENT_SNIPPET = """
+from core.referree import Referee
+from benchmarks.stubs import StubClient
+ref = Referee('unused.mp4', client=StubClient())
+ref.make_judgement('The defender stays vertical and there is no contact.')
+"""
+
+REPORT_SNIPPET = """
+import sys, json
+print(json.dumps([m for m in {heavy!r} if m in sys.modules]))
+"""
+
+
+def _run(code: str) -> tuple:
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=REPO_ROOT, capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    return elapsed, loaded
+
+
+def measure(code: str, repeat: int = 5) -> dict:
+    """Median wall time of running code in a fresh interpreter, plus the heavy modules it loaded."""
+    report = REPORT_SNIPPET.format(heavy=HEAVY_MODULES)
+    timings = []
+    loaded = []
+    for _ in range(repeat):
+        elapsed, loaded = _run(code + "\n" + report)
+        timings.append(elapsed)
+    return {'seconds_median': statistics.median(timings), 'seconds_min': min(timings), 'heavy_modules': loaded}
+
+
+def main(repeat: int = 5) -> dict:
+    results = {'baseline_interpreter': measure('pass', repeat)}
+    for module in ENTRY_POINTS:
+        try:
+            results[f'import {module}'] = measure(f'import {module}', repeat)
+        except RuntimeError as e:
+            results[f'import {module}'] = {'error': str(e)}
+    try:
+        results['text_judgement'] = measure(TEXT_JUDGEMENT_SNIPPET, repeat)
+    except RuntimeError as e:
+        results['text_judgement'] = {'error': str(e)}
+
+    for name, result in results.items():
+        if 'error' in result:
+            print(f"{name:35s} failed: {result['error']}")
+        else:
+            print(f"{name:35s} {result['seconds_median'] * 1000:8.1f} ms  {', '.join(result['heavy_modules'])}")
+
+    torch_free = 'torch' not in results['text_judgement'].get('heavy_modules', ['torch'])
+    print(f"text-only judgement path torch-free: {torch_free}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import os
+import re
+import sys
+import json
+import time
+import math
+import random
+import threading
+from types import SimpleNamespace
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.llama_transport import CompletionStream, stream_chunks, to_namespace
+
+
+class StubClient:
+    """
+    In-process stand-in for LlamaAPIClient with the same chat.completions.create interface.
+    Answers instantly (or after a fixed latency) so benchmarks measure our own overhead.
+    """
+
+    def __init__(self, latency: float = 0.0, yes_rate: float = 0.1, seed: int = 0):
+        self.latency = latency
+        self.yes_rate = yes_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model: str, messages: list, stream: bool = False, **kwargs):
+        prompt = " ".join(
+            m['content'] if isinstance(m['content'], str) else " ".join(i.get('text', '') for i in m['content'])
+            for m in messages
+        )
+        # Multi-event checks (Talk2Video.look_for_events) ask for a {"event": "yes or no"} object
+        answer_format = re.search(r"JSON object in this format: (\{.*?\})", prompt)
+        events = list(json.loads(answer_format.group(1))) if answer_format else []
+        with self.lock:
+            self.calls += 1
+            draw = self.rng.random()
+            event_draws = [self.rng.random() for _ in events]
+        if self.latency:
+            time.sleep(self.latency)
+
+        if events:
+            text = json.dumps({name: "yes" if d < self.yes_rate else "no" for name, d in zip(events, event_draws)})
+        elif "```FOUL```" in prompt:
+            text = "```FOUL```" if draw < 0.5 else "```CLEAN```"
+        elif "'yes'" in prompt:
+            text = "yes" if draw < self.yes_rate else "no"
+        else:
+            text = "The ball handler drives left and the defender stays vertical with arms up."
+
+        response = {
+            'completion_message': {'content': {'type': 'text', 'text': text}, 'stop_reason': 'stop'},
+            'metrics': [
+                {'metric': 'num_prompt_tokens', 'value': math.ceil(len(prompt) / 4)},
+                {'metric': 'num_completion_tokens', 'value': math.ceil(len(text) / 4)},
+            ],
+        }
+        if stream:
+            return CompletionStream(stream_chunks(response))
+        return to_namespace(response)
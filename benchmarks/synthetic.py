@@ -0,0 +1,100 @@
+import os
+import json
+import random
+import cv2
+import numpy as np
+
+# 20 minutes and a full broadcast (~2.5 hours), both sampled at roughly one frame per second like data/annotations
+TWENTY_MINUTES = 20 * 60
+FULL_GAME = 150 * 60
+
+FRAME_SENTENCES = [
+    "The image shows a basketball player in a {offense} jersey dribbling the ball with his {hand} hand while being closely guarded by an opponent in a {defense} jersey.",
+    "The image depicts a player in a {offense} jersey driving towards the basket as a defender in a {defense} jersey slides to stay in front of him.",
+    "The ball handler in the {offense} jersey rises for a jump shot while the defender in the {defense} jersey contests with his {hand} arm extended.",
+    "The image shows players from both teams jostling for position under the basket as a shot goes up.",
+    "The image depicts a replay of the previous possession with a graphic of the score in the corner of the screen.",
+    "In the background, the crowd is visible and the coaches are standing on the sideline watching the play.",
+]
+
+AUDIO_SENTENCES = [
+    " He drives baseline, spins, and gets the foul call.",
+    " Great defense there, stays vertical and forces the miss.",
+    " Timeout on the floor, the home team trails by four.",
+    " That's a tough whistle, the defender looked like he had position.",
+]
+
+
+def make_video(output_path: str, seconds: int = 60, fps: float = 30.0, width: int = 640, height: int = 360,
+               contact_every: float = 6.0, seed: int = 0) -> str:
+    """
+    Writes a synthetic 'game' video: two players moving across a textured court that periodically
+    converge and stop (contact), so decode, encode and motion detection have realistic work to do.
+    """
+    rng = np.random.default_rng(seed)
+    court = np.full((height, width, 3), (60, 120, 180), dtype=np.uint8)
+    court = cv2.add(court, rng.integers(0, 40, size=(height, width, 3), dtype=np.uint8))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    period = int(contact_every * fps)
+    for i in range(int(seconds * fps)):
+        frame = court.copy()
+        phase = (i % period) / period
+        # players approach each other for 60% of the period, then stay in contact
+        approach = min(phase / 0.6, 1.0)
+        y = int(height * (0.4 + 0.2 * np.sin(i / fps)))
+        x_offense = int(width * (0.1 + 0.35 * approach))
+        x_defense = int(width * (0.9 - 0.35 * approach))
+        cv2.circle(frame, (x_offense, y), height // 12, (255, 255, 255), -1)
+        cv2.circle(frame, (x_defense, y), height // 12, (20, 20, 20), -1)
+        cv2.putText(frame, f"{i / fps:07.2f}", (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 1)
+        writer.write(frame)
+    writer.release()
+    return output_path
+
+
+def make_annotations(seconds: int, seconds_per_frame: float = 1.0, audio_every: float = 25.0, seed: int = 0) -> dict:
+    """
+    Builds a compiled annotation dict in the same shape as data/annotations/*_annotations.json:
+    frame annotations keyed by float seconds plus audio segments keyed by their midpoint.
+    """
+    rng = random.Random(seed)
+    # Real keys come from frame_number / fps, e.g. 0.9843170426108717
+    step = seconds_per_frame * 30 / 29.97
+    annotations = {}
+    t = 0.0
+    frame_count = 0
+    while t < seconds:
+        sentence = rng.choice(FRAME_SENTENCES).format(
+            offense=rng.choice(["white", "gold", "blue"]),
+            defense=rng.choice(["dark", "red", "black"]),
+            hand=rng.choice(["left", "right"]),
+        )
+        annotations[str(t)] = {
+            'source': f"synthetic_{frame_count:04d}_{t:.2f}s.jpg",
+            'source_type': 'frame',
+            'annotation': " ".join([sentence] * rng.randint(1, 3)),
+        }
+        frame_count += 1
+        t += step
+
+    start = 0.0
+    while start < seconds:
+        end = start + audio_every * rng.uniform(0.5, 1.2)
+        annotations[str((start + end) / 2)] = {
+            'source': 'synthetic.wav',
+            'source_type': 'audio',
+            'annotation': "".join(rng.choice(AUDIO_SENTENCES) for _ in range(4)),
+            'start': start,
+            'end': end,
+        }
+        start = end
+    return annotations
+
+
+def write_annotations(output_path: str, seconds: int, seed: int = 0) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, 'w') as f:
+        json.dump(make_annotations(seconds, seed=seed), f, indent=2)
+    return output_path
@@ -0,0 +1,97 @@
+import os
+import sys
+import contextvars
+import concurrent.futures
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.verdict_cache import VerdictCache
+
+
+class EnsembleJudge:
+    """
+    Runs several judges on a summary concurrently and combines their verdicts.
+
+    judges: {name: (judge(summary) -> bool or None, version)}, e.g. Referee.judges(); the version is part of the
+        cache key. A judge returns None when it has no answer (invalid or failed output), which is not a vote.
+    samples: votes per judge (int, or {name: int}); a judge stops sampling once a majority is reached.
+    cache: VerdictCache, or None to always ask the judges.
+    """
+
+    def __init__(self, judges: dict, samples=1, cache: VerdictCache = None, threads: int = 8, metrics=None):
+        self.judges = judges
+        self.samples = samples
+        self.cache = cache
+        self.metrics = metrics
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+    def _samples(self, name: str) -> int:
+        return self.samples.get(name, 1) if isinstance(self.samples, dict) else self.samples
+
+    def vote(self, name: str, summary: str) -> dict:
+        """
+        Majority vote of up to n samples from one judge. Only as many samples as could still decide the
+        outcome are in flight, so unanimous judges cost n // 2 + 1 calls. Samples without an answer are left
+        out ('failed' counts them) and the vote is only cached if none failed; with no answers at all the
+        verdict is None.
+        """
+        judge, version = self.judges[name]
+        n = self._samples(name)
+        if self.cache is not None:
+            entry = self.cache.get(summary, name, version, n)
+            if self.metrics is not None:
+                self.metrics.record_cache(entry is not None)
+            if entry is not None:
+                return {'verdict': entry['verdict'], 'votes': entry['votes'], 'failed': 0, 'cached': True}
+
+        majority = n // 2 + 1
+        votes = []
+        failed = 0
+        pending = set()
+        submitted = 0
+        while True:
+            needed = majority - max(votes.count(True), votes.count(False))
+            if needed <= 0 or (submitted == n and not pending):
+                break
+            while len(pending) < needed and submitted < n:
+                pending.add(self.executor.submit(contextvars.copy_context().run, judge, summary))
+                submitted += 1
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Judge {name} failed: {e}")
+                    result = None
+                if result is None:
+                    failed += 1
+                else:
+                    votes.append(bool(result))
+        for future in pending:
+            future.cancel()
+
+        verdict = votes.count(True) > votes.count(False) if votes else None
+        if self.cache is not None and votes and not failed:
+            self.cache.put(summary, name, version, verdict, votes, n)
+        return {'verdict': verdict, 'votes': votes, 'failed': failed, 'cached': False}
+
+    def judge(self, summary: str, judges: list = None) -> dict:
+        """
+        Returns {'verdict': bool, 'judges': {name: {verdict, votes, failed, cached}}}.
+        The ensemble verdict is the majority of the judges' verdicts; a tie goes to the first judge.
+        Judges without an answer are left out, and if none answered the verdict is None.
+        """
+        names = [name for name in self.judges if judges is None or name in judges]
+        # Judges vote on their own threads, their samples share self.executor
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(names))) as pool:
+            futures = {name: pool.submit(contextvars.copy_context().run, self.vote, name, summary) for name in names}
+            results = {name: future.result() for name, future in futures.items()}
+
+        verdicts = [results[name]['verdict'] for name in names if results[name]['verdict'] is not None]
+        if verdicts.count(True) == verdicts.count(False):
+            verdict = verdicts[0] if verdicts else None
+        else:
+            verdict = verdicts.count(True) > verdicts.count(False)
+        return {'verdict': verdict, 'judges': {name: results[name] for name in names}}
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,177 @@
+"""
+Evaluates the referee against labeled timestamps.
+
+    python core/evaluate.py labels.csv --video nba_2016_finals_6.mp4 --output data/eval/finals_6.jsonl
+
+labels.csv has a header with timestamp and foul (true/false, 1/0, FOUL/CLEAN) columns, and optionally a video
+column (relative to --video-root) for sets spanning several games; .jsonl files with the same fields work too.
+Reviews run concurrently and every result is appended to --output as soon as it completes; rerunning the same
+command skips the timestamps already there.
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.review_server import ReviewService, JUDGES
+from utils.instrumentation import REGISTRY, percentile, track_usage
+
+
+def _parse_label(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', '1', 'yes', 'foul', '```foul```')
+
+
+def load_labels(path: str, video: str = None) -> list:
+    """Returns [{video, timestamp, foul}] from a labeled .csv or .jsonl file."""
+    with open(path, 'r') as f:
+        if path.endswith('.jsonl'):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+    labels = []
+    for row in rows:
+        row_video = row.get('video') or video
+        if not row_video:
+            raise ValueError(f"No video for timestamp {row['timestamp']}, pass --video or add a video column")
+        labels.append({'video': row_video, 'timestamp': int(float(row['timestamp'])), 'foul': _parse_label(row['foul'])})
+    return labels
+
+
+def load_results(path: str) -> dict:
+    """Completed results from a previous run, keyed by (video, timestamp). Failed reviews are retried."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                if 'error' not in result:
+                    results[(result['video'], result['timestamp'])] = result
+    return results
+
+
+class Evaluator:
+    """Reviews labeled timestamps through a ReviewService under a concurrency cap and streams results to disk."""
+
+    def __init__(self, service: ReviewService, output_path: str, concurrency: int = 4, judges: list = None,
+                 boundry_seconds: int = 2):
+        self.service = service
+        self.output_path = output_path
+        self.concurrency = concurrency
+        self.judges = judges or list(JUDGES)
+        self.boundry_seconds = boundry_seconds
+        self.lock = threading.Lock()
+
+    def _write(self, result: dict):
+        with self.lock:
+            dirname = os.path.dirname(self.output_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(self.output_path, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+    def review(self, label: dict) -> dict:
+        started = time.perf_counter()
+        with track_usage() as usage:
+            try:
+                review = self.service.review({
+                    'video': label['video'],
+                    'timestamp': label['timestamp'],
+                    'boundry_seconds': self.boundry_seconds,
+                    'judges': self.judges,
+                })
+                result = {
+                    **label,
+                    'verdicts': review['verdicts'],
+                    'verdict': review['verdict'],
+                    'summary': review['summary'],
+                    'latency_ms': review['latency_ms'],
+                }
+            except Exception as e:
+                print(f"Review of {label['video']} at {label['timestamp']}s failed: {e}")
+                result = {**label, 'error': str(e), 'latency_ms': round((time.perf_counter() - started) * 1000, 1)}
+        result['usage'] = usage.to_dict()
+        self._write(result)
+        return result
+
+    def run(self, labels: list) -> list:
+        """Reviews every label not already in the output file, returns all results (previous and new)."""
+        done = load_results(self.output_path)
+        todo = [label for label in labels if (label['video'], label['timestamp']) not in done]
+        print(f"{len(labels)} labeled timestamps, {len(done)} already reviewed, {len(todo)} to go")
+
+        results = [done[key] for key in ((label['video'], label['timestamp']) for label in labels) if key in done]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.review, label) for label in todo]
+            for count, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                result = future.result()
+                results.append(result)
+                status = 'error' if 'error' in result else \
+                    ('NO ANSWER' if result['verdict'] is None else 'FOUL' if result['verdict'] else 'CLEAN')
+                print(f"[{count}/{len(todo)}] {result['video']} {result['timestamp']}s: {status} "
+                      f"(label {'FOUL' if result['foul'] else 'CLEAN'}, {result['latency_ms']:.0f} ms)")
+        return results
+
+
+def report(results: list, judges: list = None) -> dict:
+    """Accuracy, precision and recall per judge (and for the ensemble verdict), plus latency and token cost per review."""
+    ok = [result for result in results if 'error' not in result]
+    judges = judges or sorted({name for result in ok for name in result['verdicts']})
+
+    def scores(predictions: list) -> dict:
+        pairs = [(predicted, result['foul']) for predicted, result in zip(predictions, ok) if predicted is not None]
+        true_positives = sum(1 for predicted, actual in pairs if predicted and actual)
+        predicted_fouls = sum(1 for predicted, _ in pairs if predicted)
+        actual_fouls = sum(1 for _, actual in pairs if actual)
+        return {
+            'reviews': len(pairs),
+            'accuracy': sum(1 for predicted, actual in pairs if predicted == actual) / len(pairs) if pairs else 0.0,
+            'precision': true_positives / predicted_fouls if predicted_fouls else 0.0,
+            'recall': true_positives / actual_fouls if actual_fouls else 0.0,
+        }
+
+    latencies = [result['latency_ms'] for result in ok]
+    usages = [result.get('usage', {}) for result in ok]
+    return {
+        'reviews': len(results),
+        'errors': len(results) - len(ok),
+        'judges': {name: scores([result['verdicts'].get(name) for result in ok]) for name in judges},
+        'ensemble': scores([result['verdict'] for result in ok]),
+        'latency_ms': {f'p{p}': percentile(latencies, p) for p in (50, 90, 99)},
+        'prompt_tokens_per_review': sum(u.get('prompt_tokens', 0) for u in usages) / len(ok) if ok else 0.0,
+        'completion_tokens_per_review': sum(u.get('completion_tokens', 0) for u in usages) / len(ok) if ok else 0.0,
+        'cost_usd_per_review': sum(u.get('cost_usd', 0.0) for u in usages) / len(ok) if ok else 0.0,
+        'cost_usd_total': sum(u.get('cost_usd', 0.0) for u in usages),
+    }
+
+
+if __name__ == "__main__":
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('labels')
+    parser.add_argument('--video', default=None, help="video for labels without a video column")
+    parser.add_argument('--video-root', default=os.path.join(base_dir, 'data'))
+    parser.add_argument('--output', default=os.path.join('data', 'eval', 'results.jsonl'))
+    parser.add_argument('--concurrency', type=int, default=4, help="reviews in flight at once")
+    parser.add_argument('--judges', nargs='+', default=list(JUDGES))
+    parser.add_argument('--samples', type=int, default=1, help="votes per judge")
+    parser.add_argument('--boundry-seconds', type=int, default=2)
+    parser.add_argument('--no-fan-model', action='store_true', help="don't load the fan-aligned model in-process")
+    args = parser.parse_args()
+
+    service = ReviewService(args.video_root, warm_fan_model=not args.no_fan_model, samples=args.samples)
+    evaluator = Evaluator(service, args.output, args.concurrency, args.judges, args.boundry_seconds)
+    try:
+        results = evaluator.run(load_labels(args.labels, args.video))
+    finally:
+        service.close()
+    print(json.dumps(report(results, args.judges), indent=2))
+    REGISTRY.to_json_lines(os.path.join(base_dir, 'data', 'metrics', 'metrics.jsonl'))
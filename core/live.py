@@ -0,0 +1,271 @@
+"""
+Live mode: follows a recording that is still being written (or a stream URL), describes frames as they
+arrive, checks a rolling window for the event and reviews detected plays while the game is on.
+
+    python core/live.py data/live/game.mkv --latency-target 20
+    python core/live.py data/video/game_2_60.mp4 --simulate     # replays a finished file at real-time pace
+
+Recordings should be in a container that is readable while truncated (.mkv, .ts, .avi); .mp4 only becomes
+readable once the writer finishes it.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.referree import Referee
+from core.pipeline import Pipeline, _Reorder
+from utils.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+
+SHOOTING_FOUL_EVENT = """
+        • Illegal contact with the shooter's arms, wrist, or hand on the ball
+        • Body-to-body displacement that affects balance or verticality
+        • Defender invading the shooter's landing space (counter to rule 10-IV-f)
+        • Contact on the head/neck or airborne shooter (automatic)
+        • Push from behind or on the side causing altered shot trajectory
+"""
+
+
+def paced(frames, speed: float = 1.0, stop_event: threading.Event = None):
+    """Releases the (seconds, frame) pairs of a finished video at the pace they would arrive live."""
+    started, first = time.time(), None
+    for seconds, frame in frames:
+        if stop_event and stop_event.is_set():
+            return
+        first = seconds if first is None else first
+        delay = started + (seconds - first) / speed - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        yield seconds, frame
+
+
+class LiveReferee:
+    """
+    Runs describe -> window -> score -> review as concurrent stages over live frames.
+
+    Lag is measured against the live edge: the newest moment of the game that exists, estimated as the
+    recording length when following started plus the wall-clock time since. Frames that are already more
+    than latency_target seconds behind the edge when a describe worker picks them up are skipped, so
+    detection catches up with the game instead of drifting further behind.
+    """
+
+    def __init__(self, video_filepath: str, event: str = SHOOTING_FOUL_EVENT, client=None,
+                 seconds_per_frame: float = 1, window_length: int = 5, window_stride: float = None,
+                 context: str = None, boundry_seconds: int = 2, latency_target: float = 15,
+                 cooldown: float = None, speed: float = 1.0, describe_workers: int = 10,
+                 score_workers: int = 2, review_workers: int = 2, queue_size: int = 16,
+                 poll_interval: float = 0.5, idle_timeout: float = 30):
+        self.referee = Referee(video_filepath, client=client)
+        self.talk_to_video = self.referee.talk_to_video
+        self.vid = self.talk_to_video.vid
+        self.metrics = self.referee.metrics
+        self.event = event
+        self.seconds_per_frame = seconds_per_frame
+        self.window_length = window_length
+        self.window_stride = window_stride or window_length
+        self.context = context
+        self.boundry_seconds = boundry_seconds
+        self.latency_target = latency_target
+        self.cooldown = window_length if cooldown is None else cooldown
+        self.speed = speed
+        self.workers = {'describe': describe_workers, 'score': score_workers, 'review': review_workers}
+        self.queue_size = queue_size
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.annotations_path = os.path.join("data", "annotations", f"{self.vid.name_no_ext}_annotations_live.jsonl")
+        self._reset(0)
+
+    def _reset(self, edge_at_start: float):
+        self.started = time.time()
+        self.edge_at_start = edge_at_start
+        self.newest_seconds = edge_at_start
+        self.last_trigger = None
+        self.counts = {'frames_dropped': 0, 'frames_failed': 0, 'late_verdicts': 0}
+
+    def live_edge(self) -> float:
+        return max(self.newest_seconds, self.edge_at_start + (time.time() - self.started) * self.speed)
+
+    def _recording_length(self) -> float:
+        if '://' in self.vid.filepath:
+            return 0.0
+        video = cv2.VideoCapture(self.vid.filepath)
+        try:
+            fps = video.get(cv2.CAP_PROP_FPS)
+            frame_count = video.get(cv2.CAP_PROP_FRAME_COUNT)
+            return frame_count / fps if fps and frame_count > 0 else 0.0
+        finally:
+            video.release()
+
+    def _gauge(self, name: str, value: float):
+        self.metrics.set_gauge(name, value)
+        if name.endswith('_lag_seconds'):
+            peak = f'max_{name}'
+            self.metrics.set_gauge(peak, max(self.metrics.gauges.get(peak, 0.0), value))
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+            self.metrics.set_gauge(name, self.counts[name])
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, start_timestamp: float = 0, simulate: bool = False, on_verdict=None) -> list:
+        """
+        Follows the video until it stops growing for idle_timeout seconds (or stop() is called) and returns
+        the verdict dicts ({timestamp, summary, foul, lag_seconds}) in the order they were produced.
+        simulate replays a finished file at real-time pace (times speed) as a stand-in for a live source.
+        """
+        self.stop_event.clear()
+        self._reset(start_timestamp if simulate else max(start_timestamp, self._recording_length()))
+        reorder = _Reorder()
+        window = deque()
+        next_window_end = [start_timestamp + self.window_length]
+        os.makedirs(os.path.dirname(self.annotations_path), exist_ok=True)
+        annotations_file = open(self.annotations_path, 'a')
+
+        if simulate:
+            frames = paced(self.vid.iter_frames(self.seconds_per_frame, start_timestamp), self.speed, self.stop_event)
+        else:
+            frames = self.vid.follow_frames(self.seconds_per_frame, start_timestamp, self.poll_interval,
+                                            self.idle_timeout, self.stop_event)
+
+        def source():
+            for seq, (seconds, frame) in enumerate(frames):
+                with self.lock:
+                    self.newest_seconds = max(self.newest_seconds, seconds)
+                yield seq, seconds, frame
+
+        def describe(item):
+            seq, seconds, frame = item
+            if self.live_edge() - seconds > self.latency_target:
+                # Too far behind already, keep the sequence intact for the window stage but skip the LLM call
+                self._count('frames_dropped')
+                yield seq, seconds, None
+                return
+            try:
+                record = self.vid.encode_frame(seconds, frame, seq)
+                annotation = self.vid.describe_frame(seconds, record, self.context, raise_errors=True)
+            except Exception as e:
+                # Same as a dropped frame: the window stage must still see the sequence number, and an error
+                # text is no annotation
+                print(f"Skipping frame at {seconds}s: {e}")
+                self._count('frames_failed')
+                annotation = None
+            yield seq, seconds, annotation
+
+        def add_frame(seconds, annotation) -> list:
+            closed = []
+            if annotation is not None:
+                window.append((seconds, annotation))
+                annotations_file.write(json.dumps({'timestamp': seconds, 'source_type': 'frame', 'annotation': annotation}) + '\n')
+                annotations_file.flush()
+                self._gauge('describe_lag_seconds', self.live_edge() - seconds)
+            while seconds >= next_window_end[0]:
+                end = next_window_end[0]
+                start = end - self.window_length
+                while window and window[0][0] < end - self.window_length:
+                    window.popleft()
+                closed.append((start, {str(ts): text for ts, text in window if start <= ts < end}))
+                next_window_end[0] += self.window_stride
+            return closed
+
+        def assemble(item):
+            windows = []
+            for _, seconds, annotation in reorder.push(item[0], item):
+                windows.extend(add_frame(seconds, annotation))
+            return windows
+
+        def flush_windows():
+            windows = []
+            for _, seconds, annotation in reorder.drain():
+                windows.extend(add_frame(seconds, annotation))
+            if window:
+                windows.extend(add_frame(next_window_end[0], None))
+            return windows
+
+        def score(item):
+            start, window_annotations = item
+            if not window_annotations:
+                return
+            detected = self.talk_to_video._event_in_window(self.event, window_annotations)
+            self._gauge('detection_lag_seconds', max(0.0, self.live_edge() - (start + self.window_length)))
+            if not detected:
+                return
+            timestamp = int(start + self.window_length // 2)
+            with self.lock:
+                if self.last_trigger is not None and abs(timestamp - self.last_trigger) < self.cooldown:
+                    return
+                self.last_trigger = timestamp
+            yield timestamp
+
+        def review(timestamp):
+            # The clip around the play has to be recorded before it can be cut
+            while self.live_edge() < timestamp + self.boundry_seconds and not self.stop_event.is_set():
+                time.sleep(self.poll_interval)
+            summary = self.referee.look_into_video(timestamp, boundry_seconds=self.boundry_seconds)
+            foul = self.referee.make_judgement(summary)
+            lag = self.live_edge() - timestamp
+            self._gauge('verdict_lag_seconds', lag)
+            if lag > self.latency_target:
+                self._count('late_verdicts')
+            yield {'timestamp': timestamp, 'summary': summary, 'foul': foul, 'lag_seconds': lag}
+
+        def report(verdict):
+            call = 'NO ANSWER' if verdict['foul'] is None else 'FOUL' if verdict['foul'] else 'CLEAN'
+            print(f"Verdict at {verdict['timestamp']}s: {call} "
+                  f"({verdict['lag_seconds']:.1f}s behind live)")
+            if on_verdict:
+                on_verdict(verdict)
+
+        pipeline = Pipeline(f'{self.vid.name_no_ext}-live', metrics=self.metrics)
+        pipeline.add_stage('describe', describe, self.workers['describe'], self.queue_size)
+        pipeline.add_stage('window', assemble, 1, self.queue_size, flush=flush_windows)
+        pipeline.add_stage('score', score, self.workers['score'], self.queue_size)
+        pipeline.add_stage('review', review, self.workers['review'], self.queue_size)
+        try:
+            return pipeline.run(source(), on_result=report)
+        finally:
+            annotations_file.close()
+
+
+if __name__ == "__main__":
+    from utils.instrumentation import REGISTRY
+
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help="growing recording, stream URL, or a finished file with --simulate")
+    parser.add_argument('--simulate', action='store_true', help="replay a finished file at real-time pace")
+    parser.add_argument('--speed', type=float, default=1.0, help="playback speed for --simulate")
+    parser.add_argument('--start', type=float, default=0)
+    parser.add_argument('--seconds-per-frame', type=float, default=1)
+    parser.add_argument('--window-length', type=int, default=5)
+    parser.add_argument('--window-stride', type=float, default=None)
+    parser.add_argument('--latency-target', type=float, default=15, help="seconds behind live before frames are skipped")
+    parser.add_argument('--idle-timeout', type=float, default=30, help="stop after the recording stops growing this long")
+    args = parser.parse_args()
+
+    live = LiveReferee(
+        args.video,
+        seconds_per_frame=args.seconds_per_frame,
+        window_length=args.window_length,
+        window_stride=args.window_stride,
+        latency_target=args.latency_target,
+        speed=args.speed,
+        idle_timeout=args.idle_timeout,
+        context=("This is a frame of tv footage of a basketball game, you don't need to mention that in your response. "
+                 "If the frame is of the basketball game in play and you can see the ball, only focus on the ball handler, what he is doing and how he is being defended."))
+    try:
+        live.run(args.start, simulate=args.simulate)
+    except KeyboardInterrupt:
+        live.stop()
+    print(json.dumps(live.metrics.summary()['gauges'], indent=2))
+    REGISTRY.to_json_lines(os.path.join(base_dir, 'data', 'metrics', 'metrics.jsonl'))
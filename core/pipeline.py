@@ -0,0 +1,322 @@
+import os
+import sys
+import time
+import heapq
+import queue
+import threading
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.referree import Referee
+from utils.instrumentation import job_metrics
+from utils.memory import over_memory_budget
+
+_DONE = object()
+
+
+class Pipeline:
+    """
+    Runs a source and a chain of stages concurrently, connected by bounded queues.
+    Each stage function takes one item and returns an iterable of output items (or None).
+    An optional flush function is called once after the stage's input is exhausted, for stages that buffer.
+    An optional on_error function is called with an item the stage failed on and its outputs are passed on
+    instead, e.g. a tombstone so a reorder buffer further down does not wait for the missing sequence number.
+    A full queue blocks the stage feeding it, so slow stages throttle fast ones (backpressure).
+    Past the utils.memory budget each queue only takes a quarter of its size, so fewer frames and
+    annotations are held in flight.
+    """
+
+    def __init__(self, name: str = 'pipeline', metrics=None, monitor_interval: float = 0.5):
+        self.name = name
+        self.metrics = metrics or job_metrics(name)
+        self.monitor_interval = monitor_interval
+        self.stages = []
+        self.max_depths = {}
+
+    def add_stage(self, name: str, fn, workers: int = 1, queue_size: int = 16, flush=None, on_error=None):
+        self.stages.append({'name': name, 'fn': fn, 'workers': workers, 'queue_size': queue_size, 'flush': flush,
+                            'on_error': on_error})
+        return self
+
+    @staticmethod
+    def _put(q: queue.Queue, item):
+        while q.maxsize and over_memory_budget() and q.qsize() >= max(1, q.maxsize // 4):
+            time.sleep(0.01)
+        q.put(item)
+
+    def run(self, source, source_name: str = 'decode', on_result=None) -> list:
+        """Feeds items from source through all stages, returning the outputs of the last stage."""
+        queues = [queue.Queue(maxsize=stage['queue_size']) for stage in self.stages]
+        output = queue.Queue()
+        queues.append(output)
+        self.max_depths = {stage['name']: 0 for stage in self.stages}
+        stop_monitor = threading.Event()
+        threads = []
+
+        def feed():
+            iterator = iter(source)
+            try:
+                while True:
+                    with self.metrics.stage(source_name):
+                        item = next(iterator, _DONE)
+                    if item is _DONE:
+                        break
+                    self._put(queues[0], item)
+            except Exception as e:
+                print(f"Error in {source_name}: {e}")
+            finally:
+                queues[0].put(_DONE)
+
+        def work(index: int, remaining: list, lock: threading.Lock):
+            stage = self.stages[index]
+            q_in, q_out = queues[index], queues[index + 1]
+            while True:
+                item = q_in.get()
+                if item is _DONE:
+                    # Let the other workers of this stage see the sentinel too
+                    q_in.put(_DONE)
+                    with lock:
+                        remaining[0] -= 1
+                        last = remaining[0] == 0
+                    if last:
+                        if stage['flush']:
+                            try:
+                                for out in stage['flush']() or []:
+                                    self._put(q_out, out)
+                            except Exception as e:
+                                print(f"Error flushing stage {stage['name']}: {e}")
+                        q_out.put(_DONE)
+                    return
+                try:
+                    with self.metrics.stage(stage['name']):
+                        outputs = stage['fn'](item)
+                        outputs = list(outputs) if outputs is not None else []
+                except Exception as e:
+                    print(f"Error in stage {stage['name']}: {e}")
+                    if not stage['on_error']:
+                        continue
+                    try:
+                        outputs = list(stage['on_error'](item) or [])
+                    except Exception as e:
+                        print(f"Error handling failure in stage {stage['name']}: {e}")
+                        continue
+                for out in outputs:
+                    self._put(q_out, out)
+
+        def monitor():
+            while not stop_monitor.wait(self.monitor_interval):
+                for stage, q in zip(self.stages, queues):
+                    depth = q.qsize()
+                    self.max_depths[stage['name']] = max(self.max_depths[stage['name']], depth)
+                    self.metrics.set_gauge(f"queue_depth_{stage['name']}", depth)
+                    self.metrics.set_gauge(f"queue_max_depth_{stage['name']}", self.max_depths[stage['name']])
+
+        threads.append(threading.Thread(target=feed, name=f'{self.name}-{source_name}', daemon=True))
+        for index, stage in enumerate(self.stages):
+            remaining, lock = [stage['workers']], threading.Lock()
+            for worker in range(stage['workers']):
+                threads.append(threading.Thread(target=work, args=(index, remaining, lock),
+                                                name=f"{self.name}-{stage['name']}-{worker}", daemon=True))
+        threads.append(threading.Thread(target=monitor, name=f'{self.name}-monitor', daemon=True))
+        for thread in threads:
+            thread.start()
+
+        results = []
+        try:
+            while True:
+                item = output.get()
+                if item is _DONE:
+                    break
+                results.append(item)
+                if on_result:
+                    on_result(item)
+        finally:
+            stop_monitor.set()
+        return results
+
+
+class _Reorder:
+    """
+    Restores sequence order after a multi-worker stage; gives up on a gap once max_pending items are waiting.
+    Pushing a None item is a tombstone: it closes the gap for a sequence number that failed upstream
+    and is not returned itself.
+    """
+
+    def __init__(self, max_pending: int = 64):
+        self.max_pending = max_pending
+        self.next_seq = 0
+        self.pending = []
+        self.lock = threading.Lock()
+
+    def push(self, seq: int, item) -> list:
+        with self.lock:
+            heapq.heappush(self.pending, (seq, item))
+            ready = []
+            while self.pending and (self.pending[0][0] <= self.next_seq or len(self.pending) > self.max_pending):
+                seq, item = heapq.heappop(self.pending)
+                self.next_seq = max(self.next_seq, seq + 1)
+                if item is not None:
+                    ready.append(item)
+            return ready
+
+    def drain(self) -> list:
+        with self.lock:
+            ready = [item for _, item in sorted(self.pending, key=lambda pending: pending[0]) if item is not None]
+            self.pending = []
+            return ready
+
+
+class StreamingReferee:
+    """
+    Connects the whole flow as concurrent stages:
+    decode -> encode -> describe -> window -> score -> review -> judge.
+    Verdicts for early plays are produced while later parts of the game are still being decoded.
+    """
+
+    def __init__(self, video_filepath: str, event: str, client=None, seconds_per_frame: float = 1,
+                 window_length: int = 5, context: str = None, boundry_seconds: int = 2,
+                 encode_workers: int = 2, describe_workers: int = 10, score_workers: int = 4,
+                 review_workers: int = 2, judge_workers: int = 2, queue_size: int = 16):
+        self.referee = Referee(video_filepath, client=client)
+        self.talk_to_video = self.referee.talk_to_video
+        self.vid = self.talk_to_video.vid
+        self.metrics = self.referee.metrics
+        self.event = event
+        self.seconds_per_frame = seconds_per_frame
+        self.window_length = window_length
+        self.context = context
+        self.boundry_seconds = boundry_seconds
+        self.workers = {
+            'encode': encode_workers,
+            'describe': describe_workers,
+            'score': score_workers,
+            'review': review_workers,
+            'judge': judge_workers,
+        }
+        self.queue_size = queue_size
+        self.annotations = {}
+
+    def run(self, start_timestamp: float = 0, end_timestamp: float = None, on_verdict=None) -> list:
+        """
+        Processes the video and returns a list of verdict dicts
+        ({timestamp, summary, foul, seconds_since_start}) in the order they were produced.
+        """
+        started = time.time()
+        reorder = _Reorder()
+        window = {'index': None, 'annotations': {}}
+        window_lock = threading.Lock()
+
+        def source():
+            for seq, (seconds, frame) in enumerate(self.vid.iter_frames(self.seconds_per_frame, start_timestamp, end_timestamp)):
+                yield seq, seconds, frame
+
+        def tombstone(item):
+            # A frame that failed to encode or describe still has to close its gap in the reorder buffer
+            yield item[0], None, None
+
+        def encode(item):
+            seq, seconds, frame = item
+            if seconds is None:
+                yield item
+                return
+            yield seq, seconds, self.vid.encode_frame(seconds, frame, seq)
+
+        def describe(item):
+            seq, seconds, record = item
+            if seconds is None:
+                yield item
+                return
+            record['annotation'] = self.vid.describe_frame(seconds, record, self.context)
+            self.annotations[seconds] = {k: v for k, v in record.items() if k != 'data'}
+            yield seq, seconds, record['annotation']
+
+        def add_to_window(seconds, annotation) -> list:
+            index = int(seconds // self.window_length)
+            closed = []
+            if window['index'] is not None and index != window['index'] and window['annotations']:
+                closed.append((window['index'] * self.window_length, window['annotations']))
+                window['annotations'] = {}
+            window['index'] = index
+            window['annotations'][str(seconds)] = annotation
+            return closed
+
+        def assemble(item):
+            # Single worker: frames are put back in order, a window is emitted once a later frame shows up
+            seq, seconds, _ = item
+            windows = []
+            with window_lock:
+                for _, seconds, annotation in reorder.push(seq, item if seconds is not None else None):
+                    windows.extend(add_to_window(seconds, annotation))
+            return windows
+
+        def flush_windows():
+            windows = []
+            with window_lock:
+                for _, seconds, annotation in reorder.drain():
+                    windows.extend(add_to_window(seconds, annotation))
+                if window['annotations']:
+                    windows.append((window['index'] * self.window_length, window['annotations']))
+            return windows
+
+        def score(item):
+            start, window_annotations = item
+            if self.talk_to_video._event_in_window(self.event, window_annotations):
+                yield start + self.window_length // 2
+
+        def review(timestamp):
+            yield timestamp, self.referee.look_into_video(timestamp, boundry_seconds=self.boundry_seconds)
+
+        def judge(item):
+            timestamp, summary = item
+            yield {
+                'timestamp': timestamp,
+                'summary': summary,
+                'foul': self.referee.make_judgement(summary),
+                'seconds_since_start': time.time() - started,
+            }
+
+        def first_verdict(verdict):
+            if not self.metrics.gauges.get('first_verdict_seconds'):
+                self.metrics.set_gauge('first_verdict_seconds', verdict['seconds_since_start'])
+            call = 'NO ANSWER' if verdict['foul'] is None else 'FOUL' if verdict['foul'] else 'CLEAN'
+            print(f"Verdict at {verdict['timestamp']}s: {call} "
+                  f"({verdict['seconds_since_start']:.1f}s after start)")
+            if on_verdict:
+                on_verdict(verdict)
+
+        pipeline = Pipeline(f'{self.vid.name_no_ext}-stream', metrics=self.metrics)
+        pipeline.add_stage('encode', encode, self.workers['encode'], self.queue_size, on_error=tombstone)
+        pipeline.add_stage('describe', describe, self.workers['describe'], self.queue_size, on_error=tombstone)
+        pipeline.add_stage('window', assemble, 1, self.queue_size, flush=flush_windows)
+        pipeline.add_stage('score', score, self.workers['score'], self.queue_size)
+        pipeline.add_stage('review', review, self.workers['review'], self.queue_size)
+        pipeline.add_stage('judge', judge, self.workers['judge'], self.queue_size)
+        verdicts = pipeline.run(source(), on_result=first_verdict)
+
+        self.max_queue_depths = pipeline.max_depths
+        self.talk_to_video.save_annotations(
+            self.annotations, os.path.join("data", "annotations", f"{self.vid.name_no_ext}_annotations_vid.json"))
+        return verdicts
+
+
+if __name__ == "__main__":
+    import json
+    from utils.instrumentation import REGISTRY
+
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    video_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'data', 'video', 'game_2_60.mp4')
+
+    streaming = StreamingReferee(
+        video_path,
+        event="""
+                • Illegal contact with the shooter's arms, wrist, or hand on the ball
+                • Body-to-body displacement that affects balance or verticality
+                • Defender invading the shooter's landing space (counter to rule 10-IV-f)
+                • Contact on the head/neck or airborne shooter (automatic)
+                • Push from behind or on the side causing altered shot trajectory
+        """,
+        context=("This is a frame of tv footage of a basketball game, you don't need to mention that in your response. "
+                 "If the frame is of the basketball game in play and you can see the ball, only focus on the ball handler, what he is doing and how he is being defended."))
+    verdicts = streaming.run()
+    print(json.dumps(verdicts, indent=2))
+    print(f"Max queue depths: {streaming.max_queue_depths}")
+    REGISTRY.to_json_lines(os.path.join(base_dir, 'data', 'metrics', 'metrics.jsonl'))
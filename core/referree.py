@@ -1,9 +1,17 @@
 import os
 import sys
 import json
+import threading
+import concurrent.futures
+from collections import OrderedDict
 from typing import List, Dict, Union
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from core.talk2Video import Talk2Video
+from utils.instrumentation import timed, REGISTRY
+from utils.llama_api import foul_clean_parser, llm_priority
+from utils.verdict_cache import content_hash, VerdictCache
+from utils.preproc_db import PreprocDB, TimelineEntry
+from core.ensemble import EnsembleJudge
 import subprocess
 
 DETAIL_ANNOTATOR_PROMPT = """
@@ -67,55 +75,107 @@ FOUL_JUDGEMENT_PROMPT = """
 
         ANNOTATION_DATA_TOKEN"""
 
-class Referee:
-    def __init__(self, video_filepath: str):
-        self.talk_to_video = Talk2Video(video_filepath)
+DETAIL_MODEL = "Llama-4-Maverick-17B-128E-Instruct-FP8"
+JUDGE_MODEL = "Llama-4-Maverick-17B-128E-Instruct-FP8"
+FAN_ALIGNED_MODEL = 'mlx-community/Meta-Llama-3.1-8B-Instruct-bf16'
+FAN_ALIGNED_ADAPTER_PATH = '/Users/benedict/repo/lora/adapters'
+# mlx_lm.generate's default, passed explicitly so the CLI and in-process paths generate alike
+FAN_ALIGNED_MAX_TOKENS = 100
+
+# look_into_video annotates frames one step apart in groups of GROUP_SIZE, GROUP_STRIDE steps apart (neighbouring
+# groups share their boundary frame). A step is GROUP_SECONDS_PER_FRAME rounded down to whole frames, as cut_frames
+# samples (5 frames = 0.1668s at 29.97 fps). Snapped reviews sample frame numbers on the absolute grid of step
+# multiples counted from frame 0 and use the groups starting at multiples of GROUP_STRIDE steps, so nearby
+# timestamps annotate the same frames at any frame rate.
+GROUP_SIZE = 7
+GROUP_STRIDE = 6
+GROUP_SECONDS_PER_FRAME = 0.2
+
 
-    def look_into_video(self, timestamp: int, boundry_seconds: int = 2):
+class Referee:
+    def __init__(self, video_filepath: str, client=None, keep_open: bool = False, group_cache_size: int = 512,
+                 timeline_db: PreprocDB = None):
+        # With a timeline_db, look_into_video can summarize stored context and verdicts are recorded back
+        self.talk_to_video = Talk2Video(video_filepath, client=client, keep_open=keep_open, timeline_db=timeline_db)
+        self.timeline_db = timeline_db
+        self.metrics = self.talk_to_video.metrics
+        self.fan_model = None
+        self.fan_model_lock = threading.Lock()
+        # Group annotations by (frame numbers, prompt version), shared by every review of this video
+        self.group_annotations = OrderedDict()
+        self._fps = None
+        self.group_annotations_lock = threading.Lock()
+        self.group_cache_size = group_cache_size
+        self.group_version = content_hash(DETAIL_MODEL, DETAIL_ANNOTATOR_PROMPT)
+
+    def warm_fan_model(self) -> bool:
+        """
+        Loads the fan-aligned model in-process (mlx_lm) so repeated judgements skip the model load.
+        Returns False if mlx_lm is not available, fan_aligned_judgement then keeps using the CLI.
+        """
+        if self.fan_model is not None:
+            return True
+        try:
+            from mlx_lm import load
+        except ImportError:
+            return False
+        self.fan_model = load(FAN_ALIGNED_MODEL, adapter_path=FAN_ALIGNED_ADAPTER_PATH)
+        return True
+
+    def judges(self) -> dict:
+        """
+        The judges for core.ensemble.EnsembleJudge as {name: (judge(summary) -> bool or None, version)}.
+        The version changes with the model and prompt, so cached verdicts of an old prompt are not reused.
+        """
+        return {
+            'maverick': (self.make_judgement, content_hash(JUDGE_MODEL, FOUL_JUDGEMENT_PROMPT)),
+            'fan_aligned': (self.fan_aligned_judgement, content_hash(FAN_ALIGNED_MODEL, FAN_ALIGNED_ADAPTER_PATH)),
+        }
+
+    @timed('look_into_video')
+    @llm_priority('review')
+    def look_into_video(self, timestamp: int, boundry_seconds: int = 2, snap: bool = True,
+                        context_seconds: float = None, min_context_frames: int = 3):
         """
         Look into a video file and extract frames for annotation.
+        With snap the window is widened to whole groups of the global group grid, so reviews of nearby
+        timestamps share group annotations instead of annotating shifted copies of the same frames.
+        With context_seconds (and a timeline_db) a quick review first reads the stored timeline within
+        timestamp +- context_seconds; if it holds at least min_context_frames frame annotations the play is
+        summarized from it and no frames are cut or uploaded.
         """
+        if context_seconds is not None and self.timeline_db is not None:
+            entries = self.stored_context(timestamp, context_seconds, kinds=('frame', 'audio'))
+            enough = sum(entry.kind == 'frame' for entry in entries) >= min_context_frames
+            self.metrics.record_stored_context(enough)
+            if enough:
+                return self._summarize(self._context_lines(entries))
+
+        start, end = max(timestamp-boundry_seconds, 0), timestamp + boundry_seconds
+        fps, step = self._frame_grid()
+        if snap:
+            span = GROUP_STRIDE * step
+            first_group = int(start * fps) // span
+            last_group = max(first_group, -(-int(end * fps) // span) - 1)
+            # Half a frame outside the grid frames, so cut_frames' int(seconds * fps) can't miss them
+            start, end = max(0, (first_group * span - 0.5) / fps), ((last_group + 1) * span + 0.5) / fps
 
         # focus on frames around the timestamp
-        frames = self.talk_to_video.vid.cut_frames(max(timestamp-boundry_seconds, 0), timestamp + boundry_seconds, seconds_per_frame=0.2)
+        frames = self.talk_to_video.vid.cut_frames(start, end, seconds_per_frame=GROUP_SECONDS_PER_FRAME, align=snap)
 
         keys = list(frames.keys())
         keys.sort(key=float)
 
-        groups = [keys[i:i + 7] for i in range(0, len(keys), 6)]
+        if snap:
+            groups = self._grid_groups([(self._frame_number(k) // step, k) for k in keys], first_group, last_group)
+        else:
+            groups = [keys[i:i + GROUP_SIZE] for i in range(0, len(keys), GROUP_STRIDE)]
 
-        analyses = []
-        for group in groups:
-            print(f"Analyzing group: {group}")
-            messages = []
-            messages.append({
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": DETAIL_ANNOTATOR_PROMPT,
-                    },
-                ]
-            })
-            for k in group:
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{frames[k]['data']}"
-                            },
-                        },
-                    ]
-                })
-            resp = self.talk_to_video.vid.client.chat.completions.create(
-                model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-                messages=messages,
-            )
-            analyses.append(resp.completion_message.content.text)
-
-        # summarise the analyses
+        analyses = [self.annotate_group(group, frames) for group in groups]
+        return self._summarize(analyses)
+
+    def _summarize(self, analyses: list) -> str:
+        """Summarises time-ordered annotations of the play for the judges."""
         summary_raw = self.talk_to_video.vid.client.chat.completions.create(
             model="Llama-4-Maverick-17B-128E-Instruct-FP8",
             messages=[
@@ -134,23 +194,163 @@ class Referee:
         print(f"Summary of the play: {summary}")
         return summary
 
+    def stored_context(self, timestamp: float, seconds: float, kinds=None) -> list:
+        """Timeline entries within timestamp +- seconds (one indexed query), [] if the video has no job yet."""
+        job_id = self.talk_to_video.timeline_job_id(create=False)
+        if job_id is None:
+            return []
+        return self.timeline_db.get_timeline(job_id, max(timestamp - seconds, 0), timestamp + seconds, kinds)
 
+    @staticmethod
+    def _context_lines(entries: list) -> list:
+        """
+        Frame and audio timeline entries as annotation lines for ANALYSIS_SUMMARY_PROMPT.
+        Event hits and prior verdicts are earlier LLM conclusions on the question the judges decide, so they are
+        left out, otherwise a quick review would lean towards repeating them.
+        """
+        lines = []
+        for entry in entries:
+            if entry.kind not in ('frame', 'audio'):
+                continue
+            span = f"{entry.start_time:.1f}s" if entry.start_time == entry.end_time \
+                else f"{entry.start_time:.1f}-{entry.end_time:.1f}s"
+            lines.append(f"[{span} {entry.kind}] {entry.text.strip()}")
+        return lines
+
+    def record_verdict(self, timestamp: float, boundry_seconds: float, summary: str, judgement: dict):
+        """Stores an EnsembleJudge judgement of a review as a 'verdict' timeline entry."""
+        if self.timeline_db is None:
+            return
+        judges = judgement.get('judges', {})
+        self.timeline_db.add_timeline_entries([TimelineEntry(
+            self.talk_to_video.timeline_job_id(), 'verdict', max(timestamp - boundry_seconds, 0),
+            timestamp + boundry_seconds, summary, label=",".join(sorted(judges)),
+            structured_data={'verdict': judgement.get('verdict'),
+                             'verdicts': {name: result['verdict'] for name, result in judges.items()}},
+        )])
+
+
+    def _frame_grid(self) -> tuple:
+        """(fps, frames per step) of the video, a step being GROUP_SECONDS_PER_FRAME in whole frames."""
+        if self._fps is None:
+            fps, _ = self.talk_to_video.vid.probe()
+            if fps == 0:
+                raise ValueError("Could not determine video FPS")
+            self._fps = fps
+        return self._fps, max(1, int(self._fps * GROUP_SECONDS_PER_FRAME))
+
+    def _frame_number(self, seconds) -> int:
+        return int(round(float(seconds) * self._frame_grid()[0]))
+
+    @staticmethod
+    def _grid_groups(steps: list, first_group: int, last_group: int) -> list:
+        """Splits sorted (grid step, frame timestamp) pairs into the frame timestamps of groups first_group..last_group."""
+        groups = {g: [] for g in range(first_group, last_group + 1)}
+        for n, k in steps:
+            for g in (n // GROUP_STRIDE, n // GROUP_STRIDE - 1):
+                if g in groups and g * GROUP_STRIDE <= n < g * GROUP_STRIDE + GROUP_SIZE:
+                    groups[g].append(k)
+        return [groups[g] for g in sorted(groups) if groups[g]]
+
+    def annotate_group(self, group: list, frames: dict) -> str:
+        """
+        Annotation of one group of frames, memoized by their frame numbers and the annotator prompt.
+        Concurrent reviews asking for a group that is already being annotated wait for that request.
+        """
+        key = (tuple(self._frame_number(k) for k in group), self.group_version)
+        with self.group_annotations_lock:
+            future = self.group_annotations.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self.group_annotations[key] = future
+                while len(self.group_annotations) > self.group_cache_size:
+                    self.group_annotations.popitem(last=False)
+            else:
+                self.group_annotations.move_to_end(key)
+        self.metrics.record_group_cache(not owner)
+        if not owner:
+            return future.result()
+
+        try:
+            analysis = self._describe_group(group, frames)
+        except Exception as e:
+            # Failed annotations are not cached, the next review retries them
+            with self.group_annotations_lock:
+                if self.group_annotations.get(key) is future:
+                    del self.group_annotations[key]
+            future.set_exception(e)
+            raise
+        future.set_result(analysis)
+        return analysis
+
+    def _describe_group(self, group: list, frames: dict) -> str:
+        print(f"Analyzing group: {group}")
+        messages = []
+        messages.append({
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": DETAIL_ANNOTATOR_PROMPT,
+                },
+            ]
+        })
+        for k in group:
+            messages.append({
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{self.talk_to_video.vid.frame_data(frames[k])}"
+                        },
+                    },
+                ]
+            })
+        resp = self.talk_to_video.vid.client.chat.completions.create(
+            model=DETAIL_MODEL,
+            messages=messages,
+        )
+        return resp.completion_message.content.text
+
+    @timed('fan_aligned_judgement')
     def fan_aligned_judgement(self, analysis: str):
         """
         Make a judgement using fan-aligned LLM.
+        Returns None if the model gave neither 'true' nor 'false' (no output, or the CLI failed).
         """
-        cmd = ['mlx_lm.generate', '--model', 'mlx-community/Meta-Llama-3.1-8B-Instruct-bf16', '--adapter-path', '/Users/benedict/repo/lora/adapters', '--verbose', 'F', '--prompt', analysis]
+        if self.fan_model is not None:
+            from mlx_lm import generate
+            model, tokenizer = self.fan_model
+            # Same prompt as the CLI, which applies the tokenizer's chat template when it has one
+            prompt = analysis
+            if getattr(tokenizer, 'chat_template', None) is not None:
+                prompt = tokenizer.apply_chat_template([{'role': 'user', 'content': analysis}], tokenize=False,
+                                                       add_generation_prompt=True)
+            with self.fan_model_lock:
+                result = generate(model, tokenizer, prompt=prompt, max_tokens=FAN_ALIGNED_MAX_TOKENS,
+                                  verbose=False).strip()
+            return {'true': True, 'false': False}.get(result)
+
+        cmd = ['mlx_lm.generate', '--model', FAN_ALIGNED_MODEL, '--adapter-path', FAN_ALIGNED_ADAPTER_PATH, '--verbose', 'F',
+               '--max-tokens', str(FAN_ALIGNED_MAX_TOKENS), '--prompt', analysis]
         raw_result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         print(raw_result.stdout)
         print(raw_result.stderr)
         # print(f"Fan aligned judgement: {result}")
 
         result = raw_result.stdout.strip()
-        return result == 'true'
+        if raw_result.returncode != 0:
+            return None
+        return {'true': True, 'false': False}.get(result)
 
+    @timed('make_judgement')
+    @llm_priority('review')
     def make_judgement(self, analyses: Union[str,list]):
         """
         Make a judgement based on generic .
+        Returns None if the judge's answer could not be parsed.
         """
         # print("\n--------------------------------\n".join(analyses))
         # print('--------------------------------')
@@ -158,9 +358,8 @@ class Referee:
         if isinstance(analyses, list):
             analyses = "\n".join(analyses)
 
-        judgement = self.talk_to_video.vid.client.chat.completions.create(
-            model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-            messages=[
+        is_foul_present, judge_text = self.talk_to_video.llama_api.decide(
+            [
                 {
                     "role": "user",
                     "content": [
@@ -171,19 +370,14 @@ class Referee:
                     ]
                 }
             ],
+            foul_clean_parser,
+            model=JUDGE_MODEL,
+            call_type='judgement',
         )
-
-        judge_text = judgement.completion_message.content.text
         print(judge_text)
 
-        
-        if "```FOUL```" in judge_text:
-            is_foul_present =  True
-        elif "```CLEAN```" in judge_text:
-            is_foul_present = False
-        else:
+        if is_foul_present is None:
             print(f"Invalid response!!!!!: {judge_text}")
-            is_foul_present = False
 
         clumped_annotations = "\n----\n".join(analyses)
         # json_annotations = json.dumps(clumped_annotations)
@@ -207,16 +401,22 @@ if __name__ == "__main__":
     # foul = ref.fan_aligned_judgement("The defensive player initiates moderate contact with the offensive player's arm or upper body using his forearm, impeding their progress, and potentially committing a foul. The contact is a result of the defender's attempt to gain an advantageous position or disrupt the opponent's action. The severity is moderate, indicating a deliberate attempt to interfere with the opponent's action.")
     # assert foul == True
 
+    ensemble = EnsembleJudge(ref.judges(), samples={'maverick': 3, 'fan_aligned': 1}, cache=VerdictCache(), metrics=ref.metrics)
+
     res = []
     # # for interesting_ts in [22, 152, 177, 217, 262, 337, 477, 582, 22, 152, 177, 217, 262, 272, 337, 362, 477, 582, 637, 647, 672, 767, 817, 927, 937, 1127, 1132, 1177, 1187]:
     for interesting_ts in [target]:
         summary = ref.look_into_video(interesting_ts, boundry_seconds=2)
-        result = ref.make_judgement(summary)
-        ft_result = ref.fan_aligned_judgement(summary)
+        judgement = ensemble.judge(summary)
+        result = judgement['judges']['maverick']['verdict']
+        ft_result = judgement['judges']['fan_aligned']['verdict']
         print(f"Foul is present (maverick) : {result}")
         print(f"Foul is present (fan aligned / fine tuned) : {ft_result}")
         res.append((interesting_ts, summary, result, ft_result))
 
+    REGISTRY.to_json_lines(os.path.join(base_dir, 'data', 'metrics', 'metrics.jsonl'))
+    print(json.dumps(ref.metrics.summary(), indent=2))
+
     # pipe separated csv
     # import csv
     # with open('res.csv', 'w') as f:
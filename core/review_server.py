@@ -0,0 +1,237 @@
+"""
+Long-running foul review service.
+
+    python core/review_server.py --port 8780
+    python core/review_server.py --unix-socket /tmp/bron-review.sock
+
+    curl -s localhost:8780/review -d '{"video": "nba_2016_finals_6.mp4", "timestamp": 1127}'
+    curl -s --unix-socket /tmp/bron-review.sock http://x/review -d '{"video": "nba_2016_finals_6.mp4", "timestamp": 22}'
+
+    python core/review_server.py --timeline-db data/preproc.db
+    curl -s localhost:8780/review -d '{"video": "nba_2016_finals_6.mp4", "timestamp": 1127, "context_seconds": 3}'
+
+Referees (with their open video captures), the HTTP client and the fan-aligned model are created once and
+reused across requests; summaries are cached per (video, timestamp, boundry_seconds) and verdicts on disk
+per (summary, judge, prompt version).
+
+With --timeline-db, each video's <video_root>/annotations/<name>_annotations.json is materialized into the
+PreprocDB timeline the first time the video is reviewed, verdicts are recorded back, and requests with
+context_seconds are summarized from the stored timeline when it covers the play (see Referee.look_into_video).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core.referree import Referee
+from core.ensemble import EnsembleJudge
+from utils.verdict_cache import VerdictCache
+from utils.preproc_db import PreprocDB
+from utils.llama_api import make_client
+from utils.instrumentation import REGISTRY, percentile
+
+JUDGES = ('maverick', 'fan_aligned')
+
+
+class ReviewService:
+    def __init__(self, video_root: str, client=None, warm_fan_model: bool = True, cache_size: int = 1024,
+                 verdict_cache: VerdictCache = None, samples=1, timeline_db: PreprocDB = None):
+        self.video_root = os.path.abspath(video_root)
+        self.timeline_db = timeline_db
+        self.client = client or make_client()
+        self.warm_fan_model = warm_fan_model
+        self.referees = {}
+        self.ensembles = {}
+        self.verdict_cache = verdict_cache or VerdictCache()
+        self.samples = samples
+        self.referees_lock = threading.Lock()
+        self.summaries = OrderedDict()
+        self.summaries_lock = threading.Lock()
+        self.cache_size = cache_size
+        self.latencies = []
+        self.latencies_lock = threading.Lock()
+
+    def resolve_video(self, video: str) -> str:
+        """Only videos under video_root can be reviewed."""
+        path = os.path.abspath(os.path.join(self.video_root, video))
+        if os.path.commonpath([path, self.video_root]) != self.video_root:
+            raise ValueError(f"Video outside of {self.video_root}: {video}")
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Video not found: {video}")
+        return path
+
+    def referee(self, video_path: str) -> Referee:
+        with self.referees_lock:
+            if video_path not in self.referees:
+                referee = Referee(video_path, client=self.client, keep_open=True, timeline_db=self.timeline_db)
+                if self.timeline_db is not None:
+                    self.materialize(referee)
+                if self.warm_fan_model:
+                    referee.warm_fan_model()
+                self.referees[video_path] = referee
+                self.ensembles[video_path] = EnsembleJudge(referee.judges(), self.samples, self.verdict_cache, metrics=referee.metrics)
+            return self.referees[video_path]
+
+    def materialize(self, referee: Referee):
+        """Loads the video's annotations into the timeline, unless its job already has frame or audio entries."""
+        t2v = referee.talk_to_video
+        job_id = t2v.timeline_job_id(create=False)
+        if job_id is not None and set(self.timeline_db.count_timeline(job_id)) & {'frame', 'audio'}:
+            return
+        annotations_path = os.path.join(self.video_root, 'annotations', f'{t2v.vid.name_no_ext}_annotations.json')
+        if os.path.exists(annotations_path):
+            t2v.load_annotations(annotations_path)
+            print(f"Materialized timeline of {t2v.vid.name_no_ext}: {self.timeline_db.count_timeline(t2v.timeline_job_id())}")
+
+    def summary(self, referee: Referee, video_path: str, timestamp: int, boundry_seconds: int,
+                context_seconds: float = None):
+        key = (video_path, timestamp, boundry_seconds, context_seconds)
+        with self.summaries_lock:
+            if key in self.summaries:
+                self.summaries.move_to_end(key)
+                referee.metrics.record_cache(True)
+                return self.summaries[key], True
+        referee.metrics.record_cache(False)
+        summary = referee.look_into_video(timestamp, boundry_seconds=boundry_seconds, context_seconds=context_seconds)
+        with self.summaries_lock:
+            self.summaries[key] = summary
+            while len(self.summaries) > self.cache_size:
+                self.summaries.popitem(last=False)
+        return summary, False
+
+    def review(self, request: dict) -> dict:
+        started = time.perf_counter()
+        video_path = self.resolve_video(request['video'])
+        timestamp = int(request['timestamp'])
+        boundry_seconds = int(request.get('boundry_seconds', 2))
+        judges = request.get('judges', list(JUDGES))
+        context_seconds = request.get('context_seconds')
+        context_seconds = float(context_seconds) if context_seconds is not None else None
+
+        referee = self.referee(video_path)
+        summary, cached = self.summary(referee, video_path, timestamp, boundry_seconds, context_seconds)
+        judgement = self.ensembles[video_path].judge(summary, judges)
+        verdicts = {name: result['verdict'] for name, result in judgement['judges'].items()}
+        referee.record_verdict(timestamp, boundry_seconds, summary, judgement)
+
+        latency = time.perf_counter() - started
+        with self.latencies_lock:
+            self.latencies.append(latency)
+        return {
+            'video': request['video'],
+            'timestamp': timestamp,
+            'summary': summary,
+            'verdicts': verdicts,
+            'verdict': judgement['verdict'],
+            'summary_cached': cached,
+            'latency_ms': round(latency * 1000, 1),
+        }
+
+    def stats(self) -> dict:
+        with self.latencies_lock:
+            latencies = list(self.latencies)
+        return {
+            'reviews': len(latencies),
+            'latency_ms': {f'p{p}': round(percentile(latencies, p) * 1000, 1) for p in (50, 90, 99)},
+            'videos_open': len(self.referees),
+            'cached_summaries': len(self.summaries),
+            'jobs': [job.summary() for job in list(REGISTRY.jobs.values())],
+        }
+
+    def close(self):
+        for referee in self.referees.values():
+            referee.talk_to_video.vid.close()
+        for ensemble in self.ensembles.values():
+            ensemble.close()
+
+
+def make_handler(service: ReviewService):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            print(format % args)
+
+        def _send(self, status: int, body, content_type: str = 'application/json'):
+            payload = (json.dumps(body) if content_type == 'application/json' else body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == '/stats':
+                self._send(200, service.stats())
+            elif self.path == '/metrics':
+                self._send(200, REGISTRY.to_prometheus(), 'text/plain; version=0.0.4')
+            elif self.path == '/health':
+                self._send(200, {'ok': True})
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def do_POST(self):
+            if self.path != '/review':
+                self._send(404, {'error': 'not found'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                self._send(200, service.review(request))
+            except (KeyError, ValueError, FileNotFoundError) as e:
+                self._send(400, {'error': str(e)})
+            except Exception as e:
+                self._send(500, {'error': str(e)})
+
+    return Handler
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) style address
+        return request, ('unix', 0)
+
+
+def serve(service: ReviewService, host: str = '127.0.0.1', port: int = 8780, unix_socket: str = None):
+    handler = make_handler(service)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ThreadingUnixHTTPServer(unix_socket, handler)
+        print(f"Review service listening on {unix_socket}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        print(f"Review service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8780)
+    parser.add_argument('--unix-socket', default=None)
+    parser.add_argument('--video-root', default=os.path.join(base_dir, 'data'))
+    parser.add_argument('--no-fan-model', action='store_true', help="don't load the fan-aligned model in-process")
+    parser.add_argument('--timeline-db', default=None, help="PreprocDB file holding the per-game timelines")
+    args = parser.parse_args()
+
+    timeline_db = PreprocDB(args.timeline_db) if args.timeline_db else None
+    serve(ReviewService(args.video_root, warm_fan_model=not args.no_fan_model, timeline_db=timeline_db),
+          args.host, args.port, args.unix_socket)
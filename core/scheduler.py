@@ -0,0 +1,273 @@
+import os
+import sys
+import time
+import random
+import socket
+import argparse
+import threading
+import multiprocessing
+import concurrent.futures
+from types import SimpleNamespace
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.lazy import lazy_import
+from utils.llama_api import make_client
+from utils.llama_transport import CompletionStream
+from utils.preproc_db import PreprocDB
+from utils.memory import over_memory_budget
+from utils.video import Video
+
+cv2 = lazy_import('cv2')
+
+DEFAULT_CONTEXT = (
+    "This is a frame of tv footage of a basketball game, you don't need to mention that in your response. "
+    "If the frame is of the basketball game in play and you can see the ball, only focus on the ball handler, what he is doing and how he is being defended."
+)
+
+
+class LeaseLost(RuntimeError):
+    """The worker's lease on a work unit expired or was taken over by another worker."""
+
+
+class DBConcurrencyLimiter:
+    """
+    Hands out the global LLM slots in the shared DB; acquire() blocks until one is free and returns its number,
+    which the caller passes back to release() once the request is done.
+    While all slots are busy it polls with exponential backoff (with jitter) up to max_poll_interval, so
+    waiting workers don't keep competing for the DB write lock with lease claims and renewals.
+    """
+
+    def __init__(self, db: PreprocDB, owner: str, max_slots: int, lease_seconds: float = 120, poll_interval: float = 0.05,
+                 max_poll_interval: float = 1.0):
+        self.db = db
+        self.owner = owner
+        self.max_slots = max_slots
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_poll_interval = max_poll_interval
+
+    def acquire(self) -> int:
+        delay = self.poll_interval
+        while True:
+            slot = self.db.acquire_llm_slot(self.owner, self.max_slots, self.lease_seconds)
+            if slot is not None:
+                return slot
+            time.sleep(delay * random.uniform(0.5, 1.0))
+            delay = min(delay * 2, self.max_poll_interval)
+
+    def release(self, slot: int):
+        self.db.release_llm_slot(slot, self.owner)
+
+
+class LimitedClient:
+    """Wraps a chat completions client so every request holds a limiter slot."""
+
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _create(self, **kwargs):
+        slot = self.limiter.acquire()
+        if not kwargs.get('stream'):
+            try:
+                return self.client.chat.completions.create(**kwargs)
+            finally:
+                self.limiter.release(slot)
+        # A stream holds its slot until it is exhausted or closed, possibly on another thread
+        try:
+            stream = self.client.chat.completions.create(**kwargs)
+        except Exception:
+            self.limiter.release(slot)
+            raise
+        return CompletionStream(stream, on_close=lambda _: self.limiter.release(slot))
+
+
+class Scheduler:
+    """Registers videos as jobs in PreprocDB and splits them into time-range work units."""
+
+    def __init__(self, db_path: str = "data/preproc.db"):
+        self.db = PreprocDB(db_path)
+
+    def register_video(self, video_path: str, unit_seconds: float = 60, seconds_per_frame: float = 1) -> int:
+        """Creates (or reuses) the job for video_path and its work units, returns the job id."""
+        video_path = os.path.abspath(video_path)
+        job = self.db.get_job_by_video_path(video_path)
+        if job is None:
+            video = cv2.VideoCapture(video_path)
+            fps = video.get(cv2.CAP_PROP_FPS)
+            frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            video.release()
+            if fps == 0:
+                raise ValueError(f"Could not determine video FPS: {video_path}")
+            length = frame_count / fps
+            job_id = self.db.create_job(video_path, length, frame_count, 0, fps)
+        else:
+            job_id, length = job.id, job.length
+        units = self.db.create_work_units(job_id, length, unit_seconds)
+        print(f"Registered {video_path} as job {job_id} with {units} work units")
+        return job_id
+
+    def status(self) -> list:
+        return [
+            {'job': job.id, 'video': job.video_path, 'frames': job.process_frame_count,
+             'units': self.db.get_work_progress(job.id)}
+            for job in self.db.list_jobs()
+        ]
+
+
+class Worker:
+    """
+    Claims work units, describes the frames in their time range and stores them in frame_table.
+    The lease is renewed in the background while a unit is processed; if the worker dies the lease
+    expires and another worker picks the unit up again.
+    """
+
+    def __init__(self, db_path: str = "data/preproc.db", worker_id: str = None, seconds_per_frame: float = 1,
+                 context: str = DEFAULT_CONTEXT, llm_slots: int = 20, threads: int = 8,
+                 lease_seconds: float = 300, max_attempts: int = 3):
+        self.db = PreprocDB(db_path)
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.seconds_per_frame = seconds_per_frame
+        self.context = context
+        self.threads = threads
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.client = LimitedClient(make_client(), DBConcurrencyLimiter(self.db, self.worker_id, llm_slots))
+        self.videos = {}
+
+    def _heartbeat(self, unit_id: int, stop: threading.Event, lost: threading.Event):
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.db.renew_lease(unit_id, self.worker_id, self.lease_seconds):
+                print(f"[{self.worker_id}] Lost lease on unit {unit_id}")
+                lost.set()
+                return
+
+    def process_unit(self, unit, lost: threading.Event = None) -> int:
+        """Describes the frames of a unit. Raises LeaseLost as soon as lost is set, before any further frame is stored."""
+        lost = lost or threading.Event()
+
+        def check_lease():
+            if lost.is_set():
+                raise LeaseLost(f"Lease on unit {unit.id} lost")
+
+        job = self.db.get_job(unit.job_id)
+        if job.video_path not in self.videos:
+            self.videos[job.video_path] = Video(job.video_path, client=self.client)
+        vid = self.videos[job.video_path]
+
+        def describe(item):
+            seconds, frame = item
+            check_lease()
+            record = vid.encode_frame(seconds, frame, int(round(seconds * job.framerate)))
+            # A failed description raises, so the unit is failed and retried rather than storing the error text
+            description = vid.describe_frame(seconds, record, self.context, raise_errors=True)
+            # Another worker owns the unit now and is writing these frames itself
+            check_lease()
+            self.db.add_frame(job.id, int(round(seconds * job.framerate)), description, seconds,
+                              {'source': record['source'], 'source_type': 'frame'})
+
+        frames = (
+            (seconds, frame)
+            for seconds, frame in vid.iter_frames(self.seconds_per_frame, unit.start_time, unit.end_time)
+            if seconds < unit.end_time
+        )
+        count = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as executor:
+            # Bound the number of decoded frames waiting for the LLM, tighter past the memory budget
+            pending = set()
+            for item in frames:
+                check_lease()
+                pending.add(executor.submit(describe, item))
+                count += 1
+                if len(pending) >= (self.threads if over_memory_budget() else self.threads * 2):
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            for future in concurrent.futures.as_completed(pending):
+                future.result()
+        self.db.update_job_process_count(job.id, self.db.count_frames(job.id))
+        return count
+
+    def run(self, exit_when_idle: bool = True, idle_sleep: float = 5):
+        """Processes units until none are left (or forever if exit_when_idle is False)."""
+        processed = 0
+        while True:
+            unit = self.db.claim_work_unit(self.worker_id, self.lease_seconds, self.max_attempts)
+            if unit is None:
+                if exit_when_idle:
+                    break
+                time.sleep(idle_sleep)
+                continue
+
+            print(f"[{self.worker_id}] Unit {unit.id}: job {unit.job_id} {unit.start_time:.0f}s-{unit.end_time:.0f}s (attempt {unit.attempts})")
+            stop = threading.Event()
+            lost = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(unit.id, stop, lost), daemon=True)
+            heartbeat.start()
+            try:
+                frames = self.process_unit(unit, lost)
+                if self.db.complete_work_unit(unit.id, self.worker_id):
+                    processed += 1
+                    print(f"[{self.worker_id}] Unit {unit.id} done ({frames} frames)")
+                else:
+                    print(f"[{self.worker_id}] Unit {unit.id} finished after its lease was lost, not counted")
+            except LeaseLost as e:
+                # The unit belongs to another worker (or is pending again), nothing to release
+                print(f"[{self.worker_id}] Unit {unit.id} abandoned: {e}")
+            except Exception as e:
+                print(f"[{self.worker_id}] Unit {unit.id} failed: {e}")
+                self.db.fail_work_unit(unit.id, self.worker_id, str(e), self.max_attempts)
+            finally:
+                stop.set()
+        return processed
+
+
+def _run_worker(kwargs: dict):
+    Worker(**kwargs).run()
+
+
+def run_workers(workers: int, db_path: str = "data/preproc.db", **worker_kwargs):
+    """Starts local worker processes and waits for them to drain the queue."""
+    processes = []
+    for i in range(workers):
+        kwargs = dict(worker_kwargs, db_path=db_path, worker_id=f"{socket.gethostname()}-w{i}-{os.getpid()}")
+        process = multiprocessing.Process(target=_run_worker, args=(kwargs,), name=kwargs['worker_id'])
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-game annotation scheduler")
+    parser.add_argument('--db', default=os.path.join('data', 'preproc.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    register = sub.add_parser('register', help="register videos as jobs")
+    register.add_argument('videos', nargs='+')
+    register.add_argument('--unit-seconds', type=float, default=60)
+
+    work = sub.add_parser('work', help="run local worker processes")
+    work.add_argument('--workers', type=int, default=4)
+    work.add_argument('--llm-slots', type=int, default=20, help="global concurrent LLM requests across all workers")
+    work.add_argument('--threads', type=int, default=8, help="describe threads per worker")
+    work.add_argument('--seconds-per-frame', type=float, default=1)
+    work.add_argument('--lease-seconds', type=float, default=300)
+
+    sub.add_parser('status', help="show job progress")
+    args = parser.parse_args()
+
+    if args.command == 'register':
+        scheduler = Scheduler(args.db)
+        for video in args.videos:
+            scheduler.register_video(video, unit_seconds=args.unit_seconds)
+    elif args.command == 'work':
+        run_workers(args.workers, args.db, llm_slots=args.llm_slots, threads=args.threads,
+                    seconds_per_frame=args.seconds_per_frame, lease_seconds=args.lease_seconds)
+    else:
+        for job in Scheduler(args.db).status():
+            print(job)
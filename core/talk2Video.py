@@ -1,24 +1,98 @@
 import os
+import re
 import json
 import sys
 import time
-import numpy as np
 import concurrent.futures
 from dotenv import load_dotenv
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils.llama_api import LlamaAPI
+from utils.llama_api import LlamaAPI, make_client, yes_no_parser, llm_priority, BudgetExceeded
 from utils.video import Video
 from utils.audio import Audio
+from utils.instrumentation import timed, REGISTRY
+from utils.memory import over_memory_budget
+from utils.annotation_merge import merge_annotations, iter_annotation_dict
+from utils.annotation_compact import compact_annotations, context_tokens
+from utils.preproc_db import PreprocDB, TimelineEntry, TIMELINE_MAX_SPAN
+
+# Estimated tokens of the fixed event check instructions, on top of the event definitions and the window context
+EVENT_CHECK_PROMPT_TOKENS = 150
+# Result of a window check refused by the BudgetGovernor
+UNCHECKED = object()
 
 
 class Talk2Video:
-    def __init__(self, video_filepath: str):
+    def __init__(self, video_filepath: str, client=None, keep_open: bool = False, compact_context: bool = False,
+                 timeline_db: PreprocDB = None):
         self.video_filepath = video_filepath
-        self.vid = Video(self.video_filepath)
-        self.llama_api = LlamaAPI()
+        self.vid = Video(self.video_filepath, client=client or make_client(), keep_open=keep_open)
+        self.metrics = self.vid.metrics
+        self.llama_api = LlamaAPI(self.vid.client, self.metrics)
+        # With compact_context, annotation windows and chunks go through utils.annotation_compact before they are
+        # sent. Off by default: compaction is lossy, keep it off until benchmarks/compaction_parity.py passes
+        # against real answers
+        self.compact_context = compact_context
+        # With a timeline_db, loaded annotations and event hits are materialized in its timeline table
+        self.timeline_db = timeline_db
+        self._timeline_job_id = None
+
+    def timeline_job_id(self, create: bool = True) -> int:
+        """
+        The PreprocDB job of this video, created the way Scheduler.register_video does if there is none yet
+        (or None without create).
+        """
+        if self._timeline_job_id is None:
+            video_path = os.path.abspath(self.video_filepath)
+            job = self.timeline_db.get_job_by_video_path(video_path)
+            if job is None:
+                if not create:
+                    return None
+                fps, frame_count = self.vid.probe()
+                if fps == 0:
+                    raise ValueError(f"Could not determine video FPS: {video_path}")
+                self._timeline_job_id = self.timeline_db.create_job(video_path, frame_count / fps, frame_count, 0, fps)
+            else:
+                self._timeline_job_id = job.id
+        return self._timeline_job_id
+
+    @timed('materialize_timeline')
+    def materialize_timeline(self) -> dict:
+        """
+        Writes the loaded frame and audio annotations, plus any frames Scheduler workers stored in frame_table,
+        to the timeline of this video's job, leaving out failed frame descriptions. Returns the number of
+        timeline entries per kind.
+        """
+        job_id = self.timeline_job_id()
+        entries = []
+        for timestamp, annotation in self.annotations.items():
+            if annotation.get('source_type') == 'audio':
+                kind = 'audio'
+                start, end = float(annotation.get('start', timestamp)), float(annotation.get('end', timestamp))
+            elif annotation.get('annotation', '').startswith('Error:'):
+                # A frame describe_frames failed on, its error text is no context
+                continue
+            else:
+                kind = 'frame'
+                start = end = float(timestamp)
+            extra = {k: v for k, v in annotation.items() if k not in ('annotation', 'data', 'start', 'end')}
+            entries.append(TimelineEntry(job_id, kind, start, end, annotation.get('annotation', ''), structured_data=extra))
+        self.timeline_db.add_timeline_entries(entries)
+        self.timeline_db.materialize_frames(job_id)
+        return self.timeline_db.count_timeline(job_id)
+
+    def _record_event_hits(self, name: str, event: str, hits: list, window_length: float):
+        """Stores the windows where an event was detected as 'event' timeline entries."""
+        if self.timeline_db is None or not hits:
+            return
+        job_id = self.timeline_job_id()
+        # Windows widened by a tight LLM budget are stored at most TIMELINE_MAX_SPAN long
+        length = min(window_length, TIMELINE_MAX_SPAN)
+        self.timeline_db.add_timeline_entries(
+            TimelineEntry(job_id, 'event', start, start + length, event.strip(), label=name) for start in hits)
     
+    @timed('annotate_video')
     def annotate_video(self, seconds_per_frame: int = 1, context: str = None):
         """Annotates a video file."""
 
@@ -31,14 +105,21 @@ class Talk2Video:
             context = context,
             threads=10)
         self.save_annotations(frames, os.path.join("data", "annotations", f"{self.vid.name_no_ext}_annotations_vid.json"))
+        return frames
 
+    @timed('annotate_audio')
     def annotate_audio(self):
 
         # 1. Extract audio
-        audio_output = os.path.join('data' 'audio', f'{self.vid.name_no_ext}.wav')
+        audio_output = os.path.join('data', 'audio', f'{self.vid.name_no_ext}.wav')
         self.vid.extract_audio(audio_output)
 
         # 2. Transcribe audio
+        return self.transcribe_audio(audio_output)
+
+    @timed('transcribe_audio')
+    def transcribe_audio(self, audio_output: str) -> dict:
+        """Transcribes an extracted WAV file into audio annotations keyed by segment midpoint."""
         audio = Audio(audio_output)
         transcription = audio.transcribe()
         transcription_segments = transcription.get('segments', [])
@@ -59,23 +140,51 @@ class Talk2Video:
 
         # Save to a JSON file
         self.save_annotations(frames, os.path.join("data", "annotations", f"{self.vid.name_no_ext}_annotations_audio.json"))
+        return frames
 
-    def compile_annotaions(self, video_annotations, audio_annotations):
-        """Compiles video and audio annotations into a single dictionary."""
-        compiled_annotations = {}
-        for timestamp, annotation in video_annotations.items():
-            # Exclude 'data' key from annotation if present
-            annotation_no_data = {k: v for k, v in annotation.items() if k != 'data'}
-            compiled_annotations[timestamp] = annotation_no_data
-
-        for timestamp, annotation in audio_annotations.items():
-            if timestamp not in compiled_annotations:
-                compiled_annotations[timestamp] = annotation
-            else:
-                # If both video and audio annotations exist at the same timestamp, merge them
-                compiled_annotations[timestamp].update(annotation)
-
-        self.save_annotations(compiled_annotations, os.path.join("data", "annotations", f"{self.vid.name_no_ext}_annotations.json"))
+    @timed('annotate')
+    def annotate(self, seconds_per_frame: int = 1, context: str = None):
+        """
+        Annotates video and audio concurrently.
+        ffmpeg extracts the audio in the background while frames are extracted and described; transcription
+        starts as soon as ffmpeg exits. The compiled annotation file is written as each side finishes.
+        """
+        audio_output = os.path.join('data', 'audio', f'{self.vid.name_no_ext}.wav')
+        ffmpeg = self.vid.extract_audio_async(audio_output)
+
+        def audio_side():
+            with self.metrics.stage('extract_audio'):
+                returncode = ffmpeg.wait()
+            if returncode != 0:
+                raise RuntimeError(f"ffmpeg exited with code {returncode} extracting {audio_output}")
+            return self.transcribe_audio(audio_output)
+
+        results = {'video': {}, 'audio': {}}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            futures = {
+                executor.submit(self.annotate_video, seconds_per_frame, context): 'video',
+                executor.submit(audio_side): 'audio',
+            }
+            for future in concurrent.futures.as_completed(futures):
+                side = futures[future]
+                try:
+                    results[side] = future.result()
+                except Exception as e:
+                    print(f"Error annotating {side}: {e}")
+                    continue
+                print(f"Finished {side} annotations, updating compiled annotations")
+                self.compile_annotaions(video_annotations=results['video'], audio_annotations=results['audio'])
+        return self.annotations
+
+    def compile_annotaions(self, video_annotations, audio_annotations, tolerance: float = 0.5):
+        """
+        Merges video and audio annotations into a single timeline file.
+        Audio segments keep their own entry and frames overlapping a segment (within tolerance) reference it.
+        """
+        output_path = os.path.join("data", "annotations", f"{self.vid.name_no_ext}_annotations.json")
+        merge_annotations(output_path, [iter_annotation_dict(video_annotations)],
+                          [iter_annotation_dict(audio_annotations)], tolerance)
+        self.load_annotations(output_path)
 
     def save_annotations(self, annotations, output_path):
         """Saves the annotations to a JSON file."""
@@ -84,6 +193,7 @@ class Talk2Video:
         self.annotations = dict(sorted(annotations.items(), key=lambda item: float(item[0])))
         print(f"Frame metadata saved to {output_path}")
 
+    @timed('load_annotations')
     def load_annotations(self, annotations_path: str) -> dict:
         """Load annotations from a JSON file."""
         self.annotations_path = annotations_path
@@ -92,11 +202,27 @@ class Talk2Video:
         
         with open(self.annotations_path, 'r') as f:
             annot =  dict(sorted(json.load(f).items(), key=lambda item: float(item[0])))
+            if over_memory_budget():
+                # Past the memory budget, don't hold base64 frames saved along with annotations (they stay in the file)
+                for annotation in annot.values():
+                    annotation.pop('data', None)
             self.annotations = annot
             # Create a smaller version of self.annotations: {timestamp: annotation}
         self.simple_annotations = {str(k): v.get("annotation", "") for k, v in self.annotations.items()}
+        if self.timeline_db is not None:
+            self.materialize_timeline()
         return annot
     
+    def _context_annotations(self, annotations: dict) -> dict:
+        """The annotations as they are sent to the LLM, compacted if compact_context is on."""
+        if not self.compact_context:
+            self.metrics.record_context(context_tokens(annotations), context_tokens(annotations))
+            return annotations
+        compacted = compact_annotations(annotations)
+        self.metrics.record_context(context_tokens(annotations), context_tokens(compacted))
+        return compacted
+
+    @timed('chunk_annotations')
     def chunk_annotations(self, annotations:dict, token_limit: int = 128000) -> list:
         """
         Splits a dictionary into a list of dictionaries, each not exceeding the token_limit
@@ -121,13 +247,15 @@ class Talk2Video:
             sub_dicts.append(current_dict)
         return sub_dicts
     
+    @timed('summarize_annotations')
+    @llm_priority('summary')
     def summarize_annotations(self) -> str:
         """
         Use the annotations as context and ask llama_api to create a high-level summary of the video.
         """
 
         # Split simple_annotations into chunks that fit within the token limit
-        annotation_chunks = self.chunk_annotations(annotations = self.simple_annotations, token_limit=120000)
+        annotation_chunks = self.chunk_annotations(annotations = self._context_annotations(self.simple_annotations), token_limit=120000)
 
         summaries = []
         for i, chunk in enumerate(annotation_chunks):
@@ -169,11 +297,96 @@ class Talk2Video:
         response = self.llama_api.ask(final_messages, model='Llama-4-Maverick-17B-128E-Instruct-FP8')
         return aggregated_summary
         
-    def look_for_event(self, event: str, window_length:int = 5, search_start:int=0, search_end=np.inf) -> list:
+    def _window_annotations(self, start: float, end: float) -> dict:
+        """Returns the simple annotations with start <= timestamp < end."""
+        return {k: v for k, v in self.simple_annotations.items() if start <= float(k) < end}
+
+    def _window_starts(self, timestamps: list, window_length: int, candidates: list = None,
+                       prompt_tokens: int = 0) -> tuple:
+        """
+        (window_length, window starts) covering the timestamps. If the client's BudgetGovernor can't afford a
+        check per window, windows are widened until they fit, so the whole range is still searched. If no
+        window size fits, the original windows are returned and checked until the budget runs out.
+        Token limits are planned with the estimated tokens of a window's context plus prompt_tokens for the
+        instructions, so they work before any request has finished.
+        """
+        def starts(length):
+            return [
+                start
+                for start in range(int(min(timestamps)), int(max(timestamps)) + 1, length)
+                if candidates is None or any(start <= c < start + length for c in candidates)
+            ]
+
+        window_starts = starts(window_length)
+        governor = getattr(self.vid.client, 'governor', None)
+        if governor is None or not window_starts:
+            return window_length, window_starts
+        first, last = min(timestamps), max(timestamps)
+        span = max(1.0, last - first + 1)
+        context = self.llama_api.estimate_tokens(json.dumps(
+            {k: v for k, v in self.simple_annotations.items() if first <= float(k) <= last}))
+        length = window_length
+        while True:
+            try:
+                step = governor.plan(len(window_starts), 'detect',
+                                     tokens_per_request=int(context * min(1.0, length / span)) + prompt_tokens)
+            except BudgetExceeded:
+                # Not even the whole range as a single window fits (e.g. a token limit, which wider windows barely
+                # help). Check windows in order until the budget runs out, the rest are returned as unchecked
+                print("LLM budget can't cover the whole range, checking windows until it runs out")
+                return window_length, starts(window_length)
+            if step == 1:
+                break
+            # Wider windows save the instructions, not the context, so re-plan with the new window size
+            length *= step
+            window_starts = starts(length)
+        if length != window_length:
+            print(f"LLM budget is tight, widening {window_length}s windows to {length}s")
+        return length, window_starts
+
+    def _unchecked_windows(self, window_length: int, unchecked: list) -> list:
+        """(start, end) of the windows refused by the BudgetGovernor, also set as the windows_unchecked gauge."""
+        if unchecked:
+            print(f"LLM budget ran out, {len(unchecked)} windows left unchecked")
+        self.metrics.set_gauge('windows_unchecked', len(unchecked))
+        return [(start, start + window_length) for start in unchecked]
+
+    @llm_priority('detect')
+    def _event_in_window(self, event: str, window_annotations: dict) -> bool:
+        """Asks the LLM whether the event happens within the given window of annotations."""
+        if not window_annotations:
+            return False
+        context = json.dumps(self._context_annotations(window_annotations))
+        messages = [
+            {
+            "role": "system",
+            "content": (
+                "You are an expert event detector. The user will provide you with a set of video annotations from any domain.\n"
+                "Your task is to determine whether a specific event occurred within the video based solely on these annotations.\n"
+                "The event to check for is: " + event + "\n"
+                "Remember the annotations are sampled, so they may not cover every frame of the video.\n"
+                "Respond with only 'yes' if it looks the event is very likely to have occured within the video window, otherwise respond with only 'no'."
+            ),
+            },
+            {
+            "role": "user",
+            "content": context
+            }
+        ]
+        answer, _ = self.llama_api.decide(messages, yes_no_parser, model='Llama-4-Maverick-17B-128E-Instruct-FP8',
+                                          call_type='event_check')
+        return bool(answer)
+
+    @timed('look_for_event')
+    def look_for_event(self, event: str, window_length:int = 5, search_start:int=0, search_end=float('inf'), candidates: list = None,
+                       event_name: str = None) -> tuple:
         """
         Compiles annotations within a specified window range.
         Checks if the event is present within the window range.
-        Returns a list of timestamps where the event occurs.
+        If candidates (e.g. from utils.motion.MotionDetector) are given, only windows containing a candidate are checked.
+        With a timeline_db the windows with a hit are stored as event_name (default: the start of the event text).
+        Returns (timestamps, unchecked): the window midpoints where the event occurs, and the (start, end)
+        windows refused by the client's BudgetGovernor, which are skipped rather than reported as detections.
         """
 
         timestamps = [float(ts) for ts in self.simple_annotations.keys()]
@@ -181,48 +394,216 @@ class Talk2Video:
         event_timestamps = []
 
         # Create windows by looping through the timestamps
-        def search_window(args):
-            start, window_length, event, simple_annotations = args
-            end = start + window_length
-            window_annotations = {
-                k: v for k, v in simple_annotations.items() if start <= float(k) < end
-            }
-            if window_annotations:
-                context = json.dumps(window_annotations)
-                messages = [
-                    {
-                    "role": "system",
-                    "content": (
-                        "You are an expert event detector. The user will provide you with a set of video annotations from any domain.\n"
-                        "Your task is to determine whether a specific event occurred within the video based solely on these annotations.\n"
-                        "The event to check for is: " + event + "\n"
-                        "Remember the annotations are sampled, so they may not cover every frame of the video.\n"
-                        "Respond with only 'yes' if it looks the event is very likely to have occured within the video window, otherwise respond with only 'no'."
-                    ),
-                    },
-                    {
-                    "role": "user",
-                    "content": context
-                    }
-                ]
-            response = self.llama_api.ask(messages, model='Llama-4-Maverick-17B-128E-Instruct-FP8')
-            result = response.completion_message.content.text.strip().lower() if hasattr(response, "completion_message") else str(response).strip().lower()
-
-            if "yes" in result:
-                return start + window_length // 2  # Add the midpoint of the window
+        def search_window(start):
+            try:
+                if self._event_in_window(event, self._window_annotations(start, start + window_length)):
+                    return start + window_length // 2  # Add the midpoint of the window
+            except BudgetExceeded:
+                return UNCHECKED
             return None
 
-        window_args = [
-            (start, window_length, event, self.simple_annotations)
-            for start in range(int(min(timestamps)), int(max(timestamps)) + 1, window_length)
-        ]
+        window_length, window_starts = self._window_starts(
+            timestamps, window_length, candidates, self.llama_api.estimate_tokens(event) + EVENT_CHECK_PROMPT_TOKENS)
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-            results = list(executor.map(search_window, window_args))
+            results = list(executor.map(search_window, window_starts))
+
+        unchecked = self._unchecked_windows(window_length,
+                                            [start for start, r in zip(window_starts, results) if r is UNCHECKED])
+        hits = [(start, r) for start, r in zip(window_starts, results) if r is not None and r is not UNCHECKED]
+        event_timestamps.extend([r for _, r in hits])
+        self._record_event_hits(event_name or " ".join(event.split())[:120], event, [start for start, _ in hits],
+                                window_length)
+        return event_timestamps, unchecked
+
+    @llm_priority('detect')
+    def _events_in_window(self, events: dict, window_annotations: dict) -> dict:
+        """Asks the LLM which of the named events happen within the window, in a single request."""
+        if not window_annotations:
+            return {name: False for name in events}
+        definitions = "\n".join(f'"{name}": {description.strip()}' for name, description in events.items())
+        answer_format = json.dumps({name: "yes or no" for name in events})
+        messages = [
+            {
+            "role": "system",
+            "content": (
+                "You are an expert event detector. The user will provide you with a set of video annotations from any domain.\n"
+                "Your task is to determine which of several events occurred within the video based solely on these annotations.\n"
+                "The events to check for are:\n" + definitions + "\n"
+                "Remember the annotations are sampled, so they may not cover every frame of the video.\n"
+                "For each event answer 'yes' only if it looks very likely to have occured within the video window, otherwise 'no'.\n"
+                "Respond with only a JSON object in this format: " + answer_format
+            ),
+            },
+            {
+            "role": "user",
+            "content": json.dumps(self._context_annotations(window_annotations))
+            }
+        ]
+        response = self.llama_api.ask(messages, model='Llama-4-Maverick-17B-128E-Instruct-FP8', call_type='events_check',
+                                      max_tokens=max(self.llama_api.max_tokens['events_check'], 16 * len(events)))
+        text = response.completion_message.content.text if hasattr(response, "completion_message") else str(response)
+        return self._parse_event_labels(text, events)
+
+    @staticmethod
+    def _parse_event_labels(text: str, events: dict) -> dict:
+        """Reads {"event": "yes"/"no"} answers, tolerating extra prose around the JSON object."""
+        labels = {}
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        if match:
+            try:
+                parsed = json.loads(match.group(0))
+                labels = {str(k): str(v).strip().lower() in ("yes", "true") for k, v in parsed.items()}
+            except json.JSONDecodeError:
+                labels = {}
+        for name in events:
+            if name not in labels:
+                found = re.search(rf'"?{re.escape(name)}"?\s*:\s*"?(yes|no|true|false)', text, re.IGNORECASE)
+                labels[name] = bool(found) and found.group(1).lower() in ("yes", "true")
+        return {name: labels[name] for name in events}
+
+    @timed('look_for_events')
+    def look_for_events(self, events: dict, window_length: int = 5, search_start: int = 0, search_end=float('inf'),
+                        candidates: list = None) -> tuple:
+        """
+        Multi-event version of look_for_event.
+        events maps a short name to the event description. Each window is sent once with all the
+        definitions and a structured yes/no answer per event is requested.
+        Returns (timeline, unchecked): {event name: [window midpoints where the event occurs]}, and the
+        (start, end) windows refused by the client's BudgetGovernor, as in look_for_event.
+        """
 
-        event_timestamps.extend([r for r in results if r is not None])
-        return event_timestamps
+        timestamps = [float(ts) for ts in self.simple_annotations.keys()]
+        timestamps = [ts for ts in timestamps if search_start <= ts < search_end]
+        if not timestamps:
+            return {name: [] for name in events}, []
+
+        def search_window(start):
+            try:
+                return start, self._events_in_window(events, self._window_annotations(start, start + window_length))
+            except BudgetExceeded:
+                return start, UNCHECKED
+
+        definitions = sum(self.llama_api.estimate_tokens(name + description) for name, description in events.items())
+        window_length, window_starts = self._window_starts(timestamps, window_length, candidates,
+                                                           definitions + EVENT_CHECK_PROMPT_TOKENS)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
+            results = list(executor.map(search_window, window_starts))
+
+        unchecked = self._unchecked_windows(window_length, [start for start, labels in results if labels is UNCHECKED])
+        results = [(start, labels) for start, labels in results if labels is not UNCHECKED]
+        timeline = {name: [] for name in events}
+        for start, labels in results:
+            for name, hit in labels.items():
+                if hit:
+                    timeline[name].append(start + window_length // 2)
+        for name in events:
+            self._record_event_hits(name, events[name], [start for start, labels in results if labels[name]], window_length)
+        return timeline, unchecked
+
+    def _densify_window(self, start: float, end: float, seconds_per_frame: float, context: str = None):
+        """Describes extra frames inside [start, end) and adds them to the loaded annotations."""
+        frames = self.vid.cut_frames(start, end, seconds_per_frame=seconds_per_frame)
+        frames = self.vid.describe_frames(frames, context=context, threads=len(frames) or 1)
+        for seconds, frame in frames.items():
+            if start <= seconds < end:
+                annotation = {k: v for k, v in frame.items() if k != 'data'}
+                self.annotations[str(seconds)] = annotation
+                self.simple_annotations[str(seconds)] = annotation.get('annotation', '')
+
+    @timed('look_for_event_intervals')
+    def look_for_event_intervals(self, event: str, coarse_window: float = 60, target_resolution: float = 2,
+                                 split_factor: int = 4, max_calls: int = None, search_start: float = 0,
+                                 search_end=float('inf'), dense_seconds_per_frame: float = None,
+                                 context: str = None, threads: int = 10) -> tuple:
+        """
+        Coarse-to-fine event search.
+        Checks large windows first, then splits only the windows where the event was found into split_factor
+        sub-windows, until windows are target_resolution seconds long.
+        If dense_seconds_per_frame is set, sub-windows with fewer than two annotations get extra frames described
+        via cut_frames before being checked.
+        At most max_calls window checks are made (fewer if the client's BudgetGovernor can't afford them).
+        Returns (intervals, unchecked): the sorted, merged (start, end) intervals in seconds where the event was
+        confirmed at target_resolution, and the windows left unchecked when the budget ran out. Unchecked windows
+        are never reported as detections.
+        """
 
+        timestamps = [float(ts) for ts in self.simple_annotations.keys()]
+        timestamps = [ts for ts in timestamps if search_start <= ts < search_end]
+        if not timestamps:
+            return [], []
+
+        first, last = min(timestamps), max(timestamps)
+        level = []
+        start = first
+        while start <= last:
+            level.append((start, min(start + coarse_window, search_end)))
+            start += coarse_window
+
+        calls = 0
+        intervals = []
+        unchecked = []
+        governor = getattr(self.vid.client, 'governor', None)
+        while level:
+            affordable = float('inf') if max_calls is None else max_calls - calls
+            if governor is not None:
+                affordable = min(affordable, governor.affordable('detect'))
+            if len(level) > affordable:
+                # Out of budget: check what we can, the rest are returned as unchecked
+                affordable = max(0, int(affordable))
+                unchecked.extend(level[affordable:])
+                level = level[:affordable]
+                if not level:
+                    break
+
+            if dense_seconds_per_frame:
+                for window_start, window_end in level:
+                    if len(self._window_annotations(window_start, window_end)) < 2:
+                        self._densify_window(window_start, window_end, dense_seconds_per_frame, context)
+
+            def check(window):
+                try:
+                    return self._event_in_window(event, self._window_annotations(*window))
+                except BudgetExceeded:
+                    return UNCHECKED
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                found = list(executor.map(check, level))
+            calls += len(level)
+
+            next_level = []
+            for (window_start, window_end), hit in zip(level, found):
+                if hit is UNCHECKED:
+                    # Refused by the governor after all (e.g. a token limit), never split or reported
+                    unchecked.append((window_start, window_end))
+                    continue
+                if not hit:
+                    continue
+                length = window_end - window_start
+                if length <= target_resolution:
+                    intervals.append((window_start, window_end))
+                    continue
+                step = max(target_resolution, length / split_factor)
+                sub_start = window_start
+                while sub_start < window_end:
+                    next_level.append((sub_start, min(sub_start + step, window_end)))
+                    sub_start += step
+            level = next_level
+
+        print(f"Coarse-to-fine search made {calls} window checks")
+
+        # Merge touching intervals into single events
+        merged = []
+        for interval_start, interval_end in sorted(intervals):
+            if merged and interval_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+            else:
+                merged.append((interval_start, interval_end))
+        if unchecked:
+            print(f"Budget ran out with {len(unchecked)} windows unchecked")
+        self.metrics.set_gauge('windows_unchecked', len(unchecked))
+        return merged, sorted(unchecked)
 
 
 
@@ -242,6 +623,9 @@ if __name__ == "__main__":
     
     # talk2video.annotate_audio()
 
+    ##### OR BOTH AT ONCE #####
+    # talk2video.annotate(seconds_per_frame=1, context="This is a frame of tv footage of a basketball game.")
+
     # talk2video.compile_annotaions(
     #     video_annotations=json.load(open(os.path.join("data", "annotations", f"{talk2video.vid.name_no_ext}_annotations_vid.json"), 'r')),
     #     audio_annotations=json.load(open(os.path.join("data", "annotations", f"{talk2video.vid.name_no_ext}_annotations_audio.json"), 'r'))
@@ -256,7 +640,7 @@ if __name__ == "__main__":
     fouls = []
     for i in range(1, 2):
         print(i)
-        fouls_window = talk2video.look_for_event("""
+        fouls_window, _ = talk2video.look_for_event("""
                 • Illegal contact with the shooter's arms, wrist, or hand on the ball
                 • Body-to-body displacement that affects balance or verticality
                 • Defender invading the shooter's landing space (counter to rule 10-IV-f)
@@ -269,3 +653,5 @@ if __name__ == "__main__":
         fouls.extend(fouls_window)
         time.sleep(20)
         print(fouls)
+
+    REGISTRY.to_json_lines(os.path.join(base_dir, 'data', 'metrics', 'metrics.jsonl'))
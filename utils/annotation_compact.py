@@ -0,0 +1,127 @@
+"""
+Compacts {timestamp: annotation} dicts before they are sent to the LLM as window or chunk context.
+
+    python utils/annotation_compact.py data/annotations/game_20_annotations.json --window-length 5
+
+Timestamps are rounded, boilerplate phrasing ("The image shows", markdown bullets, ...) is stripped (hedges
+such as "it appears that" are kept), and runs of consecutive near-duplicate annotations (Jaccard similarity
+of their word shingles) collapse into a single "start-end" range keyed entry holding the first annotation
+of the run.
+
+Talk2Video only compacts with compact_context=True. It is off by default until benchmarks/compaction_parity.py
+shows unchanged detections against real answers.
+"""
+import os
+import re
+import sys
+import json
+import math
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+BOILERPLATE_PATTERNS = [
+    # Markdown emphasis, headings and bullets
+    r"\*\*|__|^\s*#+\s*|^\s*(?:[\*\-•]|\d+\.)\s+",
+    r"^\s*(?:key elements|overall|in summary|summary)\s*:\s*",
+    # Openers describing the medium rather than the play. Hedges ("it appears that", "appears to show") are
+    # kept, stripping them would turn uncertain annotations into assertions
+    r"\b(?:the|this) (?:image|frame|picture|photo|screenshot|scene|still) "
+    r"(?:shows|depicts|features|captures|displays|showcases|presents|is of|illustrates)\s+",
+    r"\b(?:in|within|of) (?:the|this) (?:image|frame|picture|photo|screenshot)\b",
+]
+_BOILERPLATE = [re.compile(pattern, re.IGNORECASE | re.MULTILINE) for pattern in BOILERPLATE_PATTERNS]
+
+STOPWORDS = frozenset(
+    "a an the and or of in on at to with is are was were be been being his her their its it this that these "
+    "those as by for from while which who appears appear seems likely possibly".split()
+)
+
+
+def strip_boilerplate(text: str) -> str:
+    for pattern in _BOILERPLATE:
+        text = pattern.sub("", text)
+    text = re.sub(r"\s+([.,;:])", r"\1", re.sub(r"\s+", " ", text)).strip(" ,;")
+    return text[:1].upper() + text[1:]
+
+
+def shingles(text: str, size: int = 2) -> frozenset:
+    """Word size-grams of the text, ignoring case, punctuation and stopwords."""
+    words = [w for w in re.findall(r"[a-z0-9']+", text.lower()) if w not in STOPWORDS]
+    return frozenset(tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1)))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 1.0
+
+
+def compact_annotations(annotations: dict, decimals: int = 1, threshold: float = 0.5, shingle_size: int = 2) -> dict:
+    """
+    Returns a compacted copy of {timestamp: annotation text}, ordered by time.
+    Each annotation is compared with the first annotation of the current run, so a slowly changing scene
+    doesn't drift into one long range. threshold > 1 disables collapsing.
+    """
+    runs = []
+    for timestamp, text in sorted(annotations.items(), key=lambda item: float(item[0])):
+        text = strip_boilerplate(text or "")
+        if not text:
+            continue
+        seconds = float(timestamp)
+        text_shingles = shingles(text, shingle_size)
+        if runs and jaccard(runs[-1][3], text_shingles) >= threshold:
+            runs[-1][1] = seconds
+            continue
+        runs.append([seconds, seconds, text, text_shingles])
+
+    compacted = {}
+    for start, end, text, _ in runs:
+        first, last = f"{start:.{decimals}f}", f"{end:.{decimals}f}"
+        key = first if first == last else f"{first}-{last}"
+        # Different annotations that round to the same timestamp (a frame and an audio segment) are kept together
+        compacted[key] = f"{compacted[key]}\n{text}" if key in compacted else text
+    return compacted
+
+
+def context_tokens(annotations: dict) -> int:
+    """Tokens of the JSON context the LLM receives, with the same 4 chars per token estimate as LlamaAPI."""
+    return math.ceil(len(json.dumps(annotations)) / 4)
+
+
+def window_reduction(annotations: dict, window_length: float = 5, **kwargs) -> list:
+    """(window start, raw tokens, compact tokens) for each look_for_event window over the annotations."""
+    timestamps = sorted(float(ts) for ts in annotations)
+    windows = []
+    if not timestamps:
+        return windows
+    for start in range(int(timestamps[0]), int(timestamps[-1]) + 1, int(window_length)):
+        window = {k: v for k, v in annotations.items() if start <= float(k) < start + window_length}
+        if window:
+            windows.append((start, context_tokens(window), context_tokens(compact_annotations(window, **kwargs))))
+    return windows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('annotations', nargs='+', help="annotation .json files")
+    parser.add_argument('--window-length', type=float, default=5)
+    parser.add_argument('--decimals', type=int, default=1)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    args = parser.parse_args()
+
+    for path in args.annotations:
+        with open(path, 'r') as f:
+            simple = {k: v.get('annotation', '') for k, v in json.load(f).items()}
+        windows = window_reduction(simple, args.window_length, decimals=args.decimals, threshold=args.threshold)
+        raw = sum(w[1] for w in windows)
+        compact = sum(w[2] for w in windows)
+        reductions = sorted(1 - c / r for _, r, c in windows if r)
+        print(json.dumps({
+            'annotations': path,
+            'windows': len(windows),
+            'raw_tokens': raw,
+            'compact_tokens': compact,
+            'reduction': round(1 - compact / raw, 3) if raw else 0.0,
+            'window_reduction_p50': round(reductions[len(reductions) // 2], 3) if reductions else 0.0,
+            'whole_game_reduction': round(1 - context_tokens(compact_annotations(simple, args.decimals, args.threshold))
+                                          / context_tokens(simple), 3) if simple else 0.0,
+        }))
@@ -0,0 +1,174 @@
+import os
+import sys
+import json
+import heapq
+import argparse
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+def iter_annotation_dict(annotations: dict):
+    """Yields (timestamp, annotation) from an in-memory annotation dict in time order, without 'data' payloads."""
+    for key in sorted(annotations, key=float):
+        yield float(key), {k: v for k, v in annotations[key].items() if k != 'data'}
+
+
+def iter_json_annotations(path: str):
+    """
+    Yields (timestamp, annotation) from an annotation file in time order.
+    .jsonl files ({"timestamp": ..., ...} per line, written in time order) are streamed line by line.
+    .json dict files are parsed and sorted whole (their keys aren't guaranteed to be in time order), so the
+    whole file is held in memory while it is merged; use .jsonl for inputs too large for that.
+    """
+    if path.endswith('.jsonl'):
+        with open(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield float(record.pop('timestamp')), record
+        return
+    with open(path, 'r') as f:
+        annotations = json.load(f)
+    yield from iter_annotation_dict(annotations)
+
+
+def iter_db_frames(db, job_id: int):
+    """Yields (timestamp, annotation) for the described frames of a PreprocDB job, streamed from the DB."""
+    for frame in db.iter_frames_for_job(job_id):
+        annotation = {'source_type': 'frame', 'annotation': frame.description, 'frame_number': frame.frame_number}
+        if frame.structured_data:
+            annotation.update(frame.structured_data)
+        yield frame.video_timestamp, annotation
+
+
+def _audio_key(annotation: dict, timestamp: float) -> tuple:
+    """(start, end) of an audio segment, falling back to its key for segments without bounds."""
+    return annotation.get('start', timestamp), annotation.get('end', timestamp)
+
+
+def merge_annotation_streams(frame_sources: list, audio_sources: list = (), tolerance: float = 0.5):
+    """
+    k-way merge of time-sorted annotation streams, yielding (timestamp, annotation) in time order.
+
+    Frame sources are merged on their timestamp with a heap (O(n log k)). Audio segments keep their own
+    entry at their midpoint, as compile_annotaions did, and every frame within [start - tolerance,
+    end + tolerance] of a segment gets that segment's key in 'audio_segments'. Audio sources are keyed by
+    midpoint, which is not start order once segments overlap, so all segments are read and sorted by
+    (start, end) up front; there is one per speech segment, far fewer than frames. Frame memory is only
+    bounded for streamed sources (.jsonl files and DB frames); a .json dict source is held whole, see
+    iter_json_annotations.
+    """
+    frames = heapq.merge(*frame_sources, key=lambda item: item[0])
+    # Segments are consumed in start order so they can be attached as soon as they begin
+    audio = iter(sorted(
+        ((*_audio_key(annotation, timestamp), timestamp, annotation)
+         for source in audio_sources for timestamp, annotation in source),
+        key=lambda item: item[:2]))
+
+    active = []  # [start, end, midpoint, annotation, emitted] of segments that may still overlap upcoming frames
+    next_segment = next(audio, None)
+
+    def admit(until: float):
+        nonlocal next_segment
+        while next_segment is not None and next_segment[0] - tolerance <= until:
+            start, end, midpoint, segment = next_segment
+            active.append([start, end, midpoint, segment, False])
+            next_segment = next(audio, None)
+
+    def release(until: float):
+        """Yields the entries of segments whose midpoint is before `until` and drops segments that are over."""
+        nonlocal active
+        for entry in sorted((e for e in active if not e[4] and e[2] < until), key=lambda e: e[2]):
+            entry[4] = True
+            yield entry[2], entry[3]
+        active = [e for e in active if not (e[4] and e[1] + tolerance < until)]
+
+    for timestamp, annotation in frames:
+        admit(timestamp)
+        yield from release(timestamp)
+        overlapping = [str(midpoint) for start, end, midpoint, _, _ in active
+                       if start - tolerance <= timestamp <= end + tolerance]
+        if overlapping:
+            annotation = dict(annotation, audio_segments=overlapping)
+        yield timestamp, annotation
+
+    # Audio after the last frame
+    admit(float('inf'))
+    yield from release(float('inf'))
+
+
+class StreamingAnnotationWriter:
+    """
+    Writes a {timestamp: annotation} JSON file incrementally, in the same format load_annotations reads.
+    Consecutive entries with the same timestamp are merged into one; the first entry's fields win and the
+    annotation texts are joined, so a frame and an audio segment sharing a key both stay readable.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        dirname = os.path.dirname(output_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.file = open(output_path, 'w')
+        self.file.write('{')
+        self.count = 0
+        self.pending = None
+
+    def _flush_pending(self):
+        if self.pending is None:
+            return
+        timestamp, annotation = self.pending
+        self.file.write(',' if self.count else '')
+        self.file.write(f"\n  {json.dumps(str(timestamp))}: {json.dumps(annotation)}")
+        self.count += 1
+        self.pending = None
+
+    def write(self, timestamp: float, annotation: dict):
+        if self.pending is not None and self.pending[0] == timestamp:
+            merged = {**annotation, **self.pending[1]}
+            texts = [a.get('annotation') for a in (self.pending[1], annotation) if a.get('annotation')]
+            if texts:
+                merged['annotation'] = '\n'.join(texts)
+            self.pending = (timestamp, merged)
+            return
+        self._flush_pending()
+        self.pending = (timestamp, annotation)
+
+    def close(self):
+        self._flush_pending()
+        self.file.write('\n}\n')
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def merge_annotations(output_path: str, frame_sources: list, audio_sources: list = (), tolerance: float = 0.5) -> int:
+    """Merges the sources into output_path, returns the number of entries written."""
+    with StreamingAnnotationWriter(output_path) as writer:
+        for timestamp, annotation in merge_annotation_streams(frame_sources, audio_sources, tolerance):
+            writer.write(timestamp, annotation)
+    print(f"Merged annotations saved to {output_path}")
+    return writer.count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge frame, audio and DB annotations into one timeline. "
+                                                 "Only .jsonl and DB inputs are streamed, .json files are loaded whole.")
+    parser.add_argument('output')
+    parser.add_argument('--frames', nargs='*', default=[], help="frame annotation files (.json or .jsonl)")
+    parser.add_argument('--audio', nargs='*', default=[], help="audio annotation files (.json or .jsonl)")
+    parser.add_argument('--db', default=None, help="PreprocDB file to read frames from")
+    parser.add_argument('--job', type=int, nargs='*', default=[], help="PreprocDB job ids")
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args()
+
+    frame_sources = [iter_json_annotations(path) for path in args.frames]
+    if args.db:
+        from utils.preproc_db import PreprocDB
+        db = PreprocDB(args.db)
+        frame_sources.extend(iter_db_frames(db, job_id) for job_id in args.job)
+    audio_sources = [iter_json_annotations(path) for path in args.audio]
+    merge_annotations(args.output, frame_sources, audio_sources, args.tolerance)
@@ -1,6 +1,11 @@
-import whisperx
 import gc
 import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.lazy import lazy_import
+
+# whisperx pulls in torch, only load it when transcribing
+whisperx = lazy_import('whisperx')
 
 class Audio:
     def __init__(self, filepath: str):
@@ -0,0 +1,123 @@
+import os
+import sys
+import base64
+import concurrent.futures
+from collections import deque
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+# Frame ring of a process pool worker, attached once by _attach_ring
+_worker_ring = None
+
+
+def _encode(frame, frame_path: str = None):
+    """JPEG-encodes a frame (cv2 releases the GIL while encoding), optionally writes it, returns the base64 text."""
+    _, buffer = cv2.imencode(".jpg", frame)
+    if frame_path:
+        with open(frame_path, "wb") as f:
+            f.write(buffer.tobytes())
+    return base64.b64encode(buffer).decode("utf-8")
+
+
+def _attach_ring(name: str, shape: tuple):
+    global _worker_ring
+    from multiprocessing import shared_memory
+    # Pool workers share the parent's resource tracker, so the segment is unlinked once, by EncodePool.close
+    shm = shared_memory.SharedMemory(name=name)
+    _worker_ring = (shm, np.ndarray(shape, dtype=np.uint8, buffer=shm.buf))
+
+
+def _encode_slot(slot: int, frame_path: str = None):
+    return _encode(_worker_ring[1][slot], frame_path)
+
+
+class EncodePool:
+    """
+    Encodes decoded frames into frame records on a pool of workers, so decoding never waits for
+    JPEG encoding, base64 or disk writes.
+
+    Frames are copied into a fixed ring of slots (no per-frame allocation). With mode='process' the
+    ring lives in shared memory and workers only receive a slot number, so frames are never pickled.
+    At most `slots` frames are in flight; records come back in input order.
+    """
+
+    def __init__(self, workers: int = None, mode: str = 'thread', slots: int = None, frames_dir: str = "data/frames"):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown encode pool mode: {mode}")
+        self.workers = workers or os.cpu_count() or 4
+        self.mode = mode
+        self.slots = slots or self.workers * 2
+        self.frames_dir = frames_dir
+        self.ring = None
+        self.shm = None
+        self.executor = None
+
+    def _start(self, shape: tuple):
+        ring_shape = (self.slots,) + tuple(shape)
+        if self.mode == 'thread':
+            self.ring = np.empty(ring_shape, dtype=np.uint8)
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            return
+        from multiprocessing import shared_memory
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(ring_shape)))
+        self.ring = np.ndarray(ring_shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_attach_ring, initargs=(self.shm.name, ring_shape))
+
+    def _submit(self, slot: int, frame_path: str):
+        if self.mode == 'thread':
+            return self.executor.submit(_encode, self.ring[slot], frame_path)
+        return self.executor.submit(_encode_slot, slot, frame_path)
+
+    def encode(self, frames, filename_for=None):
+        """
+        Yields (seconds, record) for (seconds, frame) pairs, in order.
+        filename_for(seconds, index) names the JPEG written to frames_dir; None (or no function) skips the write.
+        """
+        if filename_for is not None:
+            os.makedirs(self.frames_dir, exist_ok=True)
+        pending = deque()
+        free = []
+        for index, (seconds, frame) in enumerate(frames):
+            if self.ring is None:
+                self._start(frame.shape)
+                free = list(range(self.slots))
+            elif frame.shape != self.ring.shape[1:]:
+                raise ValueError(f"Frame shape changed from {self.ring.shape[1:]} to {frame.shape}")
+            if not free:
+                yield self._finish(pending.popleft(), free)
+            slot = free.pop()
+            np.copyto(self.ring[slot], frame)
+            filename = filename_for(seconds, index) if filename_for else None
+            frame_path = os.path.join(self.frames_dir, filename) if filename else None
+            pending.append((seconds, slot, filename, self._submit(slot, frame_path)))
+        while pending:
+            yield self._finish(pending.popleft(), free)
+
+    @staticmethod
+    def _finish(item, free: list):
+        seconds, slot, filename, future = item
+        data = future.result()
+        free.append(slot)
+        return seconds, {'data': data, 'source': filename, 'source_type': 'frame'}
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.shm is not None:
+            self.ring = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        self.ring = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
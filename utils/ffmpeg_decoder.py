@@ -0,0 +1,115 @@
+import os
+import sys
+import subprocess
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.lazy import lazy_import
+
+cv2 = lazy_import('cv2')
+np = lazy_import('numpy')
+
+
+class FFmpegDecoder:
+    """
+    Decodes frames with an ffmpeg subprocess instead of cv2.VideoCapture.
+
+    ffmpeg seeks on the input (-ss before -i), keeps every frames_to_skip-th frame with the select filter and
+    scales inside the decoder, then writes raw BGR frames (the layout cv2.imencode expects) to a pipe. Frames are
+    read with readinto straight into a preallocated ring of numpy buffers, so decoding allocates nothing per frame.
+    A yielded frame is a view into the ring and is overwritten ring_size frames later; copy it to keep it longer.
+    """
+
+    def __init__(self, filepath: str, width: int = None, ring_size: int = 8, ffmpeg: str = 'ffmpeg'):
+        self.filepath = filepath
+        self.ffmpeg = ffmpeg
+        self.ring_size = ring_size
+
+        # Stream properties from the container, the same values the OpenCV path works with
+        video = cv2.VideoCapture(filepath)
+        self.fps = video.get(cv2.CAP_PROP_FPS)
+        self.frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.source_width = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.source_height = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        video.release()
+        if self.fps == 0:
+            raise ValueError("Could not determine video FPS")
+
+        if width and width != self.source_width:
+            self.width = width
+            self.height = max(2, int(round(self.source_height * width / self.source_width / 2)) * 2)
+        else:
+            self.width, self.height = self.source_width, self.source_height
+        self.ring = np.empty((ring_size, self.height, self.width, 3), dtype=np.uint8)
+
+    def command(self, start_frame: int, frames_to_skip: int, max_frames: int = None) -> list:
+        filters = []
+        if frames_to_skip > 1:
+            filters.append(f"select='not(mod(n\\,{frames_to_skip}))'")
+        if (self.width, self.height) != (self.source_width, self.source_height):
+            filters.append(f"scale={self.width}:{self.height}")
+        cmd = [self.ffmpeg, '-nostdin', '-loglevel', 'error']
+        if start_frame:
+            cmd += ['-ss', f'{start_frame / self.fps:.6f}']
+        cmd += ['-i', self.filepath, '-map', '0:v:0', '-an', '-sn']
+        if filters:
+            cmd += ['-vf', ','.join(filters)]
+        if max_frames is not None:
+            cmd += ['-frames:v', str(max_frames)]
+        # Only the selected frames, no duplicates to fill the output frame rate
+        cmd += ['-vsync', '0', '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+        return cmd
+
+    def frames(self, start_frame: int = 0, end_frame: int = None, frames_to_skip: int = 1):
+        """Yields (frame_number, frame) for start_frame, start_frame + frames_to_skip, ... up to end_frame (inclusive)."""
+        frames_to_skip = max(1, frames_to_skip)
+        max_frames = None if end_frame is None else max(0, (end_frame - start_frame) // frames_to_skip + 1)
+        if max_frames == 0:
+            return
+        frame_bytes = self.width * self.height * 3
+        process = subprocess.Popen(self.command(start_frame, frames_to_skip, max_frames),
+                                   stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   bufsize=0)
+        index = 0
+        try:
+            while max_frames is None or index < max_frames:
+                frame = self.ring[index % self.ring_size]
+                if not self._read_exact(process.stdout, memoryview(frame.reshape(-1)), frame_bytes):
+                    break
+                yield start_frame + index * frames_to_skip, frame
+                index += 1
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            error = process.stderr.read().decode('utf-8', 'replace').strip()
+            process.stderr.close()
+        if process.returncode not in (0, -9) and index == 0:
+            raise RuntimeError(f"ffmpeg failed: {error}")
+
+    def frames_between(self, start_timestamp: float, end_timestamp: float = None, seconds_per_frame: float = 1.,
+                       align: bool = False):
+        """
+        Yields (seconds, frame) with the same frame numbering as the OpenCV paths in utils.video.
+        With align only frame numbers that are multiples of the frame step (counted from frame 0) are sampled.
+        """
+        frames_to_skip = max(1, int(self.fps * seconds_per_frame))
+        start_frame = max(0, int(start_timestamp * self.fps))
+        if align:
+            start_frame = -(-start_frame // frames_to_skip) * frames_to_skip
+        end_frame = None if end_timestamp is None else int(end_timestamp * self.fps)
+        if self.frame_count > 0:
+            end_frame = self.frame_count - 1 if end_frame is None else min(end_frame, self.frame_count - 1)
+        for frame_number, frame in self.frames(start_frame, end_frame, frames_to_skip):
+            yield frame_number / self.fps, frame
+
+    @staticmethod
+    def _read_exact(stream, view, size: int) -> bool:
+        """Fills view from the pipe, False at end of stream."""
+        read = 0
+        while read < size:
+            n = stream.readinto(view[read:])
+            if not n:
+                return False
+            read += n
+        return True
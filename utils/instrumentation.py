@@ -0,0 +1,377 @@
+import os
+import json
+import math
+import time
+import functools
+import threading
+import contextvars
+from types import SimpleNamespace
+from contextlib import contextmanager
+
+from utils.llama_transport import CompletionStream
+from utils.memory import current_profiler
+
+# USD per million tokens, (prompt, completion). Override with LLAMA_PRICE_PROMPT / LLAMA_PRICE_COMPLETION.
+MODEL_PRICES = {
+    'Llama-4-Maverick-17B-128E-Instruct-FP8': (0.27, 0.85),
+    'Llama-4-Scout-17B-16E-Instruct-FP8': (0.18, 0.59),
+}
+DEFAULT_PRICE = (0.27, 0.85)
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest-rank percentile of a list, 0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _price(model: str):
+    prompt_price, completion_price = MODEL_PRICES.get(model, DEFAULT_PRICE)
+    return (
+        float(os.environ.get('LLAMA_PRICE_PROMPT', prompt_price)),
+        float(os.environ.get('LLAMA_PRICE_COMPLETION', completion_price)),
+    )
+
+
+class Usage:
+    """LLM requests, tokens and cost of one unit of work (e.g. a single review), see track_usage."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cost_usd: float):
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cost_usd += cost_usd
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {'requests': self.requests, 'prompt_tokens': self.prompt_tokens,
+                    'completion_tokens': self.completion_tokens, 'cost_usd': self.cost_usd}
+
+
+_current_usage = contextvars.ContextVar('llm_usage', default=None)
+
+
+@contextmanager
+def track_usage():
+    """
+    Collects the requests recorded by any JobMetrics inside this block into a Usage.
+    Work handed to other threads is included when it runs in a copy of the context
+    (executor.submit(contextvars.copy_context().run, fn, ...)).
+    """
+    usage = Usage()
+    token = _current_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _current_usage.reset(token)
+
+
+class JobMetrics:
+    """Counters for a single job (one video / game). Safe to update from worker threads."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.latencies = {}
+        self.counters = {
+            'requests': 0,
+            'errors': 0,
+            'retries': 0,
+            'early_exits': 0,
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'group_cache_hits': 0,
+            'group_cache_misses': 0,
+            'stored_context_hits': 0,
+            'stored_context_misses': 0,
+            'context_tokens_raw': 0,
+            'context_tokens_sent': 0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+            'images': 0,
+            'image_bytes': 0,
+            'cost_usd': 0.0,
+        }
+        self.gauges = {}
+        self.memory = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times a block of work under the given stage name (and profiles its memory when utils.memory profiling is on)."""
+        profiler = current_profiler()
+        if profiler is not None:
+            with profiler.stage(self, name), self._timed_stage(name):
+                yield
+            return
+        with self._timed_stage(name):
+            yield
+
+    @contextmanager
+    def _timed_stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                stage = self.stages.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+                stage['count'] += 1
+                stage['total_seconds'] += elapsed
+                stage['max_seconds'] = max(stage['max_seconds'], elapsed)
+
+    def record_request(self, model: str, latency: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                       images: int = 0, image_bytes: int = 0, error: bool = False):
+        prompt_price, completion_price = _price(model)
+        cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+        usage = _current_usage.get()
+        if usage is not None:
+            usage.add(prompt_tokens, completion_tokens, cost)
+        with self.lock:
+            self.latencies.setdefault(model, []).append(latency)
+            self.counters['requests'] += 1
+            self.counters['errors'] += int(error)
+            self.counters['prompt_tokens'] += prompt_tokens
+            self.counters['completion_tokens'] += completion_tokens
+            self.counters['images'] += images
+            self.counters['image_bytes'] += image_bytes
+            self.counters['cost_usd'] += cost
+
+    def record_retry(self):
+        with self.lock:
+            self.counters['retries'] += 1
+
+    def record_early_exit(self):
+        with self.lock:
+            self.counters['early_exits'] += 1
+
+    def record_cache(self, hit: bool):
+        with self.lock:
+            self.counters['cache_hits' if hit else 'cache_misses'] += 1
+
+    def record_group_cache(self, hit: bool):
+        with self.lock:
+            self.counters['group_cache_hits' if hit else 'group_cache_misses'] += 1
+
+    def record_stored_context(self, hit: bool):
+        with self.lock:
+            self.counters['stored_context_hits' if hit else 'stored_context_misses'] += 1
+
+    def record_context(self, raw_tokens: int, sent_tokens: int):
+        with self.lock:
+            self.counters['context_tokens_raw'] += raw_tokens
+            self.counters['context_tokens_sent'] += sent_tokens
+
+    def record_memory(self, stage: str, peak_rss: int = None, growth: int = None, peak_traced: int = None,
+                      top_allocations: list = None):
+        with self.lock:
+            memory = self.memory.setdefault(stage, {'peak_rss_bytes': 0, 'max_growth_bytes': 0})
+            if peak_rss is not None:
+                memory['peak_rss_bytes'] = max(memory['peak_rss_bytes'], peak_rss)
+            if growth is not None:
+                memory['max_growth_bytes'] = max(memory['max_growth_bytes'], growth)
+            if peak_traced is not None:
+                memory['peak_traced_bytes'] = peak_traced
+                memory['top_allocations'] = top_allocations
+
+    def set_gauge(self, name: str, value: float):
+        with self.lock:
+            self.gauges[name] = value
+
+    def summary(self) -> dict:
+        with self.lock:
+            all_latencies = [l for values in self.latencies.values() for l in values]
+            return {
+                'job': self.name,
+                'wall_seconds': time.time() - self.started,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'latency': {
+                    model: {f'p{p}': percentile(values, p) for p in (50, 90, 99)}
+                    for model, values in list(self.latencies.items()) + [('all', all_latencies)]
+                },
+                **self.counters,
+                'gauges': dict(self.gauges),
+                **({'memory': {name: dict(memory) for name, memory in self.memory.items()}} if self.memory else {}),
+            }
+
+
+class MetricsRegistry:
+    """Holds the JobMetrics of every job seen by this process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def job(self, name: str) -> JobMetrics:
+        with self.lock:
+            if name not in self.jobs:
+                self.jobs[name] = JobMetrics(name)
+            return self.jobs[name]
+
+    def to_json_lines(self, output_path: str):
+        """Appends one JSON line per job summary."""
+        dirname = os.path.dirname(output_path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(output_path, 'a') as f:
+            for job in list(self.jobs.values()):
+                f.write(json.dumps({'time': time.time(), **job.summary()}) + '\n')
+
+    def to_prometheus(self) -> str:
+        """Renders all jobs in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP bron_{name} {help_text}")
+            lines.append(f"# TYPE bron_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"bron_{name}{{{label_text}}} {value}")
+
+        summaries = [job.summary() for job in list(self.jobs.values())]
+        metric('stage_seconds_total', 'counter', 'Wall time spent per pipeline stage.', [
+            ({'job': s['job'], 'stage': stage}, values['total_seconds'])
+            for s in summaries for stage, values in s['stages'].items()
+        ])
+        metric('stage_runs_total', 'counter', 'Number of times each pipeline stage ran.', [
+            ({'job': s['job'], 'stage': stage}, values['count'])
+            for s in summaries for stage, values in s['stages'].items()
+        ])
+        metric('stage_peak_rss_bytes', 'gauge', 'Peak resident memory seen while each stage ran.', [
+            ({'job': s['job'], 'stage': stage}, values['peak_rss_bytes'])
+            for s in summaries for stage, values in s.get('memory', {}).items()
+        ])
+        metric('llm_request_latency_seconds', 'summary', 'LLM request latency percentiles.', [
+            ({'job': s['job'], 'model': model, 'quantile': str(int(q[1:]) / 100)}, value)
+            for s in summaries for model, quantiles in s['latency'].items() for q, value in quantiles.items()
+        ])
+        for counter, help_text in [
+            ('requests', 'LLM requests sent.'),
+            ('errors', 'LLM requests that failed.'),
+            ('retries', 'LLM requests retried after rate limiting.'),
+            ('early_exits', 'Streamed LLM requests closed as soon as the answer was parsed.'),
+            ('cache_hits', 'Cache hits.'),
+            ('cache_misses', 'Cache misses.'),
+            ('group_cache_hits', 'Clip-group annotations reused from an earlier review.'),
+            ('group_cache_misses', 'Clip-group annotations requested from the LLM.'),
+            ('stored_context_hits', 'Reviews summarized from the stored timeline without uploading frames.'),
+            ('stored_context_misses', 'Reviews that found too little stored timeline context and cut frames.'),
+            ('context_tokens_raw', 'Estimated tokens of annotation context before compaction.'),
+            ('context_tokens_sent', 'Estimated tokens of annotation context actually sent.'),
+            ('prompt_tokens', 'Prompt tokens consumed.'),
+            ('completion_tokens', 'Completion tokens generated.'),
+            ('images', 'Images uploaded.'),
+            ('image_bytes', 'Image bytes uploaded.'),
+            ('cost_usd', 'Estimated LLM cost in USD.'),
+        ]:
+            metric(f'{counter}_total', 'counter', help_text, [({'job': s['job']}, s[counter]) for s in summaries])
+        metric('gauge', 'gauge', 'Point-in-time values such as queue depths.', [
+            ({'job': s['job'], 'name': name}, value) for s in summaries for name, value in s['gauges'].items()
+        ])
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def job_metrics(name: str) -> JobMetrics:
+    return REGISTRY.job(name)
+
+
+def timed(stage: str):
+    """Method decorator timing the call under self.metrics."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(self, *args, **kwargs):
+            metrics = getattr(self, 'metrics', None)
+            if metrics is None:
+                return fn(self, *args, **kwargs)
+            with metrics.stage(stage):
+                return fn(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _response_tokens(response):
+    """Reads prompt/completion token counts from the metrics list on a Llama API response."""
+    tokens = {}
+    for item in getattr(response, 'metrics', None) or []:
+        name = item.get('metric') if isinstance(item, dict) else getattr(item, 'metric', None)
+        value = item.get('value') if isinstance(item, dict) else getattr(item, 'value', 0)
+        tokens[name] = int(value or 0)
+    return tokens.get('num_prompt_tokens', 0), tokens.get('num_completion_tokens', 0)
+
+
+def _image_stats(messages):
+    images, image_bytes = 0, 0
+    for message in messages:
+        content = message.get('content')
+        if not isinstance(content, list):
+            continue
+        for item in content:
+            if item.get('type') == 'image_url':
+                url = item['image_url']['url']
+                images += 1
+                # base64 payload after the data: prefix, 4 chars encode 3 bytes
+                image_bytes += len(url.split(',', 1)[-1]) * 3 // 4
+    return images, image_bytes
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class InstrumentedClient:
+    """Wraps a chat completions client and records every call on a JobMetrics."""
+
+    def __init__(self, client, metrics: JobMetrics):
+        self.client = client
+        self.metrics = metrics
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _create(self, **kwargs):
+        images, image_bytes = _image_stats(kwargs.get('messages', []))
+        started = time.perf_counter()
+        try:
+            response = self.client.chat.completions.create(**kwargs)
+        except Exception:
+            self.metrics.record_request(kwargs.get('model', ''), time.perf_counter() - started,
+                                        images=images, image_bytes=image_bytes, error=True)
+            raise
+        if kwargs.get('stream'):
+            return CompletionStream(response, on_close=lambda stream: self._record_stream(kwargs, stream, started, images, image_bytes))
+        prompt_tokens, completion_tokens = _response_tokens(response)
+        self.metrics.record_request(kwargs.get('model', ''), time.perf_counter() - started,
+                                    prompt_tokens, completion_tokens, images, image_bytes)
+        return response
+
+    def _record_stream(self, kwargs, stream, started, images, image_bytes):
+        """Streams closed early never get the metrics event, their completion tokens are estimated from the text."""
+        prompt_tokens, completion_tokens = _response_tokens(stream)
+        if not stream.metrics:
+            completion_tokens = math.ceil(len(stream.text) / 4)
+        self.metrics.record_request(kwargs.get('model', ''), time.perf_counter() - started,
+                                    prompt_tokens, completion_tokens, images, image_bytes)
+
+
+def instrument_client(client, metrics: JobMetrics):
+    """Wraps client unless it already reports to the same metrics."""
+    if isinstance(client, InstrumentedClient) and client.metrics is metrics:
+        return client
+    return InstrumentedClient(client, metrics)
@@ -1,30 +1,286 @@
 import os
+import re
+import sys
 from dotenv import load_dotenv
 import math
-from llama_api_client import RateLimitError  # Import the specific error
 import time
+import heapq
+import itertools
+import threading
+import contextvars
+from types import SimpleNamespace
+from contextlib import contextmanager
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+from utils.lazy import lazy_import
+from utils.instrumentation import _response_tokens, _image_stats
+from utils.llama_transport import CompletionStream
 
-class LlamaAPI():
-    def __init__(self):
-        from llama_api_client import LlamaAPIClient  # Adjust import as needed
-        self.client = LlamaAPIClient(
-            api_key=os.environ.get("LLAMA_API_KEY"),
-        )
+# The SDK (httpx, pydantic) is only imported once a live client is created or an error is matched
+llama_api_client = lazy_import('llama_api_client')
+
+# Completion token limits per call type, None leaves the model default.
+# The detection prompts only need the answer word or a short JSON object. The judgement reasons before
+# its final JSON, so capping it could cut the answer off.
+MAX_TOKENS = {
+    'event_check': 16,
+    'events_check': 256,
+    'judgement': None,
+    'summary': None,
+}
+
+# Request classes of the budget governor, highest priority first, and the share of each job limit a class
+# may use. The remaining share is kept for the classes above it, so reviews still run when bulk description
+# has used up its part of the budget.
+PRIORITIES = {'review': 0, 'detect': 1, 'summary': 2, 'describe': 3}
+BUDGET_SHARES = {'review': 1.0, 'detect': 0.9, 'summary': 0.9, 'describe': 0.8}
+
+_current_priority = contextvars.ContextVar('llm_priority', default='describe')
+
+
+def yes_no_parser(text: str, done: bool = False):
+    """
+    Early-exit parser for prompts answered with 'yes' or 'no'.
+    Returns True as soon as 'yes' shows up, False once the answer starts with a complete 'no',
+    None while undecided. A finished stream without 'yes' is False.
+    """
+    lowered = text.lower()
+    if 'yes' in lowered:
+        return True
+    if done or re.match(r"\W*no[^a-z]", lowered):
+        return False
+    return None
+
+
+def foul_clean_parser(text: str, done: bool = False):
+    """Early-exit parser for the judgement prompt: True on ```FOUL```, False on ```CLEAN```, None until one appears."""
+    if "```FOUL```" in text:
+        return True
+    if "```CLEAN```" in text:
+        return False
+    return None
+
+
+def make_client(transport: str = None, cassette_path: str = None):
+    """
+    Creates the chat completions client used throughout the repo.
+
+    transport (or LLAMA_TRANSPORT): 'live' talks to the API, 'record' also appends every call to
+    the cassette, 'replay' serves calls from the cassette without touching the network.
+    Point LLAMA_API_CLIENT_BASE_URL at utils/mock_llama_server.py to run against the local mock.
+    """
+    from utils.llama_transport import Cassette, RecordingClient, ReplayClient
+
+    transport = transport or os.environ.get("LLAMA_TRANSPORT", "live")
+    cassette_path = cassette_path or os.environ.get("LLAMA_CASSETTE", os.path.join("data", "cassettes", "llama.jsonl"))
+
+    if transport == "replay":
+        return ReplayClient(Cassette(cassette_path))
+
+    client = llama_api_client.LlamaAPIClient(
+        api_key=os.environ.get("LLAMA_API_KEY"),
+    )
+    if transport == "record":
+        return RecordingClient(client, Cassette(cassette_path))
+    if transport != "live":
+        raise ValueError(f"Unknown LLAMA_TRANSPORT: {transport}")
+    return client
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised instead of sending a request that would take a job over its LLM budget."""
+
+
+@contextmanager
+def llm_priority(name: str):
+    """Marks the LLM requests made inside the block (or decorated function) as the given PRIORITIES class."""
+    if name not in PRIORITIES:
+        raise ValueError(f"Unknown LLM priority: {name}")
+    token = _current_priority.set(name)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+
+class BudgetGovernor:
+    """
+    Request, token and image budget for one job, shared by every client it wraps.
+
+        governor = BudgetGovernor(max_requests=5000, max_prompt_tokens=20_000_000, max_images=4000, max_concurrency=16)
+        t2v = Talk2Video(video_path, client=governor.wrap(make_client()))
+
+    Requests are counted when they are sent, tokens when the response (or stream) finishes. A request whose
+    priority class has used its share of a limit raises BudgetExceeded. With max_concurrency, waiting requests
+    are let through highest priority first. Callers degrade ahead of time with plan(), which tells them how
+    coarsely to sample so that a batch of requests fits in what is left.
+    """
 
+    def __init__(self, max_requests: int = None, max_prompt_tokens: int = None, max_completion_tokens: int = None,
+                 max_images: int = None, max_concurrency: int = None, shares: dict = None, metrics=None):
+        self.limits = {
+            'requests': max_requests,
+            'prompt_tokens': max_prompt_tokens,
+            'completion_tokens': max_completion_tokens,
+            'images': max_images,
+        }
+        self.used = dict.fromkeys(self.limits, 0)
+        self.completed = 0
+        self.refused = 0
+        self.shares = {**BUDGET_SHARES, **(shares or {})}
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self.in_flight = 0
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
 
+    def wrap(self, client):
+        return GovernedClient(client, self)
 
-    def ask(self, messages, model='Llama-4-Scout-17B-16E-Instruct-FP8', max_retries=3, retry_delay=15):
+    def _remaining(self, name: str, priority: str) -> float:
+        limit = self.limits[name]
+        if limit is None:
+            return float('inf')
+        return limit * self.shares.get(priority, 1.0) - self.used[name]
+
+    def remaining(self, name: str, priority: str = 'review') -> float:
+        with self.condition:
+            return self._remaining(name, priority)
+
+    def pressure(self) -> float:
+        """Largest used fraction of any limit, 0 without limits."""
+        with self.condition:
+            return max([self.used[name] / limit for name, limit in self.limits.items() if limit] or [0.0])
+
+    def affordable(self, priority: str, images_per_request: int = 0, tokens_per_request: int = None) -> float:
+        """
+        How many more requests of this class fit in the budget. Token limits use tokens_per_request, or the
+        average of the requests finished so far.
+        """
+        with self.condition:
+            counts = [self._remaining('requests', priority)]
+            if images_per_request:
+                counts.append(self._remaining('images', priority) / images_per_request)
+            for name in ('prompt_tokens', 'completion_tokens'):
+                per_request = tokens_per_request if name == 'prompt_tokens' and tokens_per_request else (
+                    self.used[name] / self.completed if self.completed else 0)
+                if per_request:
+                    counts.append(self._remaining(name, priority) / per_request)
+            return max(0.0, min(counts))
+
+    def plan(self, count: int, priority: str, images_per_request: int = 0, tokens_per_request: int = None) -> int:
+        """
+        Sampling step for a batch of count requests: 1 if they all fit, otherwise the smallest step such that
+        every step-th request fits. Raises BudgetExceeded when not even one does.
+        Without tokens_per_request, token limits can only be planned for once some requests have finished.
+        """
+        affordable = self.affordable(priority, images_per_request, tokens_per_request)
+        # Unbounded (no limit applies to this batch) stays a float, int() of inf would overflow
+        if count <= affordable:
+            return 1
+        affordable = int(affordable)
+        if affordable < 1:
+            raise BudgetExceeded(f"No LLM budget left for {priority} requests")
+        return math.ceil(count / affordable)
+
+    def acquire(self, priority: str, images: int = 0):
+        with self.condition:
+            checks = [('requests', 1), ('prompt_tokens', 0), ('completion_tokens', 0)] + ([('images', images)] if images else [])
+            for name, amount in checks:
+                remaining = self._remaining(name, priority)
+                if remaining < amount or remaining <= 0:
+                    self.refused += 1
+                    self._report()
+                    raise BudgetExceeded(f"{priority} request over the {name} budget "
+                                         f"({self.used[name]} of {self.limits[name]} used)")
+            self.used['requests'] += 1
+            self.used['images'] += images
+            if not self.max_concurrency:
+                return
+            entry = (PRIORITIES.get(priority, len(PRIORITIES)), next(self.sequence))
+            heapq.heappush(self.waiting, entry)
+            while self.in_flight >= self.max_concurrency or self.waiting[0] != entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.in_flight += 1
+            # The next waiter may fit in a slot that is still free
+            self.condition.notify_all()
+
+    def release(self, prompt_tokens: int = 0, completion_tokens: int = 0):
+        with self.condition:
+            self.used['prompt_tokens'] += prompt_tokens
+            self.used['completion_tokens'] += completion_tokens
+            self.completed += 1
+            if self.max_concurrency:
+                self.in_flight -= 1
+                self.condition.notify_all()
+            self._report()
+
+    def _report(self):
+        if self.metrics is None:
+            return
+        for name, limit in self.limits.items():
+            if limit:
+                self.metrics.set_gauge(f'budget_{name}_used', self.used[name] / limit)
+        self.metrics.set_gauge('budget_refused', self.refused)
+
+    def summary(self) -> dict:
+        with self.condition:
+            return {'limits': dict(self.limits), 'used': dict(self.used), 'refused': self.refused}
+
+
+class GovernedClient:
+    """Wraps a chat completions client so every request is admitted and accounted by a BudgetGovernor."""
+
+    def __init__(self, client, governor: BudgetGovernor):
+        self.client = client
+        self.governor = governor
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _create(self, **kwargs):
+        images, _ = _image_stats(kwargs.get('messages', []))
+        self.governor.acquire(_current_priority.get(), images)
+        try:
+            response = self.client.chat.completions.create(**kwargs)
+        except Exception:
+            self.governor.release()
+            raise
+        if kwargs.get('stream'):
+            return CompletionStream(response, on_close=self._release_stream)
+        self.governor.release(*_response_tokens(response))
+        return response
+
+    def _release_stream(self, stream):
+        prompt_tokens, completion_tokens = _response_tokens(stream)
+        if not stream.metrics:
+            completion_tokens = math.ceil(len(stream.text) / 4)
+        self.governor.release(prompt_tokens, completion_tokens)
+
+
+class LlamaAPI():
+    def __init__(self, client=None, metrics=None, stream: bool = None, max_tokens: dict = None):
+        self.client = client or make_client()
+        self.metrics = metrics or getattr(self.client, 'metrics', None)
+        # LLAMA_STREAM=0 turns early-exit streaming off, decide() then waits for the full completion
+        self.stream = os.environ.get("LLAMA_STREAM", "1") != "0" if stream is None else stream
+        self.max_tokens = {**MAX_TOKENS, **(max_tokens or {})}
+
+    def _create(self, max_retries, retry_delay, call_type=None, max_tokens=None, **kwargs):
+        max_tokens = max_tokens or self.max_tokens.get(call_type)
+        if max_tokens:
+            kwargs['max_completion_tokens'] = max_tokens
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                )
-                return response
-            except RateLimitError as e:
+                return self.client.chat.completions.create(**kwargs)
+            except llama_api_client.RateLimitError as e:
                 if attempt < max_retries - 1:
+                    if self.metrics is not None:
+                        self.metrics.record_retry()
                     time.sleep(retry_delay)
                     continue
                 else:
@@ -32,6 +288,40 @@ class LlamaAPI():
             except Exception as e:
                 raise
 
+    def ask(self, messages, model='Llama-4-Scout-17B-16E-Instruct-FP8', max_retries=3, retry_delay=15,
+            call_type=None, max_tokens=None):
+        return self._create(max_retries, retry_delay, call_type, max_tokens, model=model, messages=messages)
+
+    def decide(self, messages, parser, model='Llama-4-Scout-17B-16E-Instruct-FP8', max_retries=3, retry_delay=15,
+               call_type=None, max_tokens=None):
+        """
+        Asks for a decision and returns (decision, text).
+        parser(text, done) is called with the text received so far and returns None until it can decide;
+        the stream is closed as soon as it does, so the rest of the completion is never generated.
+        """
+        if not self.stream:
+            response = self.ask(messages, model, max_retries, retry_delay, call_type, max_tokens)
+            text = response.completion_message.content.text if hasattr(response, "completion_message") else str(response)
+            return parser(text, True), text
+
+        stream = self._create(max_retries, retry_delay, call_type, max_tokens, model=model, messages=messages, stream=True)
+        text = ''
+        try:
+            for chunk in stream:
+                event = getattr(chunk, 'event', None)
+                delta = getattr(getattr(event, 'delta', None), 'text', None)
+                if not delta:
+                    continue
+                text += delta
+                decision = parser(text, False)
+                if decision is not None:
+                    if self.metrics is not None and getattr(event, 'event_type', None) == 'progress':
+                        self.metrics.record_early_exit()
+                    return decision, text
+        finally:
+            stream.close()
+        return parser(text, True), text
+
     @staticmethod
     def estimate_tokens(s):
         # Approximate: 1 token ≈ 4 characters (for English text)
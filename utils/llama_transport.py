@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from types import SimpleNamespace
+
+
+class CassetteMissError(KeyError):
+    """Raised when a replayed request has no recorded response."""
+
+
+def request_key(kwargs: dict) -> str:
+    """Stable hash of a chat completion request (model, messages and any other parameters)."""
+    canonical = json.dumps(kwargs, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def to_namespace(value):
+    """Recursively converts a response dict into attribute access objects (response.completion_message.content.text)."""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{k: to_namespace(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(v) for v in value]
+    return value
+
+
+def response_to_dict(response) -> dict:
+    """Converts a llama_api_client response model into a plain dict."""
+    if hasattr(response, 'to_dict'):
+        return response.to_dict()
+    if hasattr(response, 'model_dump'):
+        return response.model_dump()
+    return json.loads(json.dumps(response, default=lambda o: o.__dict__))
+
+
+def _event_field(chunk, *names):
+    value = chunk
+    for name in names:
+        value = value.get(name) if isinstance(value, dict) else getattr(value, name, None)
+        if value is None:
+            return None
+    return value
+
+
+class CompletionStream:
+    """
+    Wraps a streamed chat completion (chunks with .event.delta.text) and keeps the text seen so far.
+    The on_close callbacks run once, when the stream is exhausted or closed early; closing also closes
+    the wrapped stream, which for the SDK releases the HTTP connection and stops generation.
+    """
+
+    def __init__(self, chunks, on_close=None):
+        self.chunks = chunks
+        self.iterator = iter(chunks)
+        self.callbacks = [on_close] if on_close else []
+        self.text = ''
+        self.metrics = []
+        self.stop_reason = None
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        delta = _event_field(chunk, 'event', 'delta', 'text')
+        if delta:
+            self.text += delta
+        self.metrics = _event_field(chunk, 'event', 'metrics') or self.metrics
+        self.stop_reason = _event_field(chunk, 'event', 'stop_reason') or self.stop_reason
+        return chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        close = getattr(self.chunks, 'close', None)
+        if close:
+            close()
+        for callback in self.callbacks:
+            callback(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def to_dict(self) -> dict:
+        """The text received so far, in the shape of a non-streamed response."""
+        return {
+            'completion_message': {
+                'role': 'assistant',
+                'content': {'type': 'text', 'text': self.text},
+                'stop_reason': self.stop_reason or 'cancelled',
+            },
+            'metrics': [
+                {k: _event_field(m, k) for k in ('metric', 'value', 'unit')} for m in self.metrics
+            ],
+        }
+
+
+def stream_chunks(response: dict):
+    """Yields stream chunks (start, progress per word, complete, metrics) for a non-streamed response dict."""
+    message = response.get('completion_message', {})
+    text = (message.get('content') or {}).get('text', '')
+    yield to_namespace({'event': {'event_type': 'start', 'delta': {'type': 'text', 'text': ''}}})
+    for piece in re.findall(r'\s*\S+', text) or ['']:
+        yield to_namespace({'event': {'event_type': 'progress', 'delta': {'type': 'text', 'text': piece}}})
+    yield to_namespace({'event': {'event_type': 'complete', 'delta': {'type': 'text', 'text': ''},
+                                  'stop_reason': message.get('stop_reason', 'stop')}})
+    if response.get('metrics'):
+        yield to_namespace({'event': {'event_type': 'metrics', 'delta': {'type': 'text', 'text': ''},
+                                      'metrics': response['metrics']}})
+
+
+class Cassette:
+    """
+    A JSON lines file of recorded request/response pairs.
+    Identical requests are replayed in the order they were recorded, the last response repeats.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries = {}
+        self.replay_positions = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries.setdefault(entry['key'], []).append(entry['response'])
+
+    def record(self, request: dict, response: dict):
+        key = request_key(request)
+        with self.lock:
+            self.entries.setdefault(key, []).append(response)
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'model': request.get('model'), 'response': response}) + '\n')
+
+    def play(self, request: dict) -> dict:
+        key = request_key(request)
+        with self.lock:
+            responses = self.entries.get(key)
+            if not responses:
+                raise CassetteMissError(f"No recorded response for request {key[:12]} (model={request.get('model')}) in {self.path}")
+            position = self.replay_positions.get(key, 0)
+            self.replay_positions[key] = position + 1
+            return responses[min(position, len(responses) - 1)]
+
+
+class _Completions:
+    def __init__(self, create):
+        self.create = create
+
+
+class RecordingClient:
+    """Wraps a real LlamaAPIClient and appends every chat completion to a cassette."""
+
+    def __init__(self, client, cassette: Cassette):
+        self.client = client
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, **kwargs):
+        response = self.client.chat.completions.create(**kwargs)
+        if kwargs.get('stream'):
+            # Streams are recorded as the text actually received, so early-closed streams replay the same way
+            return CompletionStream(response, on_close=lambda stream: self.cassette.record(kwargs, stream.to_dict()))
+        self.cassette.record(kwargs, response_to_dict(response))
+        return response
+
+
+class ReplayClient:
+    """Serves chat completions from a cassette without touching the network."""
+
+    def __init__(self, cassette: Cassette):
+        self.cassette = cassette
+        self.chat = SimpleNamespace(completions=_Completions(self._create))
+
+    def _create(self, **kwargs):
+        response = self.cassette.play(kwargs)
+        if kwargs.get('stream'):
+            return CompletionStream(stream_chunks(response))
+        return to_namespace(response)
@@ -0,0 +1,160 @@
+"""
+Memory profiling per pipeline stage and a process-wide memory budget.
+
+    MEMORY_PROFILE=1 python core/talk2Video.py ...      # peak RSS and top allocators per stage in the metrics
+    MEMORY_BUDGET_MB=2048 python core/scheduler.py work # spill frames to disk, shrink queues past 2 GB RSS
+
+Stages are the ones timed through JobMetrics.stage (@timed methods and Pipeline stages). The profiler samples
+RSS in a background thread and keeps the peak seen while each stage was running; with tracing on it also keeps
+the top tracemalloc allocation sites at the highest traced memory seen during the stage.
+"""
+import os
+import sys
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process (the peak so far where the current value isn't available)."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class MemoryProfiler:
+    """Records peak RSS, RSS growth and (optionally) tracemalloc top allocators for every active stage."""
+
+    def __init__(self, interval: float = 0.05, top: int = 10, trace: bool = True, snapshot_interval: float = 1.0,
+                 trace_frames: int = 1):
+        self.interval = interval
+        self.top = top
+        self.trace = trace
+        self.snapshot_interval = snapshot_interval
+        self.active = {}
+        self.last_snapshot = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        if trace and not tracemalloc.is_tracing():
+            tracemalloc.start(trace_frames)
+        self.thread = threading.Thread(target=self._monitor, name='memory-profiler', daemon=True)
+        self.thread.start()
+
+    @contextmanager
+    def stage(self, metrics, name: str):
+        key = (metrics, name)
+        with self.lock:
+            self.active[key] = self.active.get(key, 0) + 1
+        before = rss_bytes()
+        metrics.record_memory(name, peak_rss=before)
+        try:
+            yield
+        finally:
+            after = rss_bytes()
+            metrics.record_memory(name, peak_rss=after, growth=after - before)
+            with self.lock:
+                self.active[key] -= 1
+                if not self.active[key]:
+                    del self.active[key]
+
+    def _top_allocations(self) -> list:
+        stats = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]).statistics('lineno')
+        return [f"{stat.traceback[0].filename}:{stat.traceback[0].lineno} {stat.size / 1e6:.1f} MB in {stat.count} blocks"
+                for stat in stats[:self.top]]
+
+    def _monitor(self):
+        while not self.stop_event.wait(self.interval):
+            rss = rss_bytes()
+            with self.lock:
+                active = list(self.active)
+            for metrics, name in active:
+                metrics.record_memory(name, peak_rss=rss)
+            if not self.trace or not active or not tracemalloc.is_tracing():
+                continue
+            traced, _ = tracemalloc.get_traced_memory()
+            now = time.time()
+            # Only snapshot when a stage reaches a new traced high, and not more often than snapshot_interval
+            due = [(metrics, name) for metrics, name in active
+                   if traced > metrics.memory.get(name, {}).get('peak_traced_bytes', 0)
+                   and now - self.last_snapshot.get((id(metrics), name), 0) >= self.snapshot_interval]
+            if due:
+                top = self._top_allocations()
+                for metrics, name in due:
+                    self.last_snapshot[(id(metrics), name)] = now
+                    metrics.record_memory(name, peak_traced=traced, top_allocations=top)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join()
+        if self.trace:
+            tracemalloc.stop()
+
+
+class MemoryBudget:
+    """A process RSS limit. Frame and annotation stages check exceeded() and spill or shrink their queues."""
+
+    def __init__(self, max_rss_bytes: int, check_interval: float = 0.05):
+        self.max_rss_bytes = max_rss_bytes
+        self.check_interval = check_interval
+        self.checked = 0.0
+        self.over = False
+
+    def exceeded(self) -> bool:
+        # Cached briefly, per-frame callers shouldn't read /proc for every frame
+        now = time.monotonic()
+        if now - self.checked >= self.check_interval:
+            self.checked = now
+            self.over = rss_bytes() >= self.max_rss_bytes
+        return self.over
+
+
+_profiler = None
+_budget = None
+
+
+def enable_profiling(**kwargs) -> MemoryProfiler:
+    global _profiler
+    if _profiler is None:
+        _profiler = MemoryProfiler(**kwargs)
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+        _profiler = None
+
+
+def current_profiler():
+    return _profiler
+
+
+def set_memory_budget(max_mb: float = None):
+    """Sets (or with None removes) the process memory budget."""
+    global _budget
+    _budget = MemoryBudget(int(max_mb * 1024 * 1024)) if max_mb else None
+
+
+def over_memory_budget() -> bool:
+    return _budget is not None and _budget.exceeded()
+
+
+if os.environ.get('MEMORY_PROFILE', '0') != '0':
+    enable_profiling()
+if os.environ.get('MEMORY_BUDGET_MB'):
+    set_memory_budget(float(os.environ['MEMORY_BUDGET_MB']))
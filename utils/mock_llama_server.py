@@ -0,0 +1,249 @@
+import re
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+def parse_latency(spec: str):
+    """
+    Parses a latency distribution spec into a sampler returning seconds.
+    fixed:0.5 | uniform:0.2:1.0 | lognormal:<median>:<sigma> | normal:<mean>:<std>
+    """
+    kind, *params = spec.split(':')
+    params = [float(p) for p in params]
+    if kind == 'fixed':
+        return lambda rng: params[0]
+    if kind == 'uniform':
+        return lambda rng: rng.uniform(params[0], params[1])
+    if kind == 'lognormal':
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    if kind == 'normal':
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def _message_text(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(item.get('text', '') for item in content if item.get('type') == 'text')
+    return "\n".join(parts)
+
+
+def _count_images(messages: list) -> int:
+    return sum(
+        1
+        for message in messages if isinstance(message.get('content'), list)
+        for item in message['content'] if item.get('type') == 'image_url'
+    )
+
+
+class MockLlamaServer:
+    """
+    A local stand-in for the hosted chat completions endpoint.
+    Latency, error/429 injection and the concurrency limit are configurable and seeded, so
+    throughput runs against it are reproducible.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 8765, latency: str = 'fixed:0.0',
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, max_concurrency: int = 0,
+                 yes_rate: float = 0.1, foul_rate: float = 0.5, seed: int = 0, token_interval: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_concurrency = max_concurrency
+        self.yes_rate = yes_rate
+        self.foul_rate = foul_rate
+        self.token_interval = token_interval
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'completed': 0, 'errors': 0, 'throttled': 0, 'in_flight': 0, 'max_in_flight': 0,
+                      'streamed': 0, 'cancelled': 0}
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def respond(self, request: dict) -> str:
+        """Chooses a plausible completion for the prompts used in this repo."""
+        text = _message_text(request.get('messages', []))
+        with self.lock:
+            draw = self.rng.random()
+        if "```FOUL```" in text:
+            if draw < self.foul_rate:
+                return "The defender makes contact with the shooter's arm. ```FOUL``` The contact comes before the release and affects the shot."
+            return "The contest is vertical. ```CLEAN``` The defender keeps his arms straight up and there is no body contact."
+        if "'yes'" in text:
+            return 'yes' if draw < self.yes_rate else 'no'
+        return "The ball handler drives to the basket while the primary defender slides to stay in front."
+
+    def _admit(self):
+        """Returns (error_status, None) for a rejected request, or (None, latency_seconds) if it should be served."""
+        with self.lock:
+            self.stats['requests'] += 1
+            draw = self.rng.random()
+            if self.max_concurrency and self.stats['in_flight'] >= self.max_concurrency:
+                self.stats['throttled'] += 1
+                return 429, None
+            if draw < self.rate_limit_rate:
+                self.stats['throttled'] += 1
+                return 429, None
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.stats['errors'] += 1
+                return 500, None
+            self.stats['in_flight'] += 1
+            self.stats['max_in_flight'] = max(self.stats['max_in_flight'], self.stats['in_flight'])
+            delay = self.latency(self.rng)
+        return None, delay
+
+    def _release(self):
+        with self.lock:
+            self.stats['in_flight'] -= 1
+            self.stats['completed'] += 1
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, text: str, metrics: list):
+                """Server-sent events in the Llama API chunk format, one word per progress event."""
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                events = [{'event_type': 'start', 'delta': {'type': 'text', 'text': ''}}]
+                events += [{'event_type': 'progress', 'delta': {'type': 'text', 'text': piece}}
+                           for piece in re.findall(r'\s*\S+', text)]
+                events += [{'event_type': 'complete', 'delta': {'type': 'text', 'text': ''}, 'stop_reason': 'stop'},
+                           {'event_type': 'metrics', 'delta': {'type': 'text', 'text': ''}, 'metrics': metrics}]
+                try:
+                    for event in events:
+                        self.wfile.write(f"data: {json.dumps({'event': event})}\n\n".encode('utf-8'))
+                        self.wfile.flush()
+                        if event['event_type'] == 'progress' and server.token_interval:
+                            time.sleep(server.token_interval)
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream early
+                    with server.lock:
+                        server.stats['cancelled'] += 1
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/stats'):
+                    with server.lock:
+                        self._send_json(200, dict(server.stats))
+                else:
+                    self._send_json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': 'not found'})
+                    return
+
+                status, delay = server._admit()
+                if status is not None:
+                    self._send_json(status, {'error': {'message': 'rate limited' if status == 429 else 'injected error'}})
+                    return
+
+                try:
+                    time.sleep(delay)
+                    text = server.respond(request)
+                    if request.get('max_completion_tokens'):
+                        text = text[:request['max_completion_tokens'] * 4]
+                    messages = request.get('messages', [])
+                    prompt_tokens = math.ceil(len(_message_text(messages)) / 4) + 256 * _count_images(messages)
+                    completion_tokens = math.ceil(len(text) / 4)
+                    metrics = [
+                        {'metric': 'num_prompt_tokens', 'value': prompt_tokens, 'unit': 'tokens'},
+                        {'metric': 'num_completion_tokens', 'value': completion_tokens, 'unit': 'tokens'},
+                        {'metric': 'num_total_tokens', 'value': prompt_tokens + completion_tokens, 'unit': 'tokens'},
+                    ]
+                    if request.get('stream'):
+                        with server.lock:
+                            server.stats['streamed'] += 1
+                        self._stream(text, metrics)
+                        return
+                    self._send_json(200, {
+                        'id': f"mock-{time.time_ns()}",
+                        'completion_message': {
+                            'role': 'assistant',
+                            'content': {'type': 'text', 'text': text},
+                            'stop_reason': 'stop',
+                        },
+                        'metrics': metrics,
+                    })
+                finally:
+                    server._release()
+
+        return Handler
+
+    def start(self):
+        """Starts serving on a background thread."""
+        self.httpd = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local mock of the Llama chat completions API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', default='lognormal:0.8:0.4', help="fixed:S | uniform:A:B | lognormal:MEDIAN:SIGMA | normal:MEAN:STD")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int, default=0, help="0 means unlimited")
+    parser.add_argument('--yes-rate', type=float, default=0.1)
+    parser.add_argument('--foul-rate', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--token-interval', type=float, default=0.0, help="seconds between streamed words")
+    args = parser.parse_args()
+
+    mock = MockLlamaServer(args.host, args.port, args.latency, args.error_rate, args.rate_limit_rate,
+                           args.max_concurrency, args.yes_rate, args.foul_rate, args.seed, args.token_interval)
+    mock.start()
+    print(f"Mock Llama API listening on {mock.base_url} (export LLAMA_API_CLIENT_BASE_URL={mock.base_url})")
+    try:
+        mock.thread.join()
+    except KeyboardInterrupt:
+        mock.stop()
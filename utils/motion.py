@@ -0,0 +1,178 @@
+import os
+import json
+import math
+import cv2
+import numpy as np
+import concurrent.futures
+
+
+def _scan_segment(args):
+    """
+    Decode a segment of the video sequentially and compute per-sample motion features.
+    Runs in a worker process, so it opens its own capture.
+    """
+    filepath, start_frame, end_frame, frames_to_skip, downscale_width = args
+
+    video = cv2.VideoCapture(filepath)
+    fps = video.get(cv2.CAP_PROP_FPS)
+    video.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+
+    rows = []
+    prev_gray = None
+    prev_magnitude = None
+    curr_frame = start_frame
+
+    while curr_frame <= end_frame:
+        success, frame = video.read()
+        if not success:
+            break
+
+        # Downscale before converting to grey, the flow is computed at low resolution
+        height, width = frame.shape[:2]
+        scale = downscale_width / float(width)
+        small = cv2.resize(frame, (downscale_width, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        if prev_gray is not None:
+            flow = cv2.calcOpticalFlowFarneback(prev_gray, gray, None, 0.5, 2, 9, 2, 5, 1.1, 0)
+            fx, fy = flow[..., 0], flow[..., 1]
+            magnitude = np.sqrt(fx * fx + fy * fy)
+            mean_magnitude = float(magnitude.mean())
+
+            # Negative divergence marks regions where motion vectors point at each other (players converging)
+            divergence = np.gradient(fx, axis=1) + np.gradient(fy, axis=0)
+            divergence = cv2.GaussianBlur(divergence, (7, 7), 0)
+            convergence = float(max(0.0, np.percentile(-divergence, 99)))
+
+            # Relative drop in motion compared to the previous sample (sudden stop after contact)
+            deceleration = 0.0
+            if prev_magnitude is not None and prev_magnitude > 1e-6:
+                deceleration = max(0.0, (prev_magnitude - mean_magnitude) / prev_magnitude)
+
+            rows.append({
+                'timestamp': curr_frame / fps if fps else 0,
+                'magnitude': mean_magnitude,
+                'convergence': convergence,
+                'deceleration': deceleration,
+            })
+            prev_magnitude = mean_magnitude
+
+        prev_gray = gray
+
+        # grab() skips frames without the cost of retrieving/converting them
+        skipped = 1
+        while skipped < frames_to_skip and video.grab():
+            skipped += 1
+        curr_frame += frames_to_skip
+
+    video.release()
+    return rows
+
+
+class MotionDetector:
+    def __init__(self, video_filepath: str, sample_fps: float = 5.0, downscale_width: int = 160, workers: int = None):
+        self.video_filepath = video_filepath
+        self.name_no_ext = os.path.splitext(os.path.basename(self.video_filepath))[0]
+        self.sample_fps = sample_fps
+        self.downscale_width = downscale_width
+        self.workers = workers or os.cpu_count() or 1
+
+    def scan(self, start_timestamp: float = 0, end_timestamp: float = None) -> list:
+        """
+        Computes motion features for samples between start_timestamp and end_timestamp.
+        The range is split into contiguous segments that are decoded in parallel worker processes.
+        """
+        video = cv2.VideoCapture(self.video_filepath)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        video.release()
+
+        if fps == 0:
+            raise ValueError("Could not determine video FPS")
+
+        frames_to_skip = max(1, int(round(fps / self.sample_fps)))
+        start_frame = max(0, int(start_timestamp * fps))
+        end_frame = total_frames - 1 if end_timestamp is None else min(total_frames - 1, int(end_timestamp * fps))
+        if end_frame <= start_frame:
+            return []
+
+        # Segments are aligned to the sampling grid and overlap by one sample so no flow pair is lost
+        samples = (end_frame - start_frame) // frames_to_skip + 1
+        samples_per_segment = max(2, math.ceil(samples / self.workers))
+        segment_args = []
+        for first_sample in range(0, samples, samples_per_segment):
+            seg_start = start_frame + max(0, first_sample - 1) * frames_to_skip
+            seg_end = min(end_frame, start_frame + (first_sample + samples_per_segment - 1) * frames_to_skip)
+            segment_args.append((self.video_filepath, seg_start, seg_end, frames_to_skip, self.downscale_width))
+
+        if len(segment_args) == 1:
+            results = [_scan_segment(segment_args[0])]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = list(executor.map(_scan_segment, segment_args))
+
+        rows = []
+        for segment_rows in results:
+            rows.extend(segment_rows)
+        rows.sort(key=lambda row: row['timestamp'])
+
+        # Normalise each feature over the scanned range and combine into a single score
+        for feature in ('convergence', 'deceleration'):
+            values = np.array([row[feature] for row in rows], dtype=np.float64)
+            mean, std = (values.mean(), values.std()) if len(values) else (0.0, 0.0)
+            for row, value in zip(rows, values):
+                row[f'{feature}_z'] = float((value - mean) / std) if std > 1e-9 else 0.0
+        for row in rows:
+            row['score'] = row['convergence_z'] + row['deceleration_z']
+
+        self.rows = rows
+        return rows
+
+    def candidates(self, top_k: int = None, min_gap: float = 3.0, min_score: float = 1.0,
+                   start_timestamp: float = 0, end_timestamp: float = None) -> list:
+        """
+        Returns the highest scoring motion events, ranked by score.
+        Peaks closer than min_gap seconds to a higher scoring peak are suppressed.
+        """
+        rows = self.scan(start_timestamp, end_timestamp)
+        ranked = sorted((row for row in rows if row['score'] >= min_score), key=lambda row: row['score'], reverse=True)
+
+        selected = []
+        for row in ranked:
+            if all(abs(row['timestamp'] - other['timestamp']) >= min_gap for other in selected):
+                selected.append(row)
+            if top_k is not None and len(selected) >= top_k:
+                break
+        return selected
+
+    def candidate_timestamps(self, top_k: int = None, min_gap: float = 3.0, min_score: float = 1.0,
+                             start_timestamp: float = 0, end_timestamp: float = None) -> list:
+        """
+        Returns ranked integer timestamps (seconds), the format used by Referee.look_into_video
+        and the candidates argument of Talk2Video.look_for_event.
+        """
+        events = self.candidates(top_k, min_gap, min_score, start_timestamp, end_timestamp)
+        return [int(round(event['timestamp'])) for event in events]
+
+    def save_candidates(self, candidates: list, output_path: str):
+        """Saves ranked candidates to a JSON file."""
+        with open(output_path, "w") as f:
+            json.dump(candidates, f, indent=2)
+        print(f"Motion candidates saved to {output_path}")
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    video_file = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'data', 'nba_2016_finals_6.mp4')
+
+    detector = MotionDetector(video_file)
+    started = time.time()
+    events = detector.candidates(top_k=30)
+    elapsed = time.time() - started
+    video_seconds = detector.rows[-1]['timestamp'] if detector.rows else 0
+    print(f"Scanned {video_seconds:.1f}s of video in {elapsed:.1f}s ({video_seconds / max(elapsed, 1e-9):.1f}x real time)")
+    for event in events:
+        print(f"{event['timestamp']:8.2f}s  score={event['score']:.2f}")
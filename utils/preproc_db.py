@@ -1,10 +1,16 @@
 import sqlite3
 import json
 import os
-from typing import Optional, List, Dict, Any, Tuple
+import time
+from typing import Optional, List, Dict, Any, Tuple, Iterator, Iterable
 from dataclasses import dataclass
 from contextlib import contextmanager
 
+# Timeline lookups use the (job_id, start_time) index, so an entry is found by a range query only if it starts
+# at most TIMELINE_MAX_SPAN seconds before the range. Longer entries are rejected by add_timeline_entries.
+TIMELINE_MAX_SPAN = 600.0
+TIMELINE_KINDS = ('frame', 'audio', 'event', 'verdict')
+
 
 @dataclass
 class Job:
@@ -25,6 +31,30 @@ class Frame:
     structured_data: Optional[Dict[str, Any]] = None
 
 
+@dataclass
+class WorkUnit:
+    id: Optional[int]
+    job_id: int
+    start_time: float  # Seconds within the video
+    end_time: float
+    status: str  # pending | leased | done | failed
+    lease_owner: Optional[str] = None
+    lease_expires: Optional[float] = None  # Unix time
+    attempts: int = 0
+    error: Optional[str] = None
+
+
+@dataclass
+class TimelineEntry:
+    job_id: int
+    kind: str  # frame | audio | event | verdict
+    start_time: float  # Seconds within the video
+    end_time: float
+    text: str
+    label: str = ''  # Event name or judges of a verdict, empty for frames and audio
+    structured_data: Optional[Dict[str, Any]] = None
+
+
 class PreprocDB:
     def __init__(self, db_path: str = "data/preproc.db"):
         self.db_path = db_path
@@ -35,7 +65,8 @@ class PreprocDB:
     @contextmanager
     def get_connection(self):
         """Context manager for database connections"""
-        conn = sqlite3.connect(self.db_path)
+        # Several worker processes share the file, wait for locks instead of failing immediately
+        conn = sqlite3.connect(self.db_path, timeout=30)
         conn.row_factory = sqlite3.Row  # Enable column access by name
         try:
             yield conn
@@ -79,6 +110,56 @@ class PreprocDB:
             # Create indexes for better performance
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_frame_job_id ON frame_table(job_id)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_frame_number ON frame_table(frame_number)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_frame_job_timestamp ON frame_table(job_id, video_timestamp)')
+
+            # Time-range work units claimed by scheduler workers under a lease
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS work_unit (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    start_time REAL NOT NULL,
+                    end_time REAL NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    lease_owner TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (job_id) REFERENCES job (id) ON DELETE CASCADE,
+                    UNIQUE(job_id, start_time)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_work_unit_status ON work_unit(status)')
+
+            # Global LLM concurrency budget shared by all workers using this DB file
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS llm_slot (
+                    slot INTEGER PRIMARY KEY,
+                    owner TEXT,
+                    lease_expires REAL
+                )
+            ''')
+
+            # Materialized per-game timeline: frame annotations, audio segments, event hits and verdicts
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS timeline (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id INTEGER NOT NULL,
+                    kind TEXT NOT NULL,  -- frame | audio | event | verdict
+                    label TEXT NOT NULL DEFAULT '',
+                    start_time REAL NOT NULL,  -- Seconds within the video
+                    end_time REAL NOT NULL,
+                    text TEXT NOT NULL,
+                    structured_data TEXT,  -- JSON stored as TEXT
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (job_id) REFERENCES job (id) ON DELETE CASCADE,
+                    UNIQUE(job_id, kind, label, start_time)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_timeline_job_time ON timeline(job_id, start_time)')
+
+            # WAL lets readers proceed while a worker holds the write lock
+            cursor.execute('PRAGMA journal_mode=WAL')
             
             conn.commit()
     
@@ -207,12 +288,260 @@ class PreprocDB:
                 ))
             return frames
     
+    def iter_frames_for_job(self, job_id: int) -> Iterator[Frame]:
+        """Streams the frames of a job in video_timestamp order without loading them all"""
+        with self.get_connection() as conn:
+            cursor = conn.execute('''
+                SELECT * FROM frame_table WHERE job_id = ? ORDER BY video_timestamp
+            ''', (job_id,))
+            for row in cursor:
+                structured_data = json.loads(row['structured_data']) if row['structured_data'] else None
+                yield Frame(
+                    job_id=row['job_id'],
+                    frame_number=row['frame_number'],
+                    description=row['description'],
+                    video_timestamp=row['video_timestamp'],
+                    structured_data=structured_data
+                )
+    
     def delete_job(self, job_id: int):
         """Delete a job and all its frames"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute('DELETE FROM job WHERE id = ?', (job_id,))
             conn.commit()
+
+    @staticmethod
+    def _row_to_work_unit(row) -> WorkUnit:
+        return WorkUnit(
+            id=row['id'],
+            job_id=row['job_id'],
+            start_time=row['start_time'],
+            end_time=row['end_time'],
+            status=row['status'],
+            lease_owner=row['lease_owner'],
+            lease_expires=row['lease_expires'],
+            attempts=row['attempts'],
+            error=row['error']
+        )
+
+    def create_work_units(self, job_id: int, length: float, unit_seconds: float) -> int:
+        """Split a job into [start, end) time ranges. Existing units are kept. Returns the number of units."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            start = 0.0
+            while start < length:
+                cursor.execute('''
+                    INSERT OR IGNORE INTO work_unit (job_id, start_time, end_time)
+                    VALUES (?, ?, ?)
+                ''', (job_id, start, min(start + unit_seconds, length)))
+                start += unit_seconds
+            conn.commit()
+            cursor.execute('SELECT COUNT(*) FROM work_unit WHERE job_id = ?', (job_id,))
+            return cursor.fetchone()[0]
+
+    def claim_work_unit(self, owner: str, lease_seconds: float = 300, max_attempts: int = 3) -> Optional[WorkUnit]:
+        """
+        Atomically lease the next pending unit to owner.
+        Units whose lease expired (crashed worker) are put back to pending first, or marked failed
+        once they have been attempted max_attempts times.
+        """
+        now = time.time()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # BEGIN IMMEDIATE takes the write lock up front so two workers can't claim the same unit
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                UPDATE work_unit
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    error = COALESCE(error, 'lease expired'), lease_owner = NULL, lease_expires = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE status = 'leased' AND lease_expires < ?
+            ''', (max_attempts, now))
+            cursor.execute('''
+                SELECT * FROM work_unit WHERE status = 'pending' ORDER BY job_id, start_time LIMIT 1
+            ''')
+            row = cursor.fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            cursor.execute('''
+                UPDATE work_unit
+                SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (owner, now + lease_seconds, row['id']))
+            conn.commit()
+            cursor.execute('SELECT * FROM work_unit WHERE id = ?', (row['id'],))
+            return self._row_to_work_unit(cursor.fetchone())
+
+    def renew_lease(self, unit_id: int, owner: str, lease_seconds: float = 300) -> bool:
+        """Extend a lease still held by owner. Returns False if the lease was lost."""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE work_unit SET lease_expires = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ? AND status = 'leased'
+            ''', (time.time() + lease_seconds, unit_id, owner))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def complete_work_unit(self, unit_id: int, owner: str) -> bool:
+        """Mark a leased unit as done"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE work_unit
+                SET status = 'done', lease_owner = NULL, lease_expires = NULL, error = NULL,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ?
+            ''', (unit_id, owner))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def fail_work_unit(self, unit_id: int, owner: str, error: str, max_attempts: int = 3):
+        """Release a unit after an error, it is retried until it has been attempted max_attempts times"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE work_unit
+                SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                    error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND lease_owner = ?
+            ''', (max_attempts, error, unit_id, owner))
+            conn.commit()
+
+    def get_work_units(self, job_id: int) -> List[WorkUnit]:
+        """Get all work units of a job"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT * FROM work_unit WHERE job_id = ? ORDER BY start_time', (job_id,))
+            return [self._row_to_work_unit(row) for row in cursor.fetchall()]
+
+    def get_work_progress(self, job_id: int) -> Dict[str, int]:
+        """Count work units per status for a job"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT status, COUNT(*) AS n FROM work_unit WHERE job_id = ? GROUP BY status
+            ''', (job_id,))
+            return {row['status']: row['n'] for row in cursor.fetchall()}
+
+    def count_frames(self, job_id: int) -> int:
+        """Number of described frames stored for a job"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT COUNT(*) FROM frame_table WHERE job_id = ?', (job_id,))
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def _row_to_timeline_entry(row) -> TimelineEntry:
+        return TimelineEntry(
+            job_id=row['job_id'],
+            kind=row['kind'],
+            start_time=row['start_time'],
+            end_time=row['end_time'],
+            text=row['text'],
+            label=row['label'],
+            structured_data=json.loads(row['structured_data']) if row['structured_data'] else None
+        )
+
+    def add_timeline_entries(self, entries: Iterable[TimelineEntry]) -> int:
+        """Store timeline entries, replacing entries of the same job, kind, label and start time. Returns the count."""
+        rows = []
+        for entry in entries:
+            if entry.kind not in TIMELINE_KINDS:
+                raise ValueError(f"Unknown timeline kind: {entry.kind}")
+            if not 0 <= entry.end_time - entry.start_time <= TIMELINE_MAX_SPAN:
+                raise ValueError(f"Timeline entry must span 0 to {TIMELINE_MAX_SPAN}s: {entry.start_time}-{entry.end_time}")
+            rows.append((entry.job_id, entry.kind, entry.label, entry.start_time, entry.end_time, entry.text,
+                         json.dumps(entry.structured_data) if entry.structured_data else None))
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR REPLACE INTO timeline (job_id, kind, label, start_time, end_time, text, structured_data)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        return len(rows)
+
+    def materialize_frames(self, job_id: int) -> int:
+        """
+        Copy the frame descriptions of a job from frame_table into its timeline. Returns the number of frames.
+        Failed descriptions (stored as "Error: ..." by older workers) are left out.
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO timeline (job_id, kind, label, start_time, end_time, text, structured_data)
+                SELECT job_id, 'frame', '', video_timestamp, video_timestamp, description, structured_data
+                FROM frame_table WHERE job_id = ? AND description NOT LIKE 'Error:%'
+            ''', (job_id,))
+            conn.commit()
+            return cursor.rowcount
+
+    def get_timeline(self, job_id: int, start: float, end: float, kinds: Optional[Iterable[str]] = None) -> List[TimelineEntry]:
+        """Timeline entries of a job overlapping [start, end], in time order, with a single indexed query"""
+        query = '''
+            SELECT * FROM timeline
+            WHERE job_id = ? AND start_time BETWEEN ? AND ? AND end_time >= ?
+        '''
+        params = [job_id, start - TIMELINE_MAX_SPAN, end, start]
+        if kinds is not None:
+            kinds = list(kinds)
+            query += f" AND kind IN ({', '.join('?' * len(kinds))})"
+            params.extend(kinds)
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(query + ' ORDER BY start_time, kind', params)
+            return [self._row_to_timeline_entry(row) for row in cursor.fetchall()]
+
+    def count_timeline(self, job_id: int) -> Dict[str, int]:
+        """Count timeline entries per kind for a job"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT kind, COUNT(*) AS n FROM timeline WHERE job_id = ? GROUP BY kind', (job_id,))
+            return {row['kind']: row['n'] for row in cursor.fetchall()}
+
+    def acquire_llm_slot(self, owner: str, max_slots: int, lease_seconds: float = 120) -> Optional[int]:
+        """
+        Take one of max_slots global LLM concurrency slots, returns the slot number or None if all are busy.
+        Slots held past their lease (crashed worker) are considered free.
+        """
+        now = time.time()
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            # Read-only check first, so waiting for a busy slot doesn't take the write lock
+            cursor.execute('''
+                SELECT COUNT(*) AS slots, SUM(owner IS NULL OR lease_expires < ?) AS free
+                FROM llm_slot WHERE slot < ?
+            ''', (now, max_slots))
+            row = cursor.fetchone()
+            if row['slots'] == max_slots and not row['free']:
+                return None
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.executemany('INSERT OR IGNORE INTO llm_slot (slot) VALUES (?)', [(i,) for i in range(max_slots)])
+            cursor.execute('''
+                SELECT slot FROM llm_slot
+                WHERE slot < ? AND (owner IS NULL OR lease_expires < ?)
+                ORDER BY slot LIMIT 1
+            ''', (max_slots, now))
+            row = cursor.fetchone()
+            if row is None:
+                conn.commit()
+                return None
+            cursor.execute('UPDATE llm_slot SET owner = ?, lease_expires = ? WHERE slot = ?',
+                           (owner, now + lease_seconds, row['slot']))
+            conn.commit()
+            return row['slot']
+
+    def release_llm_slot(self, slot: int, owner: str):
+        """Give back a slot taken with acquire_llm_slot"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE llm_slot SET owner = NULL, lease_expires = NULL WHERE slot = ? AND owner = ?',
+                           (slot, owner))
+            conn.commit()
     
 
 # Example usage
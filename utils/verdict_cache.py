@@ -0,0 +1,55 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def content_hash(*parts) -> str:
+    """Stable short hash of strings, used for summary keys and judge prompt versions."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()[:16]
+
+
+class VerdictCache:
+    """
+    Judge verdicts on disk, keyed by (summary hash, judge, prompt version, samples per vote).
+    A JSON lines file that is only appended to; the latest entry for a key wins.
+    """
+
+    def __init__(self, path: str = os.path.join("data", "cache", "verdicts.jsonl")):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        key = (entry['summary_hash'], entry['judge'], entry['version'], entry.get('samples', 1))
+                        self.entries[key] = entry
+
+    @staticmethod
+    def key(summary: str, judge: str, version: str, samples: int = 1) -> tuple:
+        return content_hash(summary), judge, version, samples
+
+    def get(self, summary: str, judge: str, version: str, samples: int = 1):
+        """Returns the cached entry ({verdict, votes, ...}) or None."""
+        with self.lock:
+            return self.entries.get(self.key(summary, judge, version, samples))
+
+    def put(self, summary: str, judge: str, version: str, verdict: bool, votes: list, samples: int = 1):
+        key = self.key(summary, judge, version, samples)
+        summary_hash, judge, version, samples = key
+        entry = {'summary_hash': summary_hash, 'judge': judge, 'version': version, 'samples': samples,
+                 'verdict': verdict, 'votes': votes}
+        with self.lock:
+            self.entries[key] = entry
+            dirname = os.path.dirname(self.path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
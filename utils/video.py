@@ -1,14 +1,25 @@
 import subprocess
-import cv2
-from moviepy import *
 import time
 import base64
 import os
-from llama_api_client import LlamaAPIClient
+import sys
 from dotenv import load_dotenv
 import json
+import threading
 import concurrent.futures
+from contextlib import contextmanager
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '..', '.env'))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from utils.lazy import lazy_import
+from utils.llama_api import make_client, llm_priority, BudgetExceeded
+from utils.instrumentation import job_metrics, instrument_client, timed
+from utils.ffmpeg_decoder import FFmpegDecoder
+from utils.encode_pool import EncodePool
+from utils.memory import over_memory_budget
+
+# OpenCV is only needed once frames are actually decoded
+cv2 = lazy_import('cv2')
 
 
 DETAIL_ANNOTATOR_PROMPT = """
@@ -61,85 +72,170 @@ FOUL_JUDGEMENT_PROMPT = """
         ANNOTATION_DATA_TOKEN"""
 
 class Video:
-    def __init__(self, filepath: str):
+    def __init__(self, filepath: str, client=None, keep_open: bool = False):
         self.filepath = filepath
         self.name = os.path.splitext(os.path.basename(self.filepath))[0]
         self.name_no_ext = os.path.splitext(os.path.basename(self.filepath))[0]
-        self.client = LlamaAPIClient(
-            api_key=os.environ.get("LLAMA_API_KEY"),
-        )
+        self.metrics = job_metrics(self.name_no_ext)
+        self.client = instrument_client(client or make_client(), self.metrics)
+        # A long-running service keeps the capture open between cut_frames calls
+        self.keep_open = keep_open
+        self._capture = None
+        self._capture_lock = threading.Lock()
+
+    @contextmanager
+    def open_capture(self):
+        """Yields a cv2.VideoCapture, reusing a single open capture when keep_open is set."""
+        if not self.keep_open:
+            video = cv2.VideoCapture(self.filepath)
+            try:
+                yield video
+            finally:
+                video.release()
+            return
+        with self._capture_lock:
+            if self._capture is None or not self._capture.isOpened():
+                self._capture = cv2.VideoCapture(self.filepath)
+            yield self._capture
+
+    def probe(self) -> tuple:
+        """(fps, frame_count) of the video, fps is 0 if it can't be read."""
+        with self.open_capture() as video:
+            return video.get(cv2.CAP_PROP_FPS), int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def close(self):
+        with self._capture_lock:
+            if self._capture is not None:
+                self._capture.release()
+                self._capture = None
 
 
     # def cut_video(self, start_time, end_time):
 
 
 
-    def extract_frames(self, seconds_per_frame=2) -> dict:
-
+    @timed('extract_frames')
+    def extract_frames(self, seconds_per_frame=2, backend: str = 'opencv', width: int = None,
+                       encode_workers: int = 0, encode_mode: str = 'thread') -> dict:
+        """
+        Extracts a frame every seconds_per_frame seconds.
+        backend='ffmpeg' decodes through utils.ffmpeg_decoder (seeking, frame selection and scaling to width
+        happen inside ffmpeg); 'opencv' seeks with cv2.VideoCapture.
+        encode_workers > 0 hands JPEG encoding and writes to a utils.encode_pool.EncodePool ('thread' or
+        'process' encode_mode) so the decoder keeps decoding meanwhile.
+        """
         frame_dict = {}
-        base_video_path, _ = os.path.splitext(self.filepath)
+        if backend == 'ffmpeg':
+            decoder = FFmpegDecoder(self.filepath, width=width)
+            # Same range as the OpenCV path, which stops before the last frame
+            frames = decoder.frames(0, decoder.frame_count - 2, int(decoder.fps * seconds_per_frame))
+            frames = ((n / decoder.fps, frame) for n, frame in frames)
+            frame_count = self._save_frames(frames, frame_dict, "", encode_workers, encode_mode)
+        elif backend == 'opencv':
+            video = cv2.VideoCapture(self.filepath)
+            try:
+                total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+                fps = video.get(cv2.CAP_PROP_FPS)
+                frames = self._seek_frames(video, 0, total_frames - 2, int(fps * seconds_per_frame), width)
+                frame_count = self._save_frames(frames, frame_dict, "", encode_workers, encode_mode)
+            finally:
+                video.release()
+        else:
+            raise ValueError(f"Unknown decode backend: {backend}")
 
-        video = cv2.VideoCapture(self.filepath)
-        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = video.get(cv2.CAP_PROP_FPS)
-        frames_to_skip = int(fps * seconds_per_frame)
-        curr_frame=0
+        print(f"Extracted {len(frame_dict)} frames")
+        print(f"Saved {frame_count} frames to data/frames")
+        self.frames = frame_dict
+        return frame_dict
 
-        # Create frames directory if it doesn't exist
-        frames_dir = "data/frames"
-        os.makedirs(frames_dir, exist_ok=True)
+    @staticmethod
+    def _resize(frame, width: int):
+        height, source_width = frame.shape[:2]
+        if width == source_width:
+            return frame
+        return cv2.resize(frame, (width, max(2, int(round(height * width / source_width / 2)) * 2)), interpolation=cv2.INTER_AREA)
 
-        # Loop through the video and extract frames at specified sampling rate
-        frame_count = 0
-        while curr_frame < total_frames - 1:
+    def _seek_frames(self, video, start_frame: int, end_frame: int, frames_to_skip: int, width: int = None):
+        """Yields (seconds, frame) from an open capture for start_frame, start_frame + frames_to_skip, ... up to end_frame (inclusive)."""
+        fps = video.get(cv2.CAP_PROP_FPS)
+        curr_frame = start_frame
+        while curr_frame <= end_frame:
             video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
             success, frame = video.read()
             if not success:
                 break
-            _, buffer = cv2.imencode(".jpg", frame)
-            
-            # Save frame as JPEG file
-            frame_seconds = curr_frame / fps if fps else 0
-            frame_filename = f"{self.name}_{frame_count:04d}_{frame_seconds:.2f}s.jpg"
-
-            frame_filepath = os.path.join(
-                frames_dir,
-                f"{self.name}_{frame_count:04d}_{frame_seconds:.2f}s.jpg"
-            )
-            cv2.imwrite(frame_filepath, frame)
-            frame_count += 1
+            if width:
+                frame = self._resize(frame, width)
+            yield (curr_frame / fps if fps else 0), frame
             curr_frame += frames_to_skip
 
-            frame_dict[frame_seconds] = {
-                'data': base64.b64encode(buffer).decode("utf-8"),
-                'source': frame_filename,
-                'source_type': 'frame'
-            }
-
-        video.release()
-
-        print(f"Extracted {len(frame_dict)} frames")
-        print(f"Saved {frame_count} frames to {frames_dir}")
-        self.frames = frame_dict
-        return frame_dict
-
-    def cut_frames(self, start_timestamp: float, end_timestamp: float, seconds_per_frame: float = 1.) -> dict:
+    def _save_frames(self, frames, frame_dict: dict, prefix: str, encode_workers: int = 0, encode_mode: str = 'thread') -> int:
         """
-        Extract frames from video between start_timestamp and end_timestamp.
-        
-        :param start_timestamp: Start time in seconds
-        :param end_timestamp: End time in seconds  
-        :param seconds_per_frame: Time interval between extracted frames in seconds
-        :return: Dictionary of extracted frames with timestamps as keys
+        Encodes and saves (seconds, frame) pairs from a decoder into frame_dict, returns the number saved.
+        Once the utils.memory budget is reached the base64 data is spilled: records keep only the path of the
+        JPEG (already written to data/frames) and frame_data() reads it back when the frame is sent.
         """
-        frame_dict = {}
-        
-        video = cv2.VideoCapture(self.filepath)
+        frames_dir = "data/frames"
+        os.makedirs(frames_dir, exist_ok=True)
+
+        def filename_for(frame_seconds, frame_count):
+            return f"{self.name}_{prefix}{frame_count:04d}_{frame_seconds:.2f}s.jpg"
+
+        spilled = []
+
+        def add(frame_seconds, record):
+            if over_memory_budget():
+                if not spilled:
+                    # Spill what is already held too, not just the frames from here on
+                    for held in frame_dict.values():
+                        self._spill(held, frames_dir)
+                spilled.append(frame_seconds)
+                self._spill(record, frames_dir)
+            frame_dict[frame_seconds] = record
+
+        if encode_workers:
+            with EncodePool(encode_workers, encode_mode, frames_dir=frames_dir) as pool:
+                for frame_seconds, record in pool.encode(frames, filename_for):
+                    add(frame_seconds, record)
+            frame_count = len(frame_dict)
+        else:
+            frame_count = 0
+            for frame_seconds, frame in frames:
+                _, buffer = cv2.imencode(".jpg", frame)
+                frame_filename = filename_for(frame_seconds, frame_count)
+                with open(os.path.join(frames_dir, frame_filename), "wb") as f:
+                    f.write(buffer.tobytes())
+                add(frame_seconds, {
+                    'data': base64.b64encode(buffer).decode("utf-8"),
+                    'source': frame_filename,
+                    'source_type': 'frame'
+                })
+                frame_count += 1
+        if spilled:
+            print(f"Memory budget reached, spilled frame data to {frames_dir} from {spilled[0]:.2f}s on")
+            self.metrics.set_gauge('frames_spilled', self.metrics.gauges.get('frames_spilled', 0) + len(spilled))
+        return frame_count
+
+    @staticmethod
+    def _spill(record: dict, frames_dir: str):
+        if record.pop('data', None) is not None:
+            record['data_path'] = os.path.join(frames_dir, record['source'])
+
+    @staticmethod
+    def frame_data(record: dict) -> str:
+        """The base64 JPEG of a frame record, read back from disk if it was spilled."""
+        if 'data' in record:
+            return record['data']
+        with open(record['data_path'], 'rb') as f:
+            return base64.b64encode(f.read()).decode("utf-8")
+
+    def _cut_frames(self, video, frame_dict: dict, start_timestamp: float, end_timestamp: float, seconds_per_frame: float,
+                    width: int = None, encode_workers: int = 0, encode_mode: str = 'thread', align: bool = False) -> int:
+        """Reads the frames for cut_frames from an open capture into frame_dict, returns the number saved."""
         fps = video.get(cv2.CAP_PROP_FPS)
         total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
         
         if fps == 0:
-            video.release()
             raise ValueError("Could not determine video FPS")
             
         # Convert timestamps to frame numbers
@@ -150,76 +246,188 @@ class Video:
         # Clamp frame numbers to valid range
         start_frame = max(0, start_frame)
         end_frame = min(total_frames - 1, end_frame)
+        if align:
+            # Stay on the absolute grid of multiples of frames_to_skip, whatever the start timestamp
+            frames_to_skip = max(1, frames_to_skip)
+            start_frame = -(-start_frame // frames_to_skip) * frames_to_skip
+
+        frames = self._seek_frames(video, start_frame, end_frame, frames_to_skip, width)
+        return self._save_frames(frames, frame_dict, "cut_", encode_workers, encode_mode)
+
+    @timed('cut_frames')
+    def cut_frames(self, start_timestamp: float, end_timestamp: float, seconds_per_frame: float = 1.,
+                   backend: str = 'opencv', width: int = None, encode_workers: int = 0,
+                   encode_mode: str = 'thread', align: bool = False) -> dict:
+        """
+        Extract frames from video between start_timestamp and end_timestamp.
         
-        # Create frames directory if it doesn't exist
+        :param start_timestamp: Start time in seconds
+        :param end_timestamp: End time in seconds  
+        :param seconds_per_frame: Time interval between extracted frames in seconds
+        :param backend: 'opencv' or 'ffmpeg' (see extract_frames)
+        :param width: Downscale frames to this width, keeping the aspect ratio
+        :param encode_workers: Encode on this many pool workers instead of inline (see extract_frames)
+        :param encode_mode: 'thread' or 'process' encode pool
+        :param align: Only sample frame numbers that are multiples of the frame step counted from frame 0, so
+            overlapping cuts return the same frames at any frame rate
+        :return: Dictionary of extracted frames with timestamps as keys
+        """
+        frame_dict = {}
         frames_dir = "data/frames"
-        os.makedirs(frames_dir, exist_ok=True)
-        
-        curr_frame = start_frame
-        frame_count = 0
-        
-        while curr_frame <= end_frame:
-            video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
-            success, frame = video.read()
-            if not success:
-                break
-                
-            _, buffer = cv2.imencode(".jpg", frame)
-            
-            # Calculate actual timestamp for this frame
-            frame_seconds = curr_frame / fps
-            frame_filename = f"{self.name}_cut_{frame_count:04d}_{frame_seconds:.2f}s.jpg"
-            
-            frame_filepath = os.path.join(frames_dir, frame_filename)
-            cv2.imwrite(frame_filepath, frame)
-            
-            frame_dict[frame_seconds] = {
-                'data': base64.b64encode(buffer).decode("utf-8"),
-                'source': frame_filename,
-                'source_type': 'frame'
-            }
-            
-            frame_count += 1
-            curr_frame += frames_to_skip
-            
-        video.release()
-        
+
+        if backend == 'ffmpeg':
+            decoder = FFmpegDecoder(self.filepath, width=width)
+            frame_count = self._save_frames(decoder.frames_between(start_timestamp, end_timestamp, seconds_per_frame, align),
+                                            frame_dict, "cut_", encode_workers, encode_mode)
+        elif backend == 'opencv':
+            with self.open_capture() as video:
+                frame_count = self._cut_frames(video, frame_dict, start_timestamp, end_timestamp, seconds_per_frame,
+                                               width, encode_workers, encode_mode, align)
+        else:
+            raise ValueError(f"Unknown decode backend: {backend}")
+
         print(f"Extracted {len(frame_dict)} frames between {start_timestamp}s and {end_timestamp}s")
         print(f"Saved {frame_count} frames to {frames_dir}")
         
         return frame_dict
 
-    def describe_frames(self, frames: dict, context: str = None, threads:int = 20) -> dict:
+    def iter_frames(self, seconds_per_frame: float = 1., start_timestamp: float = 0, end_timestamp: float = None):
+        """
+        Yields (seconds, frame) pairs in a single sequential decode pass, skipping frames with grab()
+        instead of seeking, so it can feed a streaming pipeline while the rest of the video is decoded.
+        """
+        video = cv2.VideoCapture(self.filepath)
+        fps = video.get(cv2.CAP_PROP_FPS)
+        if fps == 0:
+            video.release()
+            raise ValueError("Could not determine video FPS")
 
+        frames_to_skip = max(1, int(fps * seconds_per_frame))
+        curr_frame = max(0, int(start_timestamp * fps))
+        end_frame = None if end_timestamp is None else int(end_timestamp * fps)
+        if curr_frame:
+            video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
 
-        def describe_frame(args):
-            seconds, frame = args
+        try:
+            while end_frame is None or curr_frame <= end_frame:
+                success, frame = video.read()
+                if not success:
+                    break
+                yield curr_frame / fps, frame
+
+                skipped = 1
+                while skipped < frames_to_skip and video.grab():
+                    skipped += 1
+                curr_frame += frames_to_skip
+        finally:
+            video.release()
+
+    def follow_frames(self, seconds_per_frame: float = 1., start_timestamp: float = 0, poll_interval: float = 0.5,
+                      idle_timeout: float = 30., stop_event: threading.Event = None):
+        """
+        iter_frames for a recording that is still being written (e.g. ffmpeg writing .ts/.mkv) or a stream URL.
+        At the end of the available data the capture is reopened at the next sample and polled until new
+        frames show up; stops after idle_timeout seconds without new frames or once stop_event is set.
+        """
+        is_stream = '://' in self.filepath
+        next_seconds = start_timestamp
+        last_frame_time = time.time()
+        while not (stop_event and stop_event.is_set()):
+            video = cv2.VideoCapture(self.filepath)
             try:
-                print(f"Describing frame at {seconds} seconds...")
-                response = self.client.chat.completions.create(
-                    model="Llama-4-Maverick-17B-128E-Instruct-FP8",
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": [
-                                {
-                                    "type": "text",
-                                    "text": f"Provide a couple sentences describing what is in this image. {context if context else ''} ",
-                                },
-                                {
-                                    "type": "image_url",
-                                    "image_url": {
-                                        "url": f"data:image/jpeg;base64,{frame['data']}"
-                                    },
+                fps = video.get(cv2.CAP_PROP_FPS) if video.isOpened() else 0
+                if fps:
+                    frames_to_skip = max(1, int(fps * seconds_per_frame))
+                    curr_frame = int(round(next_seconds * fps))
+                    if curr_frame and not is_stream:
+                        video.set(cv2.CAP_PROP_POS_FRAMES, curr_frame)
+                    while not (stop_event and stop_event.is_set()):
+                        success, frame = video.read()
+                        if not success:
+                            break
+                        last_frame_time = time.time()
+                        yield curr_frame / fps, frame
+
+                        skipped = 1
+                        while skipped < frames_to_skip and video.grab():
+                            skipped += 1
+                        curr_frame += frames_to_skip
+                        next_seconds = curr_frame / fps
+            finally:
+                video.release()
+            if time.time() - last_frame_time > idle_timeout:
+                return
+            time.sleep(poll_interval)
+
+    def encode_frame(self, seconds: float, frame, frame_count: int = None, save: bool = False) -> dict:
+        """Encodes a decoded frame into the frame record used by describe_frames."""
+        _, buffer = cv2.imencode(".jpg", frame)
+        frame_filename = f"{self.name}_{frame_count if frame_count is not None else 0:04d}_{seconds:.2f}s.jpg"
+        if save:
+            frames_dir = "data/frames"
+            os.makedirs(frames_dir, exist_ok=True)
+            with open(os.path.join(frames_dir, frame_filename), "wb") as f:
+                f.write(buffer.tobytes())
+        return {
+            'data': base64.b64encode(buffer).decode("utf-8"),
+            'source': frame_filename,
+            'source_type': 'frame'
+        }
+
+    @llm_priority('describe')
+    def describe_frame(self, seconds: float, frame: dict, context: str = None, raise_errors: bool = False) -> str:
+        """
+        Describes a single encoded frame, returning the annotation text (or the error).
+        With raise_errors the error is raised instead, for callers that must not store it as an annotation.
+        """
+        try:
+            print(f"Describing frame at {seconds} seconds...")
+            response = self.client.chat.completions.create(
+                model="Llama-4-Maverick-17B-128E-Instruct-FP8",
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": f"Provide a couple sentences describing what is in this image. {context if context else ''} ",
+                            },
+                            {
+                                "type": "image_url",
+                                "image_url": {
+                                    "url": f"data:image/jpeg;base64,{self.frame_data(frame)}"
                                 },
-                            ],
-                        },
-                    ],
-                )
-                return seconds, response.completion_message.content.text
-            except Exception as e:
-                print(f"Error describing frame at {seconds} seconds: {e}")
-                return seconds, f"Error: {e}"
+                            },
+                        ],
+                    },
+                ],
+            )
+            return response.completion_message.content.text
+        except BudgetExceeded:
+            raise
+        except Exception as e:
+            print(f"Error describing frame at {seconds} seconds: {e}")
+            if raise_errors:
+                raise
+            return f"Error: {e}"
+
+    @timed('describe_frames')
+    def describe_frames(self, frames: dict, context: str = None, threads:int = 20) -> dict:
+        """
+        Describes the frames concurrently. When the client has a BudgetGovernor (utils.llama_api) that can't
+        afford every frame, only every step-th frame is described and returned.
+        """
+        governor = getattr(self.client, 'governor', None)
+        if governor is not None and frames:
+            step = governor.plan(len(frames), 'describe', images_per_request=1)
+            if step > 1:
+                keys = sorted(frames, key=float)[::step]
+                print(f"LLM budget is tight, describing every {step}th frame ({len(keys)} of {len(frames)})")
+                frames = {k: frames[k] for k in keys}
+
+        def describe_frame(args):
+            seconds, frame = args
+            return seconds, self.describe_frame(seconds, frame, context)
 
         with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
             results = list(executor.map(describe_frame, frames.items()))
@@ -230,16 +438,25 @@ class Video:
         return frames
 
 
+    @timed('extract_audio')
     def extract_audio(self, audio_filepath: str):
         """
         Extract audio from the video file and save it as a WAV file.
         
         :param output_audio: Path to save the extracted audio file.
         """
-        subprocess.run([
-            "ffmpeg", "-i", self.filepath, "-vn", "-acodec", "pcm_s16le",
+        self.extract_audio_async(audio_filepath).wait()
+
+    def extract_audio_async(self, audio_filepath: str) -> subprocess.Popen:
+        """
+        Start extracting the audio track with ffmpeg without waiting for it.
+        Returns the running process, call .wait() (or poll()) on it before reading the WAV file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(audio_filepath)), exist_ok=True)
+        return subprocess.Popen([
+            "ffmpeg", "-y", "-loglevel", "error", "-i", self.filepath, "-vn", "-acodec", "pcm_s16le",
             "-ar", "44100", "-ac", "1", audio_filepath
-        ])
+        ], stdin=subprocess.DEVNULL)
 
     def parse_foul_info(self, time_stamp, boundry_seconds=2):
         # client = LlamaAPIClient(
@@ -286,7 +503,7 @@ class Video:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{frames[k]['data']}"
+                                "url": f"data:image/jpeg;base64,{self.frame_data(frames[k])}"
                             },
                         },
                     ]